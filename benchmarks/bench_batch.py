@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+'''
+    namenode metadata operations per second with and without batching. a
+    namenode with a fresh namespace runs in this process; every round creates
+    a directory with `ops` files in it (mkdir, allocate and put per file) and
+    removes them again (rm per file, then rmdir). no block is written, the
+    allocations go to datanodes that are never contacted.
+
+    modes:
+      sequential  one call at a time, one request and edit log fsync each
+      concurrent  `tasks` callers, one request per call
+      coalesced   `tasks` callers, calls coalesced by MetadataBatcher
+      batch       the client builds the /batch requests itself
+
+    usage: python3 benchmarks/bench_batch.py [ops] [tasks]
+'''
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from edfs import EdfsClient, MAX_BATCH_OPS
+from src.servers.namenode import NameNode
+
+# configured but never started, so block reports fail right away
+DATANODES = [(f"datanode_{i}", "127.0.0.1", 1) for i in range(1, 5)]
+BLOCK_SIZE = 64*1024*1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_calls(client, calls, tasks):
+    '''
+        runs the (operation, request) pairs of calls on `tasks` tasks. a put
+        goes out right after its allocate, like in put_single_file
+    '''
+    queue = list(reversed(calls))
+
+    async def worker():
+        while queue:
+            op, request = queue.pop()
+            status, text = await client.metadata_call(op, request)
+            if status != 200:
+                raise RuntimeError(f"{op} failed: {text}")
+            if op == "allocate":
+                put_request = dict(request, allocation=json.loads(text))
+                status, text = await client.metadata_call("put", put_request)
+                if status != 200:
+                    raise RuntimeError(f"put failed: {text}")
+    await asyncio.gather(*[worker() for _ in range(tasks)])
+
+
+async def run_batches(client, calls):
+    for i in range(0, len(calls), MAX_BATCH_OPS):
+        chunk = calls[i:i + MAX_BATCH_OPS]
+        status, results = await client.batch(chunk)
+        puts = []
+        for (op, request), (op_status, text) in zip(chunk, results):
+            if op_status != 200:
+                raise RuntimeError(f"{op} failed: {text}")
+            if op == "allocate":
+                puts.append(("put", dict(request, allocation=json.loads(text))))
+        if puts:
+            status, results = await client.batch(puts)
+            if any(op_status != 200 for op_status, _ in results):
+                raise RuntimeError("put failed")
+
+
+async def round_trip(client, mode, directory, ops, tasks):
+    '''
+        returns the number of metadata operations done and the seconds taken
+    '''
+    files = [{"name": f"file_{i}", "size": 1024, "path": directory} for i in range(ops)]
+    phases = [[("mkdir", {"path": directory})],
+              [("allocate", f) for f in files],
+              [("rm", {"path": f"{directory}/{f['name']}"}) for f in files],
+              [("rmdir", {"path": directory})]]
+    start = time.perf_counter()
+    for calls in phases:
+        if mode == "batch":
+            await run_batches(client, calls)
+        else:
+            await run_calls(client, calls, 1 if mode == "sequential" else tasks)
+    # allocate and put are two operations per file
+    return 2 + 3 * ops, time.perf_counter() - start
+
+
+async def main(ops, tasks):
+    home = tempfile.mkdtemp(prefix="edfs_bench_")
+    os.mkdir(f"{home}/fsimage")
+    shutil.copy(f"{homepath}/fsimage/fsimage.xml", f"{home}/fsimage/fsimage.xml")
+    port = free_port()
+    namenode = NameNode("127.0.0.1", port, BLOCK_SIZE, 3, {"nodes": DATANODES}, home)
+    namenode.initialize()
+    runner = web.AppRunner(namenode.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    while namenode.safe_mode:
+        await asyncio.sleep(0.05)
+    logging.disable(logging.CRITICAL)
+
+    print(f'{ops} files per round, {tasks} tasks')
+    print(f'{"mode":<12}{"ops/s":>10}{"requests":>10}')
+    try:
+        for mode in ("sequential", "concurrent", "coalesced", "batch"):
+            client = EdfsClient(batch_metadata=(mode == "coalesced"))
+            client.namenode_info = ("127.0.0.1", port)
+            await client.initialize()
+            try:
+                done, seconds = await round_trip(client, mode, f"/bench_{mode}", ops, tasks)
+            finally:
+                await client.close()
+            if client.metadata_batcher:
+                requests = client.metadata_batcher.requests
+            elif mode == "batch":
+                requests = 2 + 3 * -(-ops // MAX_BATCH_OPS)
+            else:
+                requests = done
+            print(f'{mode:<12}{done / seconds:>10.0f}{requests:>10}')
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(home)
+
+
+if __name__ == "__main__":
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    tasks = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    asyncio.run(main(ops, tasks))
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+'''
+    block compression: ratio, CPU cost and effective put/get throughput of
+    every registered codec on csv, json and random data. effective throughput
+    assumes compression (in `workers` threads, like the client's in-flight
+    blocks) overlaps the transfer of the smaller stored block over a link of
+    the given bandwidth, so it is bounded by whichever of the two is slower.
+
+    usage: python3 benchmarks/bench_codec.py [block MB] [link MB/s ...]
+'''
+import json
+import os
+import random
+import sys
+import time
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from edfs import MAX_INFLIGHT_BLOCKS
+from src.servers.codec import CODECS
+
+
+def csv_data(size):
+    lines, total = [], 0
+    while total < size:
+        line = (f'{total},2026-10-{random.randint(1, 28):02d},user{random.randint(0, 999)},'
+                f'{random.choice(["GET", "PUT", "DELETE"])},/api/v1/item/{random.randint(0, 99999)},'
+                f'{random.randint(100, 599)}\n')
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode()[:size]
+
+
+def json_data(size):
+    lines, total = [], 0
+    while total < size:
+        line = json.dumps({"ts": time.time() + total, "level": random.choice(["INFO", "WARN", "ERROR"]),
+                           "host": f"node-{random.randint(0, 63)}", "latency_ms": random.random() * 100,
+                           "msg": "request served"}) + '\n'
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines).encode()[:size]
+
+
+def measure(codec, data):
+    start = time.process_time()
+    compressed = codec.compress(data)
+    compress_time = time.process_time() - start
+    start = time.process_time()
+    codec.decompress(compressed)
+    decompress_time = time.process_time() - start
+    return len(compressed), compress_time, decompress_time
+
+
+if __name__ == "__main__":
+    block_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    links = [float(x) for x in sys.argv[2:]] or [100.0, 1000.0]
+    size = block_mb * 1024 * 1024
+    samples = {"csv": csv_data(size), "json": json_data(size), "random": os.urandom(size)}
+    workers = min(MAX_INFLIGHT_BLOCKS, os.cpu_count() or 1)
+    link_columns = ''.join(f'{f"put@{link:g}":>10}{f"get@{link:g}":>10}' for link in links)
+    print(f'{block_mb} MB blocks, {workers} compression workers, throughput in MB/s of file data')
+    print(f'{"data":<7}{"codec":<10}{"ratio":>7}{"comp MB/s":>11}{"dec MB/s":>10}{"CPU s/GB":>10}{link_columns}')
+    for sample_name, data in samples.items():
+        for codec_name, codec in CODECS.items():
+            stored, compress_time, decompress_time = measure(codec, data)
+            ratio = len(data) / stored
+            compress_speed = block_mb / max(compress_time, 1e-9)
+            decompress_speed = block_mb / max(decompress_time, 1e-9)
+            cpu_per_gb = (compress_time + decompress_time) * 1024 / block_mb
+            columns = ''
+            for link in links:
+                put = min(compress_speed * workers, link * ratio)
+                get = min(decompress_speed * workers, link * ratio)
+                columns += f'{put:>10.0f}{get:>10.0f}'
+            print(f'{sample_name:<7}{codec_name:<10}{ratio:>7.2f}{compress_speed:>11.0f}'
+                  f'{decompress_speed:>10.0f}{cpu_per_gb:>10.1f}{columns}')
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+'''
+    compares DataNode block serving paths under concurrent readers:
+    sendfile (whole block reads) against chunked streaming (offset/length reads).
+    reports throughput and the peak RSS of the datanode process.
+
+    usage: python3 benchmarks/bench_datanode_read.py [readers] [reads per reader] [block MB]
+'''
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Process
+
+import aiohttp
+from aiohttp import web
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from src.servers.datanode import DataNode
+
+HOSTNAME = '127.0.0.1'
+PORT = 10901
+BLOCK_ID = 1
+
+
+def run_server(storage_path):
+    dn = DataNode('bench_datanode', HOSTNAME, PORT, storage_path, storage_path)
+    web.run_app(dn.make_app(), host=HOSTNAME, port=PORT, print=None)
+
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+async def run_readers(pid, params, readers, reads_per_reader):
+    peak_rss = rss_kb(pid)
+    done = False
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not done:
+            peak_rss = max(peak_rss, rss_kb(pid))
+            await asyncio.sleep(0.01)
+
+    async def reader(session):
+        received = 0
+        for _ in range(reads_per_reader):
+            async with session.get('/read', params=params) as resp:
+                async for chunk in resp.content.iter_chunked(1024*1024):
+                    received += len(chunk)
+        return received
+
+    connector = aiohttp.TCPConnector(limit=readers)
+    async with aiohttp.ClientSession(f'http://{HOSTNAME}:{PORT}', connector=connector) as session:
+        sampler = asyncio.create_task(sample_rss())
+        start = time.perf_counter()
+        received = sum(await asyncio.gather(*[reader(session) for _ in range(readers)]))
+        elapsed = time.perf_counter() - start
+        done = True
+        await sampler
+    return received / elapsed / (1024*1024), peak_rss / 1024
+
+
+async def main(readers, reads_per_reader, block_mb):
+    with tempfile.TemporaryDirectory() as storage_path:
+        os.makedirs(f'{storage_path}/logs')
+        os.makedirs(f'{storage_path}/bench_datanode')
+        with open(f'{storage_path}/bench_datanode/{BLOCK_ID}-r0', 'wb') as block_writer:
+            block_writer.write(os.urandom(block_mb * 1024*1024))
+        server = Process(target=run_server, args=(storage_path,))
+        server.start()
+        try:
+            await asyncio.sleep(1)
+            print(f'{readers} readers x {reads_per_reader} reads of a {block_mb} MB block')
+            print(f'{"mode":<10}{"MB/s":>10}{"peak RSS MB":>14}')
+            modes = [('sendfile', {'id': BLOCK_ID}),
+                     ('chunked', {'id': BLOCK_ID, 'offset': 0})]
+            for mode, params in modes:
+                throughput, peak_rss = await run_readers(server.pid, params, readers, reads_per_reader)
+                print(f'{mode:<10}{throughput:>10.1f}{peak_rss:>14.1f}')
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == '__main__':
+    args = [int(x) for x in sys.argv[1:]]
+    readers, reads_per_reader, block_mb = args + [32, 4, 64][len(args):]
+    asyncio.run(main(readers, reads_per_reader, block_mb))
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+'''
+    erasure coding: encode and decode throughput of every registered policy,
+    and the storage it needs against replication. a block is encoded into its
+    units, then rebuilt with one lost data unit and with as many lost data
+    units as the policy has parity units (the worst degraded read). a read
+    with no lost unit does not decode at all, the data units are the block.
+
+    usage: python3 benchmarks/bench_erasure.py [block MB] [replication]
+'''
+import os
+import sys
+import time
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from src.servers.erasure import POLICIES
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    block_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    replication = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    data = os.urandom(block_mb * 1024 * 1024)
+    print(f'{block_mb} MB block, throughput in MB/s of block data')
+    print(f'{"policy":<10}{"units":>7}{"overhead":>10}{"vs " + str(replication) + "x":>8}'
+          f'{"enc MB/s":>10}{"dec-1 MB/s":>12}{"dec-max MB/s":>14}')
+    print(f'{"replicated":<10}{replication:>7}{replication:>10.2f}{1:>8.2f}{"-":>10}{"-":>12}{"-":>14}')
+    for name, policy in POLICIES.items():
+        units, encode_time = timed(policy.encode, data)
+        speeds = []
+        for lost in (1, policy.parity_units):
+            available = {i: unit for i, unit in enumerate(units) if i >= lost}
+            rebuilt, decode_time = timed(policy.decode, available, len(data))
+            if rebuilt != data:
+                raise RuntimeError(f"{name} rebuilt a different block")
+            speeds.append(block_mb / decode_time)
+        print(f'{name:<10}{policy.width:>7}{policy.overhead():>10.2f}{policy.overhead() / replication:>8.2f}'
+              f'{block_mb / encode_time:>10.0f}{speeds[0]:>12.0f}{speeds[1]:>14.0f}')
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+'''
+    fsimage load/save time and peak RSS, xml against the binary format, for 
+    namespaces of 1M and 10M inodes (1000 single-block files per directory).
+    every measurement runs in a fresh process so peak RSS is not shared.
+
+    usage: python3 benchmarks/bench_fsimage.py [inodes ...] [--binary-only]
+'''
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from src.FSTree.FSTree import FSTree, Inode
+
+FILES_PER_DIRECTORY = 1000
+
+
+def rss_mb(field):
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def build_tree(inodes):
+    tree = FSTree()
+    tree.initialize(1, 1, 0)
+    root = Inode("", "DIRECTORY")
+    root.set_id(0)
+    tree.set_root(root)
+    directory = None
+    for i in range(inodes - 1):
+        if i % (FILES_PER_DIRECTORY + 1) == 0:
+            directory = Inode(f"dir_{i}", "DIRECTORY")
+            tree.insert(directory, [])
+            continue
+        new_file = Inode(f"file_{i}", "FILE")
+        new_file.blocks = [(tree.currBlockID, 1024)]
+        new_file.set_replication(3)
+        tree.currBlockID += 1
+        tree.insert(new_file, [directory.node_name])
+    return tree
+
+
+def save(fmt, inodes, path, results):
+    tree = build_tree(inodes)
+    rss_before = rss_mb('VmRSS:')
+    start = time.perf_counter()
+    if fmt == 'xml':
+        tree.save_fs_to_fsimage(path)
+    else:
+        tree.save_fs_to_binary_fsimage(path)
+    results.put((time.perf_counter() - start, rss_mb('VmHWM:') - rss_before))
+
+
+def load(fmt, inodes, path, results):
+    rss_before = rss_mb('VmRSS:')
+    start = time.perf_counter()
+    tree = FSTree()
+    if fmt == 'xml':
+        tree.load_xml(path)
+    else:
+        tree.load_binary(path)
+    results.put((time.perf_counter() - start, rss_mb('VmHWM:') - rss_before))
+
+
+def measure(target, *args):
+    results = Queue()
+    p = Process(target=target, args=(*args, results))
+    p.start()
+    result = results.get()
+    p.join()
+    return result
+
+
+if __name__ == "__main__":
+    formats = ['binary'] if '--binary-only' in sys.argv else ['xml', 'binary']
+    sizes = [int(x) for x in sys.argv[1:] if x != '--binary-only'] or [1_000_000, 10_000_000]
+    print(f'{"inodes":>10} {"format":<8}{"save s":>9}{"save MB":>10}{"load s":>9}{"load MB":>10}{"file MB":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for inodes in sizes:
+            for fmt in formats:
+                path = f'{tmp}/fsimage.{fmt}'
+                save_time, save_rss = measure(save, fmt, inodes, path)
+                load_time, load_rss = measure(load, fmt, inodes, path)
+                size = os.path.getsize(path) / (1024*1024)
+                print(f'{inodes:>10} {fmt:<8}{save_time:>9.2f}{save_rss:>10.0f}{load_time:>9.2f}{load_rss:>10.0f}{size:>10.1f}')
+                os.remove(path)
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+'''
+    FSTree metadata microbenchmark: create, lookup and delete ops/sec in a 
+    single flat directory of 10k, 100k and 1M entries.
+
+    usage: python3 benchmarks/bench_fstree.py [entries ...]
+'''
+import os
+import sys
+import time
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from src.FSTree.FSTree import FSTree, Inode
+
+
+def new_tree():
+    tree = FSTree()
+    tree.initialize(1, 1, 0)
+    root = Inode("", "DIRECTORY")
+    root.set_id(0)
+    tree.set_root(root)
+    tree.insert(Inode("flat", "DIRECTORY"), [])
+    return tree
+
+
+def ops_per_sec(op, names):
+    start = time.perf_counter()
+    for name in names:
+        op(name)
+    return len(names) / (time.perf_counter() - start)
+
+
+def bench(entries):
+    tree = new_tree()
+    names = [f"file_{i}" for i in range(entries)]
+    create = ops_per_sec(lambda name: tree.insert(Inode(name, "FILE"), ["flat"]), names)
+    lookup = ops_per_sec(lambda name: tree.find(["flat", name]), names)
+    delete = ops_per_sec(lambda name: tree.remove(["flat", name]), names)
+    return create, lookup, delete
+
+
+if __name__ == "__main__":
+    sizes = [int(x) for x in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f'{"entries":>10}{"create/s":>14}{"lookup/s":>14}{"delete/s":>14}')
+    for entries in sizes:
+        create, lookup, delete = bench(entries)
+        print(f'{entries:>10}{create:>14.0f}{lookup:>14.0f}{delete:>14.0f}')
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+'''
+    namenode memory per file (namespace + block_mapping) and datanode block
+    file count for small files stored one block each against packed into
+    container blocks, measured with tracemalloc on the real FSTree.
+
+    usage: python3 benchmarks/bench_packing.py [files] [file KB] [replication]
+'''
+import os
+import sys
+import tracemalloc
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from edfs import PACK_CONTAINER_SIZE
+from src.FSTree.FSTree import FSTree, Inode
+
+FILES_PER_DIRECTORY = 1000
+DATANODES = ["datanode_1", "datanode_2", "datanode_3", "datanode_4"]
+
+
+def build(files, file_size, replication, packed):
+    tree = FSTree()
+    tree.initialize(1, 1, 0)
+    root = Inode("", "DIRECTORY")
+    root.set_id(0)
+    tree.set_root(root)
+    tree.currBlockID = 0
+    block_mapping = {}
+    directory, container_fill = None, PACK_CONTAINER_SIZE
+    for i in range(files):
+        if i % FILES_PER_DIRECTORY == 0:
+            directory = Inode(f"dir_{i}", "DIRECTORY")
+            tree.insert(directory, [])
+        new_file = Inode(f"file_{i}.json", "FILE")
+        new_file.set_replication(replication)
+        if packed:
+            if container_fill + file_size > PACK_CONTAINER_SIZE:
+                tree.currBlockID += 1
+                container_fill = 0
+                block_mapping[tree.currBlockID] = DATANODES[:replication]
+            new_file.set_blocks([(tree.currBlockID, file_size)])
+            new_file.set_block_offset(container_fill)
+            container_fill += file_size
+        else:
+            tree.currBlockID += 1
+            new_file.set_blocks([(tree.currBlockID, file_size)])
+            block_mapping[tree.currBlockID] = DATANODES[:replication]
+        tree.insert(new_file, [directory.node_name])
+    return tree, block_mapping
+
+
+if __name__ == "__main__":
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    file_size = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 4096
+    replication = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    print(f'{files} files of {file_size // 1024} KB, replication {replication}')
+    print(f'{"layout":<10}{"namenode MB":>13}{"bytes/file":>12}{"blocks":>10}{"block files/datanode":>22}')
+    for packed in (False, True):
+        tracemalloc.start()
+        tree, block_mapping = build(files, file_size, replication, packed)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # every replica is a block file plus its .crc checksum file
+        block_files = len(block_mapping) * replication * 2 / len(DATANODES)
+        print(f'{"packed" if packed else "unpacked":<10}{used / (1024*1024):>13.0f}{used / files:>12.0f}'
+              f'{len(block_mapping):>10}{block_files:>22.0f}')
+        del tree, block_mapping
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+'''
+    simulates block writes on a skewed cluster (nearly full nodes, slow nodes) 
+    and compares the old random placement against the heartbeat driven, 
+    load-aware place_replicas. reports write throughput and how evenly the 
+    written bytes spread relative to each node's bandwidth.
+
+    usage: python3 benchmarks/bench_placement.py [blocks] [concurrent writers]
+'''
+import os
+import random
+import statistics
+import sys
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from src.servers.namenode import place_replicas
+
+BLOCK_MB = 64
+REPLICATION = 3
+TICK = 0.05
+HEARTBEAT_INTERVAL = 3
+
+# (free MB, bandwidth MB/s)
+CLUSTER = [(200_000, 100)] * 5 + [(200_000, 20)] * 3 + [(1_000, 100)] * 2
+
+
+def random_placement(nodes, stats, now):
+    datanodes = list(nodes)
+    random.shuffle(datanodes)
+    return datanodes[:REPLICATION]
+
+
+def load_aware_placement(nodes, stats, now):
+    return place_replicas(stats, REPLICATION, BLOCK_MB, now)
+
+
+def simulate(place, blocks, writers):
+    random.seed(551)
+    nodes = {f"dn{i}": {"free": free, "bandwidth": bw, "active": 0, "written": 0, "failed": 0}
+             for i, (free, bw) in enumerate(CLUSTER)}
+    stats = {}
+    def heartbeat(now):
+        for datanode_id, node in nodes.items():
+            stats[datanode_id] = {"free": node["free"], "active_transfers": node["active"],
+                                  "scheduled_blocks": 0, "last_heartbeat": now}
+
+    now, started, done, failed = 0.0, 0, 0, 0
+    heartbeat(now)
+    next_heartbeat = HEARTBEAT_INTERVAL
+    inflight = []   # [remaining MB, [datanode ids]]
+    while done + failed < blocks:
+        while len(inflight) < writers and started < blocks:
+            targets = place(nodes, stats, now)
+            started += 1
+            if any(nodes[t]["free"] < BLOCK_MB for t in targets) or not targets:
+                failed += 1
+                continue
+            for t in targets:
+                nodes[t]["active"] += 1
+                nodes[t]["free"] -= BLOCK_MB
+            inflight.append([BLOCK_MB, targets])
+        # a pipelined block moves at the pace of its slowest replica
+        for write in inflight:
+            rate = min(nodes[t]["bandwidth"] / nodes[t]["active"] for t in write[1])
+            write[0] -= rate * TICK
+        for write in [w for w in inflight if w[0] <= 0]:
+            inflight.remove(write)
+            done += 1
+            for t in write[1]:
+                nodes[t]["active"] -= 1
+                nodes[t]["written"] += BLOCK_MB
+                # the client's /put tells the namenode the block landed
+                if stats[t]["scheduled_blocks"] > 0:
+                    stats[t]["scheduled_blocks"] -= 1
+                elif stats[t]["active_transfers"] > 0:
+                    stats[t]["active_transfers"] -= 1
+        now += TICK
+        if now >= next_heartbeat:
+            heartbeat(now)
+            next_heartbeat += HEARTBEAT_INTERVAL
+    # written bytes per unit of bandwidth, 1.0 everywhere is a perfectly even spread
+    total_bw = sum(n["bandwidth"] for n in nodes.values())
+    total_written = sum(n["written"] for n in nodes.values()) or 1
+    shares = [(n["written"] / total_written) / (n["bandwidth"] / total_bw) for n in nodes.values()]
+    return done * BLOCK_MB / now, statistics.pstdev(shares), failed
+
+
+if __name__ == "__main__":
+    args = [int(x) for x in sys.argv[1:]]
+    blocks, writers = args + [2000, 16][len(args):]
+    print(f"{blocks} blocks of {BLOCK_MB} MB, {writers} writers, replication {REPLICATION}")
+    print(f'{"placement":<12}{"MB/s":>10}{"spread stdev":>14}{"failed":>8}')
+    for name, place in [("random", random_placement), ("load-aware", load_aware_placement)]:
+        throughput, spread, failed = simulate(place, blocks, writers)
+        print(f'{name:<12}{throughput:>10.1f}{spread:>14.2f}{failed:>8}')
@@ -1,2 +1,9 @@
 class Config:
-    MAX_CONTENT_LENGTH = 1000 * 1024 * 1024
\ No newline at end of file
+    # quart applies this to every body, also a streamed one, so the web-ui checks MAX_BODY_LENGTH itself
+    MAX_CONTENT_LENGTH = None
+    # limit of request bodies held in memory, e.g. form uploads. /upload_stream bodies are
+    # streamed and only limited by their Content-Length
+    MAX_BODY_LENGTH = 16 * 1024 * 1024
+    # directory of an on-disk block cache for the web-ui's reads, None to read from the datanodes only
+    BLOCK_CACHE_DIR = None
+    BLOCK_CACHE_SIZE = 1024 * 1024 * 1024
\ No newline at end of file
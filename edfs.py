@@ -1,16 +1,68 @@
 #!/usr/bin/python3
 import asyncio
 import argparse
+import inspect
 import aiohttp
 import os
+import sys
+import time
 import json
-import base64
 from urllib.parse import quote_plus as urlencode
 import xml.etree.ElementTree as ET
-from io import BytesIO
+from functools import partial
+from collections import deque, OrderedDict
 import logging
+import lzma
+import mmap
+import fcntl
+import zlib
+from src.servers.checksum import ChunkChecksums
+from src.servers.codec import CODECS, DEFAULT_CODEC, get_codec
+from src.servers.erasure import POLICIES, REPLICATED, get_policy
 
 FROM_SHELL = False
+# size of the pieces a block is streamed to the datanodes in
+TRANSFER_CHUNK_SIZE = 1024*1024
+# default number of blocks put_single_file uploads at the same time
+MAX_INFLIGHT_BLOCKS = 4
+# files up to this size are packed into shared container blocks by -putpacked
+PACK_FILE_THRESHOLD = 1024*1024
+# a container block is written once this many bytes of small files are buffered
+PACK_CONTAINER_SIZE = 32*1024*1024
+# files a recursive -put or -get transfers at the same time by default
+MAX_CONCURRENT_FILES = 8
+# seconds between progress lines of a recursive -put or -get
+PROGRESS_INTERVAL = 1
+# a download is written to local_path + PARTIAL_SUFFIX and renamed once complete
+PARTIAL_SUFFIX = ".edfs-part"
+# block lists of at most this many files (or file ranges) are cached by a client
+LOCATION_CACHE_ENTRIES = 1024
+# seconds a cached block list is used before asking the namenode again
+LOCATION_CACHE_TTL = 30
+# default byte budget of an on-disk block cache
+BLOCK_CACHE_SIZE = 1024*1024*1024
+# an over budget block cache is evicted down to this fraction of its budget
+BLOCK_CACHE_EVICT_TO = 0.9
+# seconds after which a partly written block cache file is considered abandoned
+BLOCK_CACHE_STALE_TMP_AGE = 3600
+# files smaller than this are left replicated by -ecconvert, their units would be tiny
+EC_MIN_FILE_SIZE = 1024*1024
+# seconds a file must not have been read for before -ecconvert converts it by default
+EC_CONVERT_IDLE = 7*24*3600
+# seconds between two lease renewals of an open EdfsWriter, well within the namenode's expiry
+LEASE_RENEW_INTERVAL = 20
+# entries asked for per page when a client lists a directory
+LS_PAGE_SIZE = 1000
+# metadata calls sent to the namenode in one /batch request at most
+MAX_BATCH_OPS = 500
+# {metadata operation: (method, namenode route)} of the calls MetadataBatcher coalesces
+METADATA_ROUTES = {
+    "mkdir": ("PUT", "/mkdir"),
+    "rm": ("DELETE", "/rm"),
+    "rmdir": ("DELETE", "/rmdir"),
+    "allocate": ("PUT", "/allocate"),
+    "put": ("PUT", "/put")
+}
 
 def get_config(homepath):
     def get_namenode_info(xmlnode):
@@ -29,10 +81,643 @@ def get_config(homepath):
     }
     return namenode_info, datanodes_info
 
+async def read_file_chunks(path, offset, length):
+    '''
+        yields the bytes [offset, offset+length) of a local file in 
+        TRANSFER_CHUNK_SIZE pieces, so a block never has to be held in memory
+    '''
+    with open(path, 'rb') as reader:
+        reader.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = reader.read(min(remaining, TRANSFER_CHUNK_SIZE))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def read_file_range(path, offset, length):
+    with open(path, 'rb') as reader:
+        reader.seek(offset)
+        return reader.read(length)
+
+def is_compressed(block):
+    return block.get("codec", DEFAULT_CODEC) != DEFAULT_CODEC
+
+def block_read_params(block):
+    read_params = {"id": block["block_id"]}
+    if is_compressed(block):
+        # compressed blocks are always read whole and cut after decompressing
+        return read_params
+    offset = block.get("offset", 0)
+    length = block.get("length", block["num_bytes"])
+    if block.get("packed") or offset != 0 or length != block["num_bytes"]:
+        read_params["offset"] = offset
+        read_params["length"] = length
+    return read_params
+
+def block_cache_key(block):
+    '''
+        a block read as a whole is cached under its id, a range of it (e.g. 
+        a packed file) under its id and the range
+    '''
+    read_params = block_read_params(block)
+    if "offset" in read_params:
+        return f"{block['block_id']}_{read_params['offset']}_{read_params['length']}"
+    return str(block["block_id"])
+
+def decode_block(block, content):
+    '''
+        returns the requested range of a block from the bytes stored on the 
+        datanode, decompressing them first if the file is compressed
+    '''
+    if not is_compressed(block):
+        return content
+    raw = get_codec(block["codec"]).decompress(content)
+    offset = block.get("offset", 0)
+    return raw[offset:offset + block.get("length", len(raw))]
+
+def unit_block(block, index, unit_size, offset=0, length=None):
+    '''
+        the block of one unit of an erasure coded block group, read like any 
+        uncompressed block
+    '''
+    unit = block["units"][index]
+    return {"block_id": unit["block_id"], "num_bytes": unit_size, "block_mapping": unit["block_mapping"],
+            "offset": offset, "length": unit_size - offset if length == None else length}
+
+def join_edfs_path(*parts):
+    return '/' + '/'.join(part.strip('/') for part in parts if part.strip('/'))
+
+def split_edfs_path(path):
+    '''
+        (directory, name) of a file path
+    '''
+    directory, _, name = path.rstrip('/').rpartition('/')
+    return directory or '/', name
+
+class EdfsClientError(Exception):
+    def __init__(self, message, errors = 400):
+        super().__init__(message)
+        self.error_code = errors
+
+
+class PackedWriter:
+    '''
+        batches small files into container blocks: every container is written 
+        through one datanode pipeline and registered with a single /put_packed, 
+        so the files share one block id, one replica file per datanode and one 
+        block_mapping entry
+    '''
+    def __init__(self, client, container_size=PACK_CONTAINER_SIZE):
+        self.client = client
+        self.container_size = min(container_size, client.block_size)
+        self.buffer = []
+        self.files = []
+        self.buffered = 0
+        self.stored = 0
+        self.errors = []
+
+    async def add(self, dest_path, name, data):
+        if self.buffered + len(data) > self.container_size:
+            await self.flush()
+        self.files.append({"name": name, "path": dest_path, 
+                           "offset": self.buffered, "length": len(data)})
+        self.buffer.append(data)
+        self.buffered += len(data)
+
+    async def flush(self):
+        if not self.files:
+            return
+        content, files = b"".join(self.buffer), self.files
+        self.buffer, self.files, self.buffered = [], [], 0
+        namenode_session = self.client.namenode_session
+        async with namenode_session.put('/allocate_container', json={"size": len(content)}) as a_resp:
+            if a_resp.status != 200:
+                self.errors.append(await a_resp.text())
+                return
+            container = json.loads(await a_resp.text())
+        status, text = await self.client.write_block(container, lambda: content)
+        if status != 200:
+            self.errors.append(text)
+            return
+        put_request = {"block_id": container["block_id"], 
+                       "datanode_id": container["datanode_id"], 
+                       "files": files}
+        async with namenode_session.put('/put_packed', json=put_request) as p_resp:
+            if p_resp.status != 200:
+                self.errors.append(await p_resp.text())
+                return
+            result = json.loads(await p_resp.text())
+        self.stored += result["stored"]
+        for packed_file in files:
+            self.client.location_cache.invalidate(join_edfs_path(packed_file["path"], packed_file["name"]))
+        self.errors += [f"{e['path']}/{e['name']}: {e['error']}" for e in result["errors"]]
+
+    async def close(self):
+        await self.flush()
+        if self.errors:
+            return 400, '\n'.join(self.errors)
+        return 200, f"Successfully put {self.stored} files"
+
+
+class EdfsWriter:
+    '''
+        handle of a file under construction, from EdfsClient.create or 
+        EdfsClient.append. written bytes are cut into blocks; every full block 
+        is allocated with /add_block and uploaded while the next one fills, up 
+        to max_inflight_blocks at a time, so the size of the stream never needs 
+        to be known. the blocks show up in the file once close commits them. 
+        the lease is renewed in the background until then; if the writer is 
+        never closed, the namenode keeps the blocks written before its lease 
+        expired
+    '''
+    def __init__(self, client, path, lease):
+        self.client = client
+        self.path = path
+        self.lease_id = lease["lease_id"]
+        self.block_size = lease["full_block_size"]
+        self.block_codec = get_codec(lease["codec"])
+        self.policy = get_policy(lease["ec_policy"]) if "ec_policy" in lease else None
+        self.buffer = bytearray()
+        self.uploads = []
+        # blocks written since the last request to the namenode
+        self.written = []
+        # (status, text) of the first failed upload or renewal, nothing is written after it
+        self.error = None
+        self.inflight = asyncio.Semaphore(client.max_inflight_blocks)
+        self.renew_task = asyncio.create_task(self.renew_forever())
+
+    async def lease_call(self, route, request):
+        request = dict(request, lease_id=self.lease_id)
+        async with self.client.namenode_session.put(route, json=request) as resp:
+            return resp.status, await resp.text()
+
+    async def renew_forever(self):
+        while True:
+            await asyncio.sleep(LEASE_RENEW_INTERVAL)
+            try:
+                status, text = await self.lease_call('/renew_lease', {})
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"renewing the lease on {self.path} failed: {e!r}")
+                continue
+            if status != 200:
+                self.error = self.error or (status, text)
+                return
+
+    def check(self):
+        if self.error:
+            raise EdfsClientError(self.error[1], self.error[0])
+
+    async def write(self, data):
+        '''
+            buffers data and uploads the blocks it fills. raises 
+            EdfsClientError once an upload failed or the lease was lost
+        '''
+        self.check()
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            content = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            await self.add_block(content)
+
+    async def add_block(self, content):
+        # allocated one after the other, so the blocks keep the order of the stream
+        await self.inflight.acquire()
+        written, self.written = self.written, []
+        try:
+            status, text = await self.lease_call('/add_block', {"size": len(content), "written": written})
+            if status != 200:
+                raise EdfsClientError(text, status)
+        except BaseException:
+            self.written = written + self.written
+            self.inflight.release()
+            raise
+        self.uploads.append(asyncio.create_task(self.upload(json.loads(text), content)))
+
+    async def upload(self, block, content):
+        try:
+            status, text = await self.client.store_block(block, lambda: content, self.block_codec, self.policy)
+        finally:
+            self.inflight.release()
+        if status != 200:
+            self.error = self.error or (status, text)
+        else:
+            self.written.append(block)
+
+    async def close(self):
+        '''
+            uploads the rest of the buffer, commits the blocks to the file and 
+            gives up the lease
+            return: status, text
+        '''
+        try:
+            self.check()
+            if self.buffer:
+                content = bytes(self.buffer)
+                self.buffer.clear()
+                await self.add_block(content)
+            await asyncio.gather(*self.uploads)
+            self.check()
+            status, text = await self.lease_call('/complete', {"written": self.written})
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        finally:
+            self.abort()
+        self.client.location_cache.invalidate(self.path)
+        return status, text
+
+    def abort(self):
+        '''
+            stops the writer without committing, the file is recovered by the 
+            namenode once the lease expires
+        '''
+        self.renew_task.cancel()
+        for task in self.uploads:
+            task.cancel()
+
+
+class BlockCache:
+    '''
+        opt-in on-disk LRU cache of block contents, shared by every client 
+        process pointed at the same directory. block ids are never reused, so 
+        a cached block never goes stale. each block is a file written under a 
+        temporary name and renamed into place, its mtime is refreshed on every 
+        hit and serves as the LRU order, and eviction runs under an exclusive 
+        flock so processes do not evict over each other
+    '''
+    def __init__(self, directory, capacity=BLOCK_CACHE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.capacity = capacity
+        self.lock_path = os.path.join(directory, '.lock')
+        # bytes cached by all processes, as of the last scan plus what this process added since
+        self.size = sum(size for _, size, _ in self.scan())
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.evictions = 0
+        if self.size > self.capacity:
+            self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.blk")
+
+    def get(self, key):
+        '''
+            returns a read-only mmap of a cached block, or None
+        '''
+        try:
+            with open(self.path(key), 'rb') as reader:
+                if os.fstat(reader.fileno()).st_size == 0:
+                    content = b""
+                else:
+                    content = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            # evicted by another process after it was mapped, the mapping stays valid
+            pass
+        self.hits += 1
+        self.hit_bytes += len(content)
+        return content
+
+    def writer(self, key):
+        return BlockCacheWriter(self, key)
+
+    def put(self, key, content):
+        writer = self.writer(key)
+        writer.write(content)
+        writer.commit()
+
+    def added(self, nbytes):
+        self.size += nbytes
+        if self.size > self.capacity:
+            self.evict()
+
+    def scan(self):
+        '''
+            returns (mtime, size, path) of every cached block, and removes 
+            temporary files left behind by crashed writers
+        '''
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith('.blk'):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                elif entry.name.endswith('.tmp') and now - stat.st_mtime > BLOCK_CACHE_STALE_TMP_AGE:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self):
+        '''
+            removes the least recently used blocks until the cache is at 
+            BLOCK_CACHE_EVICT_TO of its capacity
+        '''
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self.scan())
+            self.size = sum(size for _, size, _ in entries)
+            target = self.capacity * BLOCK_CACHE_EVICT_TO
+            for _, size, path in entries:
+                if self.size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self.size -= size
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"bytes": self.size, "capacity": self.capacity, "hits": self.hits, 
+                "misses": self.misses, "hit_bytes": self.hit_bytes, "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+
+class BlockCacheWriter:
+    '''
+        writes a block into the cache piece by piece, it becomes visible to 
+        readers only on commit
+    '''
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.temp_path = f"{cache.path(key)}.{os.getpid()}.{id(self)}.tmp"
+        self.file = open(self.temp_path, 'wb')
+        self.size = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self.file.close()
+        if self.size > self.cache.capacity:
+            os.remove(self.temp_path)
+            return
+        os.replace(self.temp_path, self.cache.path(self.key))
+        self.cache.added(self.size)
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+class BlockLocationCache:
+    '''
+        LRU cache of the block lists the namenode returns for /get, keyed by 
+        (path, offset, length), so repeated reads of a file skip the namenode. 
+        other clients may change a file, so entries expire after ttl seconds; 
+        at most max_entries are kept
+    '''
+    def __init__(self, max_entries=LOCATION_CACHE_ENTRIES, ttl=LOCATION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # {(path, offset, length): (expiry time, block list)}, least recently used first
+        self.entries = OrderedDict()
+        # {path: keys of its entries}
+        self.keys_by_path = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry != None and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry != None:
+            self.remove(key)
+        self.misses += 1
+        return None
+
+    def put(self, key, blocks):
+        if self.max_entries <= 0:
+            return
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (time.monotonic() + self.ttl, blocks)
+        self.keys_by_path.setdefault(key[0], set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        del self.entries[key]
+        path_keys = self.keys_by_path[key[0]]
+        path_keys.discard(key)
+        if not path_keys:
+            del self.keys_by_path[key[0]]
+
+    def invalidate(self, path):
+        '''
+            drops every cached block list of path
+        '''
+        for key in list(self.keys_by_path.get(path, ())):
+            self.remove(key)
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "invalidations": self.invalidations, 
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class MetadataBatcher:
+    '''
+        coalesces the metadata calls of concurrent tasks into /batch requests. 
+        calls made while a batch is in flight wait for it and go out together 
+        in the next one, so a single caller pays one round trip per call and 
+        many callers share them. a lone call is sent to its own route
+    '''
+    def __init__(self, client, max_ops=MAX_BATCH_OPS):
+        self.client = client
+        self.max_ops = max_ops
+        self.pending = []
+        self.flusher = None
+        self.requests = 0
+        self.ops = 0
+
+    def call(self, op, args):
+        '''
+            queues op and returns a future of (status, text), the same as 
+            calling the op's route directly
+        '''
+        result = asyncio.get_running_loop().create_future()
+        self.pending.append((op, args, result))
+        if self.flusher == None:
+            self.flusher = asyncio.create_task(self.flush_pending())
+        return result
+
+    async def flush_pending(self):
+        try:
+            # let every task that is ready in this loop turn queue its call first
+            await asyncio.sleep(0)
+            while self.pending:
+                calls, self.pending = self.pending[:self.max_ops], self.pending[self.max_ops:]
+                try:
+                    await self.send(calls)
+                except Exception as e:
+                    for _, _, result in calls:
+                        if not result.done():
+                            result.set_exception(e)
+        finally:
+            self.flusher = None
+
+    async def send(self, calls):
+        self.requests += 1
+        self.ops += len(calls)
+        namenode_session = self.client.namenode_session
+        if len(calls) == 1:
+            op, args, result = calls[0]
+            method, route = METADATA_ROUTES[op]
+            async with namenode_session.request(method, route, json=args) as resp:
+                result.set_result((resp.status, await resp.text()))
+            return
+        batch_request = {"ops": [{"op": op, "args": args} for op, args, _ in calls]}
+        async with namenode_session.post('/batch', json=batch_request) as resp:
+            status, text = resp.status, await resp.text()
+        if status != 200:
+            for _, _, result in calls:
+                result.set_result((status, text))
+            return
+        for (_, _, result), op_result in zip(calls, json.loads(text)["results"]):
+            op_text = op_result["result"]
+            if not isinstance(op_text, str):
+                op_text = json.dumps(op_text)
+            result.set_result((op_result["status"], op_text))
+
+
+class TransferMeter:
+    '''
+        counts the bytes sent and received by every transfer of a client and, 
+        given a rate, holds all of them together to rate bytes per second. a 
+        transfer that overdraws the budget waits until its bytes are paid off, 
+        so concurrent transfers share the rate between them
+    '''
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.bytes = 0
+        self.started = time.monotonic()
+        # bytes that can still go out without waiting, at most one second's worth
+        self.allowance = 0
+        self.last_refill = self.started
+
+    async def transferred(self, nbytes, throttle=True):
+        '''
+            counts nbytes. without throttle they are only counted, e.g. for 
+            bytes read from a local cache that use no bandwidth
+        '''
+        self.bytes += nbytes
+        if not self.rate or not throttle:
+            return
+        now = time.monotonic()
+        self.allowance = min(self.allowance + (now - self.last_refill) * self.rate, self.rate)
+        self.last_refill = now
+        self.allowance -= nbytes
+        if self.allowance < 0:
+            await asyncio.sleep(-self.allowance / self.rate)
+
+    async def meter(self, body):
+        '''
+            passes a request body (bytes or an async iterator of chunks) 
+            through the meter
+        '''
+        if isinstance(body, bytes):
+            for start in range(0, len(body), TRANSFER_CHUNK_SIZE):
+                chunk = body[start:start + TRANSFER_CHUNK_SIZE]
+                await self.transferred(len(chunk))
+                yield chunk
+            return
+        async for chunk in body:
+            await self.transferred(len(chunk))
+            yield chunk
+
+    def throughput(self):
+        return self.bytes / max(time.monotonic() - self.started, 1e-9)
+
+
+class TreeTransfer:
+    '''
+        moves the files of a directory tree with a fixed number of workers 
+        taking jobs from a shared queue, reporting progress to stderr when run 
+        from the shell
+    '''
+    def __init__(self, client, workers, skipped):
+        self.client = client
+        self.workers = workers
+        self.skipped = skipped
+        self.files_done = 0
+        self.errors = []
+
+    async def run(self, jobs):
+        '''
+            jobs is a list of (size, name, transfer) where transfer() returns 
+            (status, text). larger files go first so a big one does not start last
+        '''
+        queue = asyncio.Queue()
+        for job in sorted(jobs, key=lambda job: -job[0]):
+            queue.put_nowait(job)
+        self.total_files = len(jobs)
+        self.total_bytes = sum(job[0] for job in jobs)
+        meter = self.client.transfer_meter
+
+        async def worker():
+            while not queue.empty():
+                size, name, transfer = queue.get_nowait()
+                try:
+                    status, text = await transfer()
+                except EdfsClientError as e:
+                    status, text = e.error_code, str(e)
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    status, text = 503, str(e)
+                if status != 200:
+                    self.errors.append(f"{name}: {text}")
+                self.files_done += 1
+
+        reporter = asyncio.create_task(self.report_forever()) if FROM_SHELL else None
+        try:
+            await asyncio.gather(*[worker() for _ in range(self.workers)])
+        finally:
+            if reporter:
+                reporter.cancel()
+                self.report(end='\n')
+        seconds = time.monotonic() - meter.started
+        summary = (f"{self.files_done - len(self.errors)} files transferred, {self.skipped} skipped as "
+                   f"already transferred, {meter.bytes / (1024*1024):.1f} MB in {seconds:.1f}s "
+                   f"({meter.throughput() / (1024*1024):.1f} MB/s)")
+        if self.errors:
+            return 400, '\n'.join(self.errors + [summary])
+        return 200, summary
+
+    def report(self, end=''):
+        meter = self.client.transfer_meter
+        print(f"\r{self.files_done}/{self.total_files} files, "
+              f"{meter.bytes / (1024*1024):.1f}/{self.total_bytes / (1024*1024):.1f} MB, "
+              f"{meter.throughput() / (1024*1024):.1f} MB/s", end=end, file=sys.stderr, flush=True)
+
+    async def report_forever(self):
+        while True:
+            self.report()
+            await asyncio.sleep(PROGRESS_INTERVAL)
+
 
 class EdfsClient:
 
-    def __init__(self):
+    def __init__(self, max_inflight_blocks=MAX_INFLIGHT_BLOCKS, batch_metadata=True, block_cache=None):
         homepath = os.path.dirname(os.path.realpath(__file__))
         namenode_info, datanode_info = get_config(homepath)
         self.namenode_session = None
@@ -45,9 +730,30 @@ class EdfsClient:
             "rm": self.handle_rm,
             "rmdir": self.handle_rmdir,
             "get": self.handle_get,
-            "cat": self.handle_cat
+            "cat": self.handle_cat,
+            "head": self.handle_head,
+            "tail": self.handle_tail,
+            "putpacked": self.handle_put_packed,
+            "lsr": self.handle_ls_recursive,
+            "du": self.handle_du,
+            "count": self.handle_count,
+            "setec": self.handle_set_ec_policy,
+            "ecconvert": self.handle_ec_convert,
+            "append": self.handle_append
         }
+        self.max_inflight_blocks = max_inflight_blocks
+        # coalesce concurrent metadata calls into /batch requests
+        self.metadata_batcher = MetadataBatcher(self) if batch_metadata else None
+        self.location_cache = BlockLocationCache()
+        # a BlockCache, blocks are always read from the datanodes without one
+        self.block_cache = block_cache
+        # counts (and with a bandwidth limit, throttles) block transfers when set
+        self.transfer_meter = None
+        self.max_concurrent_files = MAX_CONCURRENT_FILES
+        # bytes per second shared by all transfers of a recursive -put or -get
+        self.bandwidth_limit = None
         self.namenode_info = (namenode_info[0], namenode_info[1])
+        self.block_size = namenode_info[2]
         self.datanodes_info = [(nodeid, (hostname, port))
                                 for nodeid, hostname, port 
                                 in datanode_info['nodes']]
@@ -67,89 +773,859 @@ class EdfsClient:
             await d.close()
 
 
+    async def ls_page(self, path_to_ls, cursor=None, limit=LS_PAGE_SIZE, route='/ls_html', summary=False):
+        '''
+            one page of the listing of path_to_ls, returns (entries, cursor of 
+            the next page or None). with summary, /ls_html entries carry a 
+            block_count instead of the block list
+        '''
+        params = {"path": path_to_ls, "limit": limit}
+        if cursor != None:
+            params["cursor"] = cursor
+        if summary:
+            params["summary"] = 1
+        async with self.namenode_session.get(route, params=params) as resp:
+            if resp.status != 200:
+                raise EdfsClientError(await resp.text(), resp.status)
+            page = json.loads(await resp.text())
+        return page["entries"], page["cursor"]
+
+    async def iter_ls(self, path_to_ls, route='/ls_html', summary=False):
+        '''
+            async iterator over the entries of path_to_ls, fetched a page at a 
+            time as they are consumed
+        '''
+        cursor = None
+        while True:
+            entries, cursor = await self.ls_page(path_to_ls, cursor, route=route, summary=summary)
+            for entry in entries:
+                yield entry
+            if cursor == None:
+                return
+
     async def handle_ls(self, path_to_ls):
-        #encoded_path_to_ls = urlencode(path_to_ls)
-        async with self.namenode_session.get('/ls', params={"path": path_to_ls}) as resp:
+        try:
+            entries = [entry async for entry in self.iter_ls(path_to_ls, route='/ls')]
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        if FROM_SHELL:
+            return 200, '\t'.join([x['name'] for x in entries])
+        return 200, json.dumps(entries)
+
+    async def iter_ls_recursive(self, path_to_ls):
+        '''
+            async iterator over {"path", "type", "size"} of every inode below 
+            path_to_ls, read from the namenode's streamed listing
+        '''
+        async with self.namenode_session.get('/ls', params={"path": path_to_ls, "recursive": 1}) as resp:
             if resp.status != 200:
-                return resp.status, resp_text
-            if FROM_SHELL:
-                return resp.status, '\t'.join([x['name'] for x in json.loads(await resp.text())])
-            else:
+                raise EdfsClientError(await resp.text(), resp.status)
+            async for line in resp.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def handle_ls_recursive(self, path_to_ls):
+        try:
+            entries = [entry async for entry in self.iter_ls_recursive(path_to_ls)]
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        if FROM_SHELL:
+            return 200, '\n'.join(f"{x['path']}\t{x['type']}\t{x['size']}" for x in entries)
+        return 200, entries
+
+    async def handle_du(self, path):
+        async with self.namenode_session.get('/du', params={"path": path}) as resp:
+            if resp.status != 200 or not FROM_SHELL:
                 return resp.status, await resp.text()
+            return resp.status, f"{json.loads(await resp.text())['bytes']}\t{path}"
 
-    async def handle_get(self, path_to_get, path_to_save=None):
-        block_composition = []
-        async with self.namenode_session.get('/get', params={"path": path_to_get}) as resp:
+    async def handle_count(self, path):
+        async with self.namenode_session.get('/count', params={"path": path}) as resp:
+            if resp.status != 200 or not FROM_SHELL:
+                return resp.status, await resp.text()
+            count = json.loads(await resp.text())
+            return resp.status, f"{count['directories']}\t{count['files']}\t{count['bytes']}\t{count['blocks']}\t{path}"
+
+    async def get_block_list(self, path_to_get, offset=None, length=None):
+        get_params = {"path": path_to_get}
+        if offset != None:
+            get_params["offset"] = offset
+        if length != None:
+            get_params["length"] = length
+        async with self.namenode_session.get('/get', params=get_params) as resp:
             resp_text = await resp.text()
             if resp.status != 200:
-                return resp.status, resp_text
-            block_composition = json.loads(resp_text)
-        block_bytes = b""
-        for block in block_composition:
-            block_id = block["block_id"]
-            for avaliable_datanode in block["block_mapping"]:
-                session = self.datanode_sessions[avaliable_datanode]
-                async with session.get('/read', params={"id": block_id}) as r_resp:
+                raise EdfsClientError(resp_text, resp.status)
+            return json.loads(resp_text)
+
+    async def locate(self, path_to_get, offset=None, length=None):
+        '''
+            returns the block list of a file (range) and whether it came from 
+            the location cache
+        '''
+        key = (path_to_get, offset, length)
+        block_composition = self.location_cache.get(key)
+        if block_composition != None:
+            return block_composition, True
+        block_composition = await self.get_block_list(path_to_get, offset, length)
+        self.location_cache.put(key, block_composition)
+        return block_composition, False
+
+    async def read_located(self, read, key, from_cache, index, block, *args):
+        '''
+            runs read(block, *args). when no replica at the cached locations can 
+            serve the block, which happens after replicas moved or the file was 
+            replaced, the file's cache entries are dropped and the block is read 
+            again from fresh locations
+        '''
+        try:
+            return await read(block, *args)
+        except EdfsClientError as e:
+            if e.error_code != 404 or not from_cache:
+                raise
+        self.location_cache.invalidate(key[0])
+        block_composition = await self.get_block_list(*key)
+        self.location_cache.put(key, block_composition)
+        if index >= len(block_composition) or block_composition[index]["block_id"] != block["block_id"]:
+            raise EdfsClientError("File was replaced while being read", 404)
+        return await read(block_composition[index], *args)
+
+    async def fetch_checksums(self, session, block):
+        '''
+            returns the stored checksums of a block read as a whole, which 
+            the datanode sends with sendfile unverified. range reads are 
+            verified by the datanode, so None is returned for them
+        '''
+        if "offset" in block_read_params(block):
+            return None
+        async with session.get('/checksums', params={"id": block["block_id"]}) as c_resp:
+            if c_resp.status != 200:
+                return None
+            return await c_resp.read()
+
+    async def checksum_mismatch(self, session, block, datanode_id):
+        logging.warning(f"block {block['block_id']} from {datanode_id} failed its checksums")
+        # the datanode re-checks the replica and drops it if it is really corrupt
+        async with session.post('/verify', params={"id": block["block_id"]}) as v_resp:
+            await v_resp.read()
+
+    async def read_block(self, block):
+        '''
+            returns the content of a block (or of its offset/length range), 
+            trying each of its replicas in turn until one passes its checksums
+        '''
+        if "ec_policy" in block:
+            return await self.read_block_group(block)
+        loop = asyncio.get_running_loop()
+        if self.block_cache:
+            content = self.block_cache.get(block_cache_key(block))
+            if content != None:
+                try:
+                    # an uncompressed hit is an mmap, callers always get bytes
+                    return await loop.run_in_executor(None, lambda: bytes(decode_block(block, content)))
+                except (ValueError, zlib.error, lzma.LZMAError) as e:
+                    raise EdfsClientError(f"Cannot decode block {block['block_id']}: {e}", 415)
+        for avaliable_datanode in block["block_mapping"]:
+            session = self.datanode_sessions[avaliable_datanode]
+            try:
+                expected = await self.fetch_checksums(session, block)
+                async with session.get('/read', params=block_read_params(block)) as r_resp:
+                    if r_resp.status != 200:
+                        continue
+                    content = await r_resp.read()
+                if expected != None:
+                    checksums = ChunkChecksums()
+                    checksums.update(content)
+                    if checksums.digest() != expected:
+                        await self.checksum_mismatch(session, block, avaliable_datanode)
+                        continue
+                if self.block_cache:
+                    await loop.run_in_executor(None, self.block_cache.put, block_cache_key(block), content)
+                return await loop.run_in_executor(None, decode_block, block, content)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+            except (ValueError, zlib.error, lzma.LZMAError) as e:
+                raise EdfsClientError(f"Cannot decode block {block['block_id']}: {e}", 415)
+        raise EdfsClientError("Block broken", 404)
+
+    async def read_block_into(self, block, fd, file_offset):
+        '''
+            streams a block into an open local file at file_offset, chunk by 
+            chunk, trying each of its replicas in turn. compressed blocks are 
+            decompressed while they arrive
+        '''
+        if "ec_policy" in block:
+            content = await self.read_block_group(block)
+            await asyncio.get_running_loop().run_in_executor(None, os.pwrite, fd, content, file_offset)
+            if self.transfer_meter:
+                await self.transfer_meter.transferred(len(content))
+            return
+        if self.block_cache:
+            content = self.block_cache.get(block_cache_key(block))
+            if content != None:
+                try:
+                    written = await asyncio.get_running_loop().run_in_executor(
+                        None, lambda: os.pwrite(fd, decode_block(block, content), file_offset))
+                except (ValueError, zlib.error, lzma.LZMAError) as e:
+                    raise EdfsClientError(f"Cannot decode block {block['block_id']}: {e}", 415)
+                if self.transfer_meter:
+                    await self.transfer_meter.transferred(written, throttle=False)
+                return
+        for avaliable_datanode in block["block_mapping"]:
+            session = self.datanode_sessions[avaliable_datanode]
+            cache_writer = None
+            try:
+                expected = await self.fetch_checksums(session, block)
+                checksums = ChunkChecksums()
+                decompressor = get_codec(block.get("codec", DEFAULT_CODEC)).decompressor()
+                async with session.get('/read', params=block_read_params(block)) as r_resp:
                     if r_resp.status != 200:
                         continue
-                    content_stream = r_resp.content
-                    content = await content_stream.read(-1)
-                    block_bytes += content
+                    if self.block_cache:
+                        cache_writer = self.block_cache.writer(block_cache_key(block))
+                    position = file_offset
+                    async for chunk in r_resp.content.iter_chunked(TRANSFER_CHUNK_SIZE):
+                        if expected != None:
+                            checksums.update(chunk)
+                        if cache_writer:
+                            cache_writer.write(chunk)
+                        chunk = decompressor.decompress(chunk)
+                        os.pwrite(fd, chunk, position)
+                        position += len(chunk)
+                        if self.transfer_meter:
+                            await self.transfer_meter.transferred(len(chunk))
+                    os.pwrite(fd, decompressor.flush(), position)
+                if expected != None and checksums.digest() != expected:
+                    # the next replica overwrites the same range
+                    await self.checksum_mismatch(session, block, avaliable_datanode)
+                    continue
+                if cache_writer:
+                    # committing may evict under the cache's flock
+                    await asyncio.get_running_loop().run_in_executor(None, cache_writer.commit)
+                    cache_writer = None
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+            except (ValueError, zlib.error, lzma.LZMAError) as e:
+                raise EdfsClientError(f"Cannot decode block {block['block_id']}: {e}", 415)
+            finally:
+                if cache_writer:
+                    cache_writer.abort()
+        raise EdfsClientError("Block broken", 404)
+
+    async def read_block_group(self, block):
+        '''
+            returns the requested range of an erasure coded block group. only 
+            the data units holding the range are read; if one of them cannot 
+            be, the group is rebuilt from whole units of the others (degraded read)
+        '''
+        policy = get_policy(block["ec_policy"])
+        offset = block.get("offset", 0)
+        end = offset + block.get("length", block["num_bytes"])
+        if end <= offset:
+            return b""
+        unit_size = policy.unit_size(block["num_bytes"])
+        first = offset // unit_size
+        reads = []
+        for index in range(first, (end - 1) // unit_size + 1):
+            unit_start = index * unit_size
+            range_start = max(offset, unit_start) - unit_start
+            range_end = min(end, unit_start + unit_size) - unit_start
+            reads.append(self.read_block(unit_block(block, index, unit_size, range_start, 
+                                                    range_end - range_start)))
+        results = await asyncio.gather(*reads, return_exceptions=True)
+        failed = set()
+        for index, result in enumerate(results, first):
+            if isinstance(result, EdfsClientError):
+                failed.add(index)
+            elif isinstance(result, BaseException):
+                raise result
+        if not failed:
+            return b"".join(results)
+        logging.warning(f"units {sorted(failed)} of block group {block['block_id']} unreadable, rebuilding it")
+        units = await self.read_units(block, policy, unit_size, failed)
+        content = await asyncio.get_running_loop().run_in_executor(None, policy.decode, units, 
+                                                                   block["num_bytes"])
+        return content[offset:end]
+
+    async def read_units(self, block, policy, unit_size, failed):
+        '''
+            reads whole units of a block group, data units first, until 
+            data_units of them arrived. returns {unit index: unit}
+        '''
+        units = {}
+        candidates = [index for index in range(policy.width) if index not in failed]
+        while len(units) < policy.data_units:
+            wanted = policy.data_units - len(units)
+            if len(candidates) < wanted:
+                raise EdfsClientError(f"Block group {block['block_id']} lost more than "
+                                      f"{policy.parity_units} units", 404)
+            batch, candidates = candidates[:wanted], candidates[wanted:]
+            results = await asyncio.gather(*[self.read_block(unit_block(block, index, unit_size)) 
+                                             for index in batch], return_exceptions=True)
+            for index, result in zip(batch, results):
+                if isinstance(result, EdfsClientError):
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                units[index] = result
+        return units
+
+    async def iter_file(self, path_to_get, offset=None, length=None, located=None):
+        '''
+            async iterator over the blocks of a file (or of a byte range of it), 
+            in order. up to max_inflight_blocks blocks are fetched ahead in 
+            parallel, so memory is bounded by the in-flight blocks instead of 
+            the file size. located is what locate returned for the same range, 
+            for callers that already looked the file up
+        '''
+        if located == None:
+            located = await self.locate(path_to_get, offset, length)
+        block_composition, from_cache = located
+        read = partial(self.read_located, self.read_block, (path_to_get, offset, length), from_cache)
+        pending = deque()
+        blocks = enumerate(block_composition)
+        try:
+            for index, block in blocks:
+                pending.append(asyncio.create_task(read(index, block)))
+                if len(pending) >= self.max_inflight_blocks:
                     break
-                return 404, "Block broken"
-
-        if FROM_SHELL and path_to_save!=None:
-            filename = path_to_get[path_to_get.rfind('/')+1:]
-            with open(path_to_save + '/' + filename, 'wb') as getwriter:
-                getwriter.write(block_bytes)
-            return 200, "Successfully saved to local"
-        return 200, block_bytes
+            while pending:
+                content = await pending.popleft()
+                index, block = next(blocks, (None, None))
+                if block is not None:
+                    pending.append(asyncio.create_task(read(index, block)))
+                yield content
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_to_file(self, path_to_get, local_path):
+        '''
+            downloads a file into local_path, fetching up to max_inflight_blocks 
+            blocks in parallel and writing each one at its offset as it arrives
+        '''
+        block_composition, from_cache = await self.locate(path_to_get)
+        read = partial(self.read_located, self.read_block_into, (path_to_get, None, None), from_cache)
+        inflight = asyncio.Semaphore(self.max_inflight_blocks)
+        async def download(index, block, file_offset):
+            async with inflight:
+                await read(index, block, fd, file_offset)
+
+        partial_path = local_path + PARTIAL_SUFFIX
+        fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, sum(block["num_bytes"] for block in block_composition))
+            downloads, file_offset = [], 0
+            for index, block in enumerate(block_composition):
+                downloads.append(asyncio.create_task(download(index, block, file_offset)))
+                file_offset += block["num_bytes"]
+            try:
+                await asyncio.gather(*downloads)
+            except BaseException:
+                for task in downloads:
+                    task.cancel()
+                raise
+        finally:
+            os.close(fd)
+        # only a complete download ever has the name of the file
+        os.replace(partial_path, local_path)
+
+    async def handle_get(self, path_to_get, path_to_save=None):
+        try:
+            if FROM_SHELL and path_to_save!=None:
+                if await self.is_directory(path_to_get):
+                    return await self.get_tree(path_to_get, path_to_save)
+                filename = path_to_get[path_to_get.rfind('/')+1:]
+                await self.get_to_file(path_to_get, path_to_save + '/' + filename)
+                return 200, "Successfully saved to local"
+            return 200, b"".join([content async for content in self.iter_file(path_to_get)])
+        except EdfsClientError as e:
+            return e.error_code, str(e)
                     
+    async def read_range(self, path_to_read, offset, length=None):
+        '''
+            returns length bytes of a file starting at offset, fetching only the 
+            blocks covering the range. a negative offset counts from the end
+        '''
+        return b"".join([content async for content in self.iter_file(path_to_read, offset, length)])
+
     async def handle_cat(self, path_to_cat):
         code, resp = await self.handle_get(path_to_cat)
+        if code != 200:
+            return code, resp
         return code, resp.decode()
 
+    async def handle_head(self, path_to_read, num_bytes=1024):
+        try:
+            content = await self.read_range(path_to_read, 0, int(num_bytes))
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        return 200, content.decode(errors='replace')
+
+    async def handle_tail(self, path_to_read, num_bytes=1024):
+        try:
+            content = await self.read_range(path_to_read, -int(num_bytes))
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        return 200, content.decode(errors='replace')
+
     
     async def handle_ls_html(self, path_to_ls):
-        #encoded_path_to_ls = urlencode(path_to_ls)
-        async with self.namenode_session.get('/ls_html', params={"path": path_to_ls}) as resp:
-            if resp.status != 200:
-                return resp.status, resp.text()
-            if FROM_SHELL:
-                return resp.status, '\t'.join([f"{x['name']}\t{x['replication']}\t{x['blocks']}" for x in json.loads(await resp.text())])
-            else:
-                return resp.status, await resp.text()
+        try:
+            entries = [entry async for entry in self.iter_ls(path_to_ls)]
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        if FROM_SHELL:
+            return 200, '\t'.join([f"{x['name']}\t{x['replication']}\t{x['blocks']}" for x in entries])
+        return 200, json.dumps(entries)
 
-    async def handle_put(self, *args):
-        return await self.put_single_file(*args)
+    async def handle_put(self, src_path, dest_path, src_reader=None, codec=DEFAULT_CODEC, ec_policy=None):
+        if src_reader == None and src_path == '-':
+            # stdin has no size, it goes to the file dest_path through a writer
+            return await self.write_stream(self.create(dest_path, codec, ec_policy), sys.stdin.buffer)
+        if src_reader == None and os.path.isdir(src_path):
+            return await self.put_tree(src_path, dest_path, codec, ec_policy)
+        return await self.put_single_file(src_path, dest_path, src_reader, codec, ec_policy=ec_policy)
         
+    async def handle_put_packed(self, dest_path, *src_paths):
+        '''
+            puts local files into dest_path; files up to PACK_FILE_THRESHOLD 
+            bytes are packed into shared container blocks, larger ones are put 
+            as usual
+        '''
+        writer = PackedWriter(self)
+        large_files = []
+        for src_path in src_paths:
+            if os.path.getsize(src_path) > PACK_FILE_THRESHOLD:
+                large_files.append(src_path)
+                continue
+            with open(src_path, 'rb') as reader:
+                await writer.add(dest_path, os.path.basename(src_path), reader.read())
+        status, text = await writer.close()
+        for src_path in large_files:
+            put_status, put_text = await self.put_single_file(src_path, dest_path)
+            if put_status != 200:
+                status, text = put_status, put_text
+        return status, text
+
+    async def create(self, path, codec=DEFAULT_CODEC, ec_policy=None):
+        '''
+            creates the file path and returns an EdfsWriter for it. ec_policy 
+            overrides the erasure coding policy of its directory. raises 
+            EdfsClientError if the file cannot be created
+        '''
+        directory, name = split_edfs_path(path)
+        create_request = {"name": name, "path": directory, "codec": codec}
+        if ec_policy != None:
+            create_request["ec_policy"] = ec_policy
+        return await self.open_writer('/create', create_request, path)
+
+    async def append(self, path):
+        '''
+            returns an EdfsWriter adding blocks after the end of the file path. 
+            raises EdfsClientError if the file cannot be appended to
+        '''
+        return await self.open_writer('/append', {"path": path}, path)
+
+    async def open_writer(self, route, request, path):
+        async with self.namenode_session.put(route, json=request) as resp:
+            status, text = resp.status, await resp.text()
+        if status != 200:
+            raise EdfsClientError(text, status)
+        self.location_cache.invalidate(path)
+        return EdfsWriter(self, path, json.loads(text))
+
+    async def write_stream(self, opening, src_reader):
+        '''
+            copies src_reader to the EdfsWriter that opening (create or append) 
+            returns until src_reader ends, then closes the writer. src_reader.read 
+            runs in a worker thread, so waiting on a pipe does not hold up the uploads
+        '''
+        loop = asyncio.get_running_loop()
+        try:
+            writer = await opening
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, src_reader.read, TRANSFER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await writer.write(chunk)
+        except BaseException as e:
+            writer.abort()
+            if isinstance(e, EdfsClientError):
+                return e.error_code, str(e)
+            raise
+        return await writer.close()
+
+    async def handle_append(self, src_path, dest_file):
+        '''
+            appends a local file, or stdin for "-", to the file dest_file
+        '''
+        if src_path == '-':
+            return await self.write_stream(self.append(dest_file), sys.stdin.buffer)
+        with open(src_path, 'rb') as reader:
+            return await self.write_stream(self.append(dest_file), reader)
+
+    async def metadata_call(self, op, request):
+        '''
+            sends a metadata operation (a key of METADATA_ROUTES) to the 
+            namenode, through the batcher if there is one
+        '''
+        if self.metadata_batcher:
+            return await self.metadata_batcher.call(op, request)
+        method, route = METADATA_ROUTES[op]
+        async with self.namenode_session.request(method, route, json=request) as resp:
+            return resp.status, await resp.text()
+
+    async def batch(self, ops, atomic=False):
+        '''
+            applies ops, a list of (operation, request body), in one /batch 
+            request. with atomic, either all of them are applied or none
+            return: status, [(status, text) of every op]
+        '''
+        batch_request = {"ops": [{"op": op, "args": args} for op, args in ops], "atomic": atomic}
+        async with self.namenode_session.post('/batch', json=batch_request) as resp:
+            status, text = resp.status, await resp.text()
+        if status not in (200, 409):
+            return status, text
+        results = json.loads(text)["results"]
+        return status, [(r["status"], r["result"] if isinstance(r["result"], str) else json.dumps(r["result"]))
+                        for r in results]
+
     async def handle_mkdir(self, path):
         mkdir_request = {
             'path': path
         }
-        async with self.namenode_session.put('/mkdir', json=mkdir_request) as resp:
-            return resp.status, await resp.text()
+        return await self.metadata_call("mkdir", mkdir_request)
 
     async def handle_rm(self, path):
         rm_request = {
             'path': path
         }
-        async with self.namenode_session.delete('/rm', json=rm_request) as resp:
-            return resp.status, await resp.text()
+        status, text = await self.metadata_call("rm", rm_request)
+        self.location_cache.invalidate(path)
+        return status, text
 
     async def handle_rmdir(self, path):
         rmdir_request = {
             'path': path
         }
-        async with self.namenode_session.delete('/rmdir', json=rmdir_request) as resp:
+        return await self.metadata_call("rmdir", rmdir_request)
+
+    async def handle_set_ec_policy(self, path, ec_policy):
+        '''
+            sets the erasure coding policy of new files below the directory 
+            path: a policy name, "replicated", or "inherit" for the parent's
+        '''
+        request = {"path": path, "ec_policy": None if ec_policy == "inherit" else ec_policy}
+        async with self.namenode_session.put('/set_ec_policy', json=request) as resp:
             return resp.status, await resp.text()
 
-    async def put_single_file(self, src_path, dest_path, src_reader=None):
-        file_path, file_name, file_size, file_bytes = None, None, None, None
-        if src_reader:
-            file_bytes = src_reader.read()
+    async def convert_file(self, path_to_convert, ec_policy):
+        '''
+            rewrites a replicated file in the erasure coded layout of ec_policy: 
+            every block is read, encoded and written as a block group, then the 
+            namenode switches the file over and drops the old replicas. readers 
+            keep seeing the replicas until the switch
+        '''
+        try:
+            policy = get_policy(ec_policy)
+        except ValueError as e:
+            raise EdfsClientError(str(e), 400)
+        block_composition = await self.get_block_list(path_to_convert)
+        if any("ec_policy" in block or is_compressed(block) or block.get("packed") 
+               for block in block_composition):
+            raise EdfsClientError("Only uncompressed replicated files can be converted", 400)
+        slash_index = path_to_convert.rfind('/')
+        allocation_request = {
+            "name": path_to_convert[slash_index + 1:],
+            "size": sum(block["num_bytes"] for block in block_composition),
+            "path": path_to_convert[:slash_index] or '/',
+            "ec_policy": ec_policy,
+            "replace": True
+        }
+        status, text = await self.metadata_call("allocate", allocation_request)
+        if status != 200:
+            raise EdfsClientError(text, status)
+        allocation = json.loads(text)
+        # every block group must hold exactly the bytes of the block it replaces
+        if ([block_group["block_size"] for block_group in allocation["block_info"]] != 
+                [block["num_bytes"] for block in block_composition]):
+            raise EdfsClientError("File changed while being converted", 409)
+
+        inflight = asyncio.Semaphore(self.max_inflight_blocks)
+        async def convert_block(block, block_group):
+            async with inflight:
+                content = await self.read_block(block)
+                status, text = await self.write_block_group(block_group, content, policy)
+                if status != 200:
+                    raise EdfsClientError(text, status)
+        conversions = [asyncio.create_task(convert_block(block, block_group)) 
+                       for block, block_group in zip(block_composition, allocation["block_info"])]
+        try:
+            await asyncio.gather(*conversions)
+        except BaseException:
+            for task in conversions:
+                task.cancel()
+            raise
+        convert_request = {
+            "path": path_to_convert,
+            "source_blocks": [block["block_id"] for block in block_composition],
+            "allocation": allocation
+        }
+        async with self.namenode_session.put('/convert', json=convert_request) as resp:
+            status, text = resp.status, await resp.text()
+        self.location_cache.invalidate(path_to_convert)
+        if status != 200:
+            raise EdfsClientError(text, status)
+
+    async def convert_cold_files(self, path, ec_policy, idle):
+        '''
+            converts the replicated files below path that were not read for 
+            idle seconds, one after the other. returns (files converted, errors)
+        '''
+        params = {"path": path, "idle": idle, "min_size": EC_MIN_FILE_SIZE}
+        async with self.namenode_session.get('/cold_files', params=params) as resp:
+            resp_text = await resp.text()
+            if resp.status != 200:
+                raise EdfsClientError(resp_text, resp.status)
+        converted, errors = 0, []
+        for cold_file in json.loads(resp_text):
+            try:
+                await self.convert_file(cold_file["path"], ec_policy)
+                converted += 1
+            except EdfsClientError as e:
+                errors.append(f"{cold_file['path']}: {e}")
+        return converted, errors
+
+    async def handle_ec_convert(self, path, ec_policy, idle=EC_CONVERT_IDLE, interval=None):
+        '''
+            converts cold files below path to ec_policy once or, given an 
+            interval in seconds, runs as a background converter that does so 
+            again every interval until interrupted
+        '''
+        while True:
+            try:
+                converted, errors = await self.convert_cold_files(path, ec_policy, float(idle))
+            except EdfsClientError as e:
+                return e.error_code, str(e)
+            summary = '\n'.join([f"{converted} files converted to {ec_policy}", *errors])
+            if interval == None:
+                return (400 if errors else 200), summary
+            print(summary)
+            await asyncio.sleep(float(interval))
+
+    async def is_directory(self, path):
+        # /count answers from the directory summaries, without listing any child
+        async with self.namenode_session.get('/count', params={"path": path}) as resp:
+            return resp.status == 200 and json.loads(await resp.text())["directories"] > 0
+
+    async def remote_tree(self, path):
+        '''
+            {path: (type, size)} of every inode below path, empty if path 
+            does not exist
+        '''
+        try:
+            return {entry["path"]: (entry["type"], entry["size"]) 
+                    async for entry in self.iter_ls_recursive(path)}
+        except EdfsClientError as e:
+            if e.error_code == 404:
+                return {}
+            raise
+
+    async def make_directories(self, paths):
+        '''
+            creates directories, parents before children, in /batch requests. 
+            returns the errors
+        '''
+        errors = []
+        for start in range(0, len(paths), MAX_BATCH_OPS):
+            ops = [("mkdir", {"path": path}) for path in paths[start:start + MAX_BATCH_OPS]]
+            status, results = await self.batch(ops)
+            if status != 200:
+                return [results]
+            errors += [f"{args['path']}: {text}" for (_, args), (op_status, text) in zip(ops, results) 
+                       if op_status != 200]
+        return errors
+
+    def start_tree_transfer(self, skipped):
+        self.transfer_meter = TransferMeter(self.bandwidth_limit)
+        return TreeTransfer(self, self.max_concurrent_files, skipped)
+
+    async def put_tree(self, src_dir, dest_path, codec=DEFAULT_CODEC, ec_policy=None):
+        '''
+            puts the local directory src_dir, with everything below it, into 
+            dest_path. directories are created in bulk first, then the files 
+            are put concurrently. files already in EDFS with their local size 
+            are skipped, so an interrupted put is resumed by running it again
+        '''
+        src_dir = os.path.abspath(src_dir)
+        root = join_edfs_path(dest_path, os.path.basename(src_dir))
+        try:
+            existing = await self.remote_tree(root)
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        directories = [] if await self.is_directory(root) else [root]
+        files = []
+        for local_dir, dir_names, file_names in os.walk(src_dir):
+            relative = os.path.relpath(local_dir, src_dir)
+            edfs_dir = root if relative == '.' else join_edfs_path(root, *relative.split(os.sep))
+            dir_names.sort()
+            directories += [join_edfs_path(edfs_dir, name) for name in dir_names]
+            files += [(os.path.join(local_dir, name), edfs_dir, name) for name in sorted(file_names)]
+        errors = await self.make_directories([path for path in directories 
+                                              if existing.get(path, (None,))[0] != "DIRECTORY"])
+        if errors:
+            return 400, '\n'.join(errors)
+
+        jobs, skipped = [], 0
+        for local_path, edfs_dir, name in files:
+            size = os.path.getsize(local_path)
+            edfs_path = join_edfs_path(edfs_dir, name)
+            remote = existing.get(edfs_path)
+            if remote == ("FILE", size):
+                skipped += 1
+                continue
+            jobs.append((size, edfs_path, partial(self.put_tree_file, local_path, edfs_dir, 
+                                                  edfs_path if remote else None, codec, ec_policy)))
+        return await self.start_tree_transfer(skipped).run(jobs)
+
+    async def put_tree_file(self, local_path, edfs_dir, replaced_path, codec, ec_policy):
+        if replaced_path:
+            # left from an earlier put of a different version of the file
+            status, text = await self.handle_rm(replaced_path)
+            if status != 200:
+                return status, text
+        return await self.put_single_file(local_path, edfs_dir, codec=codec, ec_policy=ec_policy)
+
+    async def get_tree(self, src_path, local_dir):
+        '''
+            downloads the EDFS directory src_path, with everything below it, 
+            into local_dir, fetching files concurrently. local files that 
+            already have their EDFS size are skipped, so an interrupted get is 
+            resumed by running it again
+        '''
+        try:
+            entries = await self.remote_tree(src_path)
+        except EdfsClientError as e:
+            return e.error_code, str(e)
+        name = src_path.rstrip('/').rsplit('/', 1)[-1]
+        root = os.path.join(local_dir, name) if name else local_dir
+        prefix = src_path.rstrip('/')
+        os.makedirs(root, exist_ok=True)
+        jobs, skipped = [], 0
+        for edfs_path, (node_type, size) in entries.items():
+            local_path = os.path.join(root, *edfs_path[len(prefix):].strip('/').split('/'))
+            if node_type == "DIRECTORY":
+                os.makedirs(local_path, exist_ok=True)
+            elif os.path.isfile(local_path) and os.path.getsize(local_path) == size:
+                skipped += 1
+            else:
+                jobs.append((size, edfs_path, partial(self.get_tree_file, edfs_path, local_path)))
+        return await self.start_tree_transfer(skipped).run(jobs)
+
+    async def get_tree_file(self, edfs_path, local_path):
+        await self.get_to_file(edfs_path, local_path)
+        return 200, "Successfully saved to local"
+
+    def metered(self, body):
+        if self.transfer_meter == None:
+            return body
+        return self.transfer_meter.meter(body)
+
+    async def write_block(self, block, block_source):
+        '''
+            writes one block through a datanode pipeline. block_source() returns 
+            a fresh body for every attempt. the first datanode stores replica 0 and 
+            forwards the block along the rest; a datanode that cannot be reached 
+            is dropped and the pipeline is retried with the remaining ones
+        '''
+        datanode_ids = block["datanode_id"]
+        resp_status, resp_text = 503, f"No datanode available for block {block['block_id']}"
+        while datanode_ids:
+            writeblock_params = {
+                "block_id": block["block_id"],
+                "replica": 0,
+                "pipeline": ','.join(datanode_ids[1:])
+            }
+            try:
+                async with self.datanode_sessions[datanode_ids[0]].post(f'/write', 
+                        params=writeblock_params,
+                        data=self.metered(block_source()),
+                        headers={"Content-Type": "application/octet-stream"}) as d_resp:
+                    resp_status, resp_text = d_resp.status, await d_resp.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                resp_status, resp_text = 503, str(e)
+            if resp_status == 200:
+                # only report the replicas that were actually written to the namenode
+                block["datanode_id"] = json.loads(resp_text)
+                return resp_status, resp_text
+            logging.warning(f"writing block {block['block_id']} to {datanode_ids[0]} failed: {resp_text}")
+            datanode_ids = datanode_ids[1:]
+        return resp_status, resp_text
+
+    async def write_block_group(self, block, content, policy):
+        '''
+            encodes a block into the units of its block group and writes every 
+            unit to its datanode. the group stays readable as long as 
+            data_units of its units were written, units that were not are 
+            reported to the namenode without a datanode
+        '''
+        units = await asyncio.get_running_loop().run_in_executor(None, policy.encode, content)
+        results = await asyncio.gather(*[self.write_block(unit, lambda data=data: data)
+                                         for unit, data in zip(block["units"], units)])
+        written = 0
+        for unit, (resp_status, resp_text) in zip(block["units"], results):
+            if resp_status == 200:
+                written += 1
+            else:
+                unit["datanode_id"] = []
+        if written < policy.data_units:
+            return 503, f"Only {written} of {policy.width} units of block group {block['block_id']} were written"
+        return 200, f"{written} units written"
+
+    async def store_block(self, block, block_source, block_codec, policy=None):
+        '''
+            writes one block of a file: as the units of a block group with an 
+            erasure coding policy, else compressed with block_codec first. a 
+            compressed block gets its block["stored_size"]
+        '''
+        loop = asyncio.get_running_loop()
+        if policy:
+            content = await loop.run_in_executor(None, block_source)
+            return await self.write_block_group(block, content, policy)
+        if block_codec.name != DEFAULT_CODEC:
+            # compressing in worker threads lets the in-flight blocks use several cores
+            compressed = await loop.run_in_executor(
+                None, lambda: block_codec.compress(block_source()))
+            block["stored_size"] = len(compressed)
+            block_source = lambda: compressed
+        return await self.write_block(block, block_source)
+
+    async def put_single_file(self, src_path, dest_path, src_reader=None, codec=DEFAULT_CODEC, 
+                              src_size=None, ec_policy=None):
+        '''
+            uploads a local file (or src_reader) to dest_path. with a codec 
+            other than "none" every block is compressed on its own before upload. 
+            src_reader.read(n) may also be a coroutine, e.g. over a request 
+            body being received; a reader that cannot seek needs src_size. 
+            ec_policy overrides the erasure coding policy of dest_path
+        '''
+        try:
+            block_codec = get_codec(codec)
+        except ValueError as e:
+            return 400, str(e)
+        file_path, file_name, file_size = None, None, None
+        if src_reader and src_size != None:
+            file_name, file_size = src_path, src_size
+        elif src_reader:
             file_name = src_path
-            file_size = len(file_bytes)
+            src_reader.seek(0, os.SEEK_END)
+            file_size = src_reader.tell()
+            src_reader.seek(0)
         else:
             file_path = os.path.abspath(src_path)
             file_name = os.path.basename(file_path)
@@ -157,50 +1633,70 @@ class EdfsClient:
         allocation_request = {
             'name': file_name,
             'size': file_size,
-            'path': dest_path
+            'path': dest_path,
+            'codec': codec
         }
+        if ec_policy != None:
+            allocation_request['ec_policy'] = ec_policy
         logging.info(file_size)
         #allocate blocks
         allocation_response = None
-        async with self.namenode_session.put('/allocate', json=allocation_request) as a_resp:
-            if a_resp.status != 200:
-                
-                return a_resp.status, await a_resp.text()
-            
-            allocation_response = json.loads(await a_resp.text())
+        a_status, a_text = await self.metadata_call("allocate", allocation_request)
+        if a_status != 200:
+            return a_status, a_text
+        allocation_response = json.loads(a_text)
         block_count = allocation_response["block_count"]
         full_block_size = allocation_response["full_block_size"]
         block_info = allocation_response["block_info"]
-        stream = None
-        #contact DataNodes to writeblocks
-        if src_reader:
-            stream = BytesIO(file_bytes)
-        else:
-            stream = open(src_path, 'rb')
-        
+        policy = get_policy(allocation_response["ec_policy"]) if "ec_policy" in allocation_response else None
+
+        #contact DataNodes to writeblocks, at most max_inflight_blocks at a time
+        inflight = asyncio.Semaphore(self.max_inflight_blocks)
+        async def upload(block, block_source):
+            try:
+                return await self.store_block(block, block_source, block_codec, policy)
+            finally:
+                inflight.release()
+
+        uploads = []
         try:
-            for block in block_info:
-                chunk = stream.read(full_block_size)
-                block_id = block["block_id"]
-                datanode_ids = block["datanode_id"]
-                for replica, datanode_id in enumerate(datanode_ids):
-                    writeblock_body = {
-                        "block_id": block_id,
-                        "replica": replica,
-                        "block_content": base64.b64encode(chunk).decode("utf-8")
-                    }
-                    async with self.datanode_sessions[datanode_id].post(f'/write', json=writeblock_body) as d_resp:
-                        if d_resp.status != 200:
-                            return d_resp.status, await d_resp.text()
-        finally: 
-            stream.close()
+            for block_index, block in enumerate(block_info):
+                await inflight.acquire()
+                if src_reader:
+                    # a shared stream cannot be read concurrently, so read ahead one 
+                    # block per upload slot; this bounds memory to the in-flight blocks
+                    chunk = src_reader.read(block["block_size"])
+                    if inspect.isawaitable(chunk):
+                        chunk = await chunk
+                    if len(chunk) != block["block_size"]:
+                        raise EdfsClientError(f"{file_name} ended after {len(chunk)} of "
+                                              f"{block['block_size']} bytes of a block", 400)
+                    block_source = lambda chunk=chunk: chunk
+                elif codec != DEFAULT_CODEC or policy:
+                    block_source = partial(read_file_range, file_path, 
+                                           block_index * full_block_size, block["block_size"])
+                else:
+                    block_source = partial(read_file_chunks, file_path, 
+                                           block_index * full_block_size, block["block_size"])
+                uploads.append(asyncio.create_task(upload(block, block_source)))
+            results = await asyncio.gather(*uploads)
+        except BaseException as e:
+            for task in uploads:
+                task.cancel()
+            if isinstance(e, EdfsClientError):
+                return e.error_code, str(e)
+            raise
+        for resp_status, resp_text in results:
+            if resp_status != 200:
+                return resp_status, resp_text
         #upon succesfully datanode writes, update metadata in namenodes   
         put_request = allocation_request.copy()
 
         #copy the last request and response for namenode 
         put_request["allocation"] = allocation_response
-        async with self.namenode_session.put('/put', json=put_request) as p_resp:
-            return p_resp.status, await p_resp.text()
+        status, text = await self.metadata_call("put", put_request)
+        self.location_cache.invalidate(join_edfs_path(dest_path, file_name))
+        return status, text
         
 
             
@@ -214,15 +1710,51 @@ class EdfsClient:
         group = parser.add_mutually_exclusive_group(required=True)
         group.add_argument('-ls', nargs=1)
         group.add_argument('-mkdir', nargs=1)
-        group.add_argument('-put', nargs=2)
+        group.add_argument('-put', nargs=2, help='local_path directory, a local directory is put recursively; '
+                           '- file to write stdin to a new file')
+        group.add_argument('-append', nargs=2, help='local_path file: appends a local file, or stdin for -, '
+                           'to the file')
         group.add_argument('-rm', nargs=1)
         group.add_argument('-rmdir', nargs=1)
-        group.add_argument('-get', nargs=2)
+        group.add_argument('-get', nargs=2, help='path local_directory, a directory is fetched recursively')
         group.add_argument('-cat', nargs=1)
+        group.add_argument('-head', nargs='+', help='path [number of bytes, 1024 by default]')
+        group.add_argument('-tail', nargs='+', help='path [number of bytes, 1024 by default]')
+        group.add_argument('-putpacked', nargs='+', help='directory local_file [local_file ...]')
+        group.add_argument('-lsr', nargs=1, help='recursive listing: path, type and size of every entry')
+        group.add_argument('-du', nargs=1, help='total size in bytes')
+        group.add_argument('-count', nargs=1, help='directories, files, bytes and blocks')
+        group.add_argument('-setec', nargs=2, help='directory policy: erasure coding policy of new files '
+                           'below the directory, "replicated" or "inherit" to use its parent\'s')
+        group.add_argument('-ecconvert', nargs='+', help='path policy [idle seconds [interval seconds]]: '
+                           'converts files not read for idle seconds to the erasure coding policy, '
+                           'with an interval again and again in the background')
+        parser.add_argument('-codec', default=DEFAULT_CODEC, choices=sorted(CODECS),
+                            help='compression of the blocks of a -put file')
+        parser.add_argument('-ec', default=None, choices=sorted(POLICIES) + [REPLICATED],
+                            help='erasure coding policy of a -put file, its directory\'s by default')
+        parser.add_argument('-workers', type=int, default=MAX_CONCURRENT_FILES,
+                            help='files a recursive -put or -get transfers at the same time')
+        parser.add_argument('-bwlimit', type=float, default=None,
+                            help='MB/s shared by all transfers of a recursive -put or -get')
+        parser.add_argument('-cachedir', default=None,
+                            help='directory of an on-disk block cache that reads go through')
+        parser.add_argument('-cachemb', type=int, default=BLOCK_CACHE_SIZE // (1024*1024),
+                            help='size budget of the -cachedir block cache')
         args = parser.parse_args().__dict__
+        codec = args.pop('codec')
+        ec_policy = args.pop('ec')
+        self.max_concurrent_files = args.pop('workers')
+        bwlimit = args.pop('bwlimit')
+        self.bandwidth_limit = bwlimit * 1024 * 1024 if bwlimit else None
+        cache_dir, cache_mb = args.pop('cachedir'), args.pop('cachemb')
+        if cache_dir:
+            self.block_cache = BlockCache(cache_dir, cache_mb * 1024 * 1024)
         for k, v in args.items():
             if v == None:
                 continue
+            if k == 'put':
+                return k, [*v, None, codec, ec_policy]
             return k, v
             
     async def handle_user_request(self, command, arguments):
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+from .FSTree import Inode, INodeError, FSTree, parse_path
+from ..servers.erasure import get_policy
+
+
+def read_edits(path_to_edits):
+    '''
+        yields the records of an edit log file in order. a torn record at the
+        end (crash in the middle of a write) is ignored
+    '''
+    if not os.path.exists(path_to_edits):
+        return
+    with open(path_to_edits, 'r', encoding='utf-8') as edits_reader:
+        for line in edits_reader:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"ignoring torn record at the end of {path_to_edits}")
+                return
+            yield record
+
+
+def file_block_ids(node):
+    '''
+        ids of the blocks a file keeps on the datanodes, including the units
+        of its erasure coded block groups
+    '''
+    width = get_policy(node.ec_policy).width if node.is_erasure_coded() else 1
+    return [block[0] + i for block in node.blocks for i in range(width)]
+
+
+def apply_edit(fstree, record, block_mapping=None, released_containers=None):
+    '''
+        replays one edit log record onto fstree. block ids of replayed files
+        are added to block_mapping if given, and those of removed files are
+        dropped from it. the container block of a removed packed file is
+        added to released_containers instead, other packed files may still
+        point into it
+    '''
+    op = record['op']
+    if op == 'mkdir':
+        dest_path = parse_path(record['path'])
+        fstree.insert(Inode(dest_path[-1], "DIRECTORY"), dest_path[:-1])
+    elif op == 'put':
+        new_node = Inode(record['name'], "FILE")
+        new_node.set_blocks([tuple(block) for block in record['blocks']])
+        new_node.set_replication(record['replication'])
+        new_node.set_codec(record.get('codec', new_node.codec))
+        new_node.set_ec_policy(record.get('ec_policy'))
+        fstree.insert(new_node, parse_path(record['path']))
+        if block_mapping != None:
+            for block in new_node.blocks:
+                block_mapping.setdefault(block[0], [])
+    elif op == 'put_packed':
+        for path, name, block_offset, length in record['files']:
+            new_node = Inode(name, "FILE")
+            new_node.set_blocks([(record['block_id'], length)])
+            new_node.set_block_offset(block_offset)
+            new_node.set_replication(record['replication'])
+            fstree.insert(new_node, parse_path(path))
+        if block_mapping != None:
+            block_mapping.setdefault(record['block_id'], [])
+    elif op == 'set_ec_policy':
+        fstree.find(parse_path(record['path'])).set_ec_policy(record['ec_policy'])
+    elif op == 'convert':
+        target_file = fstree.find(parse_path(record['path']))
+        if block_mapping != None:
+            for block_id in file_block_ids(target_file):
+                block_mapping.pop(block_id, None)
+        fstree.replace_blocks(target_file, [tuple(block) for block in record['blocks']])
+        target_file.set_ec_policy(record['ec_policy'])
+        target_file.set_replication(record['replication'])
+        if block_mapping != None:
+            for block in target_file.blocks:
+                block_mapping.setdefault(block[0], [])
+    elif op == 'append':
+        target_file = fstree.find(parse_path(record['path']))
+        blocks = [tuple(block) for block in record['blocks']]
+        fstree.replace_blocks(target_file, target_file.blocks + blocks)
+        if block_mapping != None:
+            for block in blocks:
+                block_mapping.setdefault(block[0], [])
+    elif op in ('rm', 'rmdir'):
+        path = parse_path(record['path'])
+        target = fstree.find(path)
+        fstree.remove(path)
+        if block_mapping != None and target.node_type == "FILE":
+            if target.is_packed():
+                if released_containers != None:
+                    released_containers.add(target.blocks[0][0])
+            else:
+                for block_id in file_block_ids(target):
+                    block_mapping.pop(block_id, None)
+    elif op == 'allocate':
+        fstree.currBlockID = max(fstree.currBlockID, record['last_block_id'])
+    else:
+        raise ValueError(f"unknown edit log operation {op}")
+    fstree.lastTxID = record['txid']
+
+
+def replay_edits(fstree, paths_to_edits, block_mapping=None):
+    '''
+        replays the records of the given edit log files that are newer than
+        the fsimage fstree was loaded from, returns the last txid seen
+    '''
+    released_containers = set()
+    for path_to_edits in paths_to_edits:
+        for record in read_edits(path_to_edits):
+            if record['txid'] <= fstree.lastTxID:
+                continue
+            try:
+                apply_edit(fstree, record, block_mapping, released_containers)
+            except INodeError as e:
+                logging.warning(f"could not replay edit {record}: {e}")
+                fstree.lastTxID = record['txid']
+    if block_mapping != None and released_containers:
+        # a container block is dropped once no packed file points into it anymore
+        for node in fstree.iter_nodes_preorder():
+            if node.node_type == "FILE" and node.is_packed():
+                released_containers.discard(node.blocks[0][0])
+        for block_id in released_containers:
+            block_mapping.pop(block_id, None)
+    return fstree.lastTxID
+
+
+def checkpoint(path_to_fsimage, paths_to_edits):
+    '''
+        merges edit log files into the fsimage on a separate FSTree, so the
+        live namespace is never touched. the new fsimage replaces the old one
+        atomically
+    '''
+    fstree = FSTree()
+    fstree.load_fsimage(path_to_fsimage)
+    replay_edits(fstree, paths_to_edits)
+    fstree.save_fs_to_binary_fsimage(f"{path_to_fsimage}.tmp")
+    os.replace(f"{path_to_fsimage}.tmp", path_to_fsimage)
+    return fstree.lastTxID
+
+
+class EditLog:
+    '''
+        append only log of namespace mutations, one json record per line.
+        records logged while a previous group is being fsynced are written
+        and fsynced together as the next group (group commit)
+    '''
+    def __init__(self, path_to_edits, last_txid):
+        self.path = path_to_edits
+        self.txid = last_txid
+        self.pending = []
+        self.syncing = []
+        self.has_pending = None
+        self.write_lock = None
+        self.sync_task = None
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def start(self):
+        self.has_pending = asyncio.Event()
+        self.write_lock = asyncio.Lock()
+        self.sync_task = asyncio.create_task(self.sync_forever())
+
+    async def close(self):
+        await self.flush()
+        if self.sync_task:
+            self.sync_task.cancel()
+        os.close(self.fd)
+
+    def size(self):
+        return os.fstat(self.fd).st_size
+
+    def append(self, op, **fields):
+        '''
+            appends a record right away, so records keep the order their 
+            operations were applied in. returns a future that is done once 
+            the record is durable on disk
+        '''
+        self.txid += 1
+        record = {'txid': self.txid, 'op': op, **fields}
+        committed = asyncio.get_running_loop().create_future()
+        self.pending.append((json.dumps(record) + '\n', committed))
+        self.has_pending.set()
+        return committed
+
+    async def log(self, op, **fields):
+        '''
+            appends a record and returns once it is durable on disk
+        '''
+        await self.append(op, **fields)
+
+    async def flush(self):
+        waiting = self.syncing + self.pending
+        if waiting:
+            await asyncio.gather(*[committed for _, committed in waiting], return_exceptions=True)
+
+    def write_and_sync(self, data):
+        os.write(self.fd, data.encode('utf-8'))
+        os.fsync(self.fd)
+
+    async def sync_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.has_pending.wait()
+            self.has_pending.clear()
+            async with self.write_lock:
+                group, self.pending = self.pending, []
+                self.syncing = group
+                try:
+                    await loop.run_in_executor(None, self.write_and_sync,
+                                               ''.join(line for line, _ in group))
+                except Exception as e:
+                    logging.error(f"edit log write failed: {e!r}")
+                    for _, committed in group:
+                        committed.set_exception(e)
+                else:
+                    for _, committed in group:
+                        committed.set_result(None)
+                finally:
+                    self.syncing = []
+
+    async def roll(self, path_to_rolled):
+        '''
+            moves the records written so far to path_to_rolled and continues
+            in a fresh file. records still pending go to the fresh file
+        '''
+        async with self.write_lock:
+            os.close(self.fd)
+            os.replace(self.path, path_to_rolled)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
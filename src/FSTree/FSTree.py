@@ -1,5 +1,6 @@
 from enum import Enum
 import xml.etree.ElementTree as ET
+import struct
 
 FILE = 1
 DIRECTORY = 2
@@ -16,20 +17,64 @@ NODE_TYPES = {
     DIRECTORY: "DIRECTORY",
     OTHER: "OTHER"
 }
+NODE_TYPE_CODES = {v: k for k, v in NODE_TYPES.items()}
+
+# binary fsimage layout (little endian):
+#   header: FSIMAGE_MAGIC, version, lastInodeId, numInodes, lastBlockId, lastTxId
+#   records: u32 length + inode record, in pre-order so parents come before their 
+#            children, terminated by a zero length
+#   inode record: id, parent id (-1 for the root), type code, u16 name length + name,
+#            and for files u16 replication, u32 block count, u8 codec name length + 
+#            codec name (version 2), i64 offset in its block of a packed file or 
+#            -1 (version 3), then (block id, numBytes) for each block, or 
+#            (block id, numBytes, storedBytes) if the file is compressed. 
+#            version 4 adds u8 length + erasure coding policy name to files 
+#            (before the blocks) and directories (after the name)
+FSIMAGE_MAGIC = b'EDFSIMG\0'
+FSIMAGE_VERSION = 4
+FSIMAGE_HEADER = struct.Struct('<8sHqqqq')
+FSIMAGE_RECORD_LENGTH = struct.Struct('<I')
+FSIMAGE_INODE = struct.Struct('<qqBH')
+FSIMAGE_FILE = struct.Struct('<HI')
+FSIMAGE_CODEC_LENGTH = struct.Struct('<B')
+FSIMAGE_EC_POLICY_LENGTH = struct.Struct('<B')
+FSIMAGE_BLOCK_OFFSET = struct.Struct('<q')
+FSIMAGE_BLOCK = struct.Struct('<qq')
+FSIMAGE_COMPRESSED_BLOCK = struct.Struct('<qqq')
+# codec of files stored uncompressed
+NO_CODEC = "none"
 class INodeError(Exception):
     def __init__(self, message, errors = 400):            
         super().__init__(message)
         self.error_code = errors
 
 class Inode:
+    # a namespace can hold millions of inodes, slots keep each one small
+    __slots__ = ('id', 'parent', 'node_name', 'node_type', 'replication', 
+                 'childs', 'blocks', 'codec', 'block_offset', 'summary', 'ec_policy')
+
     def __init__(self, node_name, node_type):
         self.id = None
         self.parent = None
         self.node_name = node_name
         self.node_type = node_type
         self.replication = 1
-        self.childs = [] if node_type=="DIRECTORY" else None
+        # {child name: child inode}, kept in insertion order for listings
+        self.childs = {} if node_type=="DIRECTORY" else None
+        # (block id, numBytes of the file in the block), plus the storedBytes 
+        # on the datanodes if the file is compressed with codec
         self.blocks = [] if node_type=="FILE" else None
+        self.codec = NO_CODEC if node_type=="FILE" else None
+        # offset of the file in its only block when packed with other small 
+        # files into a shared container block, None for a file of its own
+        self.block_offset = None
+        # [bytes, files, directories, blocks] of everything below a directory, 
+        # kept up to date by FSTree on every insert and remove
+        self.summary = [0, 0, 0, 0] if node_type=="DIRECTORY" else None
+        # erasure coding policy name. a file without one is replicated, its 
+        # blocks are block groups whose units have the ids block id + unit index. 
+        # a directory's policy applies to new files below it, None inherits it
+        self.ec_policy = None
 
     def __repr__(self):
         return "{}:{}{}".format(self.id, self.node_name, ('/' if self.node_type=="DIRECTORY" else ""))
@@ -52,8 +97,47 @@ class Inode:
     def set_blocks(self, blocks):
         self.blocks = blocks.copy()
 
+    def set_codec(self, codec):
+        self.codec = codec
+
+    def set_block_offset(self, block_offset):
+        self.block_offset = block_offset
+
+    def is_packed(self):
+        return self.block_offset != None
+
+    def set_ec_policy(self, ec_policy):
+        self.ec_policy = ec_policy
+
+    def is_erasure_coded(self):
+        return self.node_type == "FILE" and self.ec_policy != None
+
+    def inherited_ec_policy(self):
+        '''
+            the erasure coding policy of the nearest directory up from this 
+            one that has one set
+        '''
+        node = self
+        while node != None and node.ec_policy == None:
+            node = node.parent
+        return node.ec_policy if node != None else None
+
+    def get_size(self):
+        if self.node_type == "FILE":
+            return sum(block[1] for block in self.blocks)
+        return self.summary[0]
+
+    def get_summary(self):
+        '''
+            (bytes, files, directories, blocks) of this inode and everything 
+            below it
+        '''
+        if self.node_type == "FILE":
+            return (self.get_size(), 1, 0, len(self.blocks))
+        return (self.summary[0], self.summary[1], self.summary[2] + 1, self.summary[3])
+
     def display_child(self):
-        return '\t'.join([c.get_name() for c in self.childs])
+        return '\t'.join(self.childs)
 
     def attach_to_xmlnode(self, inode_section, directory_section):
         inode = ET.SubElement(inode_section, 'inode')
@@ -73,7 +157,7 @@ class Inode:
             parent = ET.SubElement(directory, 'parent')
             parent.text = str(self.id)
 
-            for c in self.childs:
+            for c in self.childs.values():
                 child_node = ET.SubElement(directory, 'child')
                 child_node.text = str(c.id)
 
@@ -87,9 +171,33 @@ class Inode:
                 block_id.text = str(b[0])
                 block_num_bytes = ET.SubElement(block, "numBytes")
                 block_num_bytes.text = str(b[1])
+                if len(b) > 2:
+                    block_stored_bytes = ET.SubElement(block, "storedBytes")
+                    block_stored_bytes.text = str(b[2])
+            if self.codec != NO_CODEC:
+                codec = ET.SubElement(inode, "codec")
+                codec.text = self.codec
+            if self.is_packed():
+                block_offset = ET.SubElement(inode, "blockOffset")
+                block_offset.text = str(self.block_offset)
+
+        if self.ec_policy != None:
+            ec_policy = ET.SubElement(inode, "ecPolicy")
+            ec_policy.text = self.ec_policy
 
         return 
 
+def read_ec_policy(node, record, position):
+    '''
+        sets node's erasure coding policy from an fsimage record, returns the 
+        position after it
+    '''
+    (ec_policy_length,) = FSIMAGE_EC_POLICY_LENGTH.unpack_from(record, position)
+    position += FSIMAGE_EC_POLICY_LENGTH.size
+    if ec_policy_length:
+        node.set_ec_policy(record[position:position + ec_policy_length].decode('utf-8'))
+    return position + ec_policy_length
+
 def parse_path(path_str):
     path_list = path_str.split('/')
     if path_list[0] != '':
@@ -101,16 +209,29 @@ def parse_path(path_str):
     return path_list
 
 def insert_node(node_to_insert, parent_node):
-    parent_node.childs.append(node_to_insert)
+    parent_node.childs[node_to_insert.node_name] = node_to_insert
     node_to_insert.parent = parent_node
     return
 
+def add_to_summaries(directory, summary, sign=1):
+    '''
+        adds (or with sign=-1 subtracts) summary to directory and all of its 
+        ancestors, O(depth)
+    '''
+    while directory != None:
+        directory_summary = directory.summary
+        for i in range(4):
+            directory_summary[i] += sign * summary[i]
+        directory = directory.parent
+
 class FSTree:
     def __init__(self):
         self.root = None
         self.num_inodes = None
         self.currInodeID = None
         self.currBlockID = None
+        # txid of the last edit log record reflected in this tree
+        self.lastTxID = 0
 
     def initialize(self, num_inodes, currInodeID, currBlockID):
         self.num_inodes = num_inodes
@@ -121,23 +242,14 @@ class FSTree:
         self.root = root
 
     def find(self, path):
-        def find_rec(curr, path):
-            
-            if len(path)==0:
-                return curr
+        curr = self.root
+        for name in path:
             if curr.childs == None:
                 raise INodeError("Given path is not a valid directory", PATH_NOT_FOUND_ERROR)
-            next_directory = None
-            for d in curr.childs:
-                if d.node_name != path[0]:
-                    continue
-                target = find_rec(d, path[1:])
-                if target == None:
-                    continue
-                return target
-            raise INodeError("Given path not found or is not valid", PATH_NOT_FOUND_ERROR)
-        
-        return find_rec(self.root, path)
+            curr = curr.childs.get(name)
+            if curr == None:
+                raise INodeError("Given path not found or is not valid", PATH_NOT_FOUND_ERROR)
+        return curr
 
     def insert(self, node_to_insert=None, path=None, attempt=False):
         if self.root == None:
@@ -147,7 +259,7 @@ class FSTree:
         if target_directory.node_type != "DIRECTORY":
             raise INodeError("Given path not a directory", PATH_NOT_FOUND_ERROR)
         
-        if node_to_insert.node_name in [x.node_name for x in target_directory.childs]:
+        if node_to_insert.node_name in target_directory.childs:
             raise INodeError("Given path already exists", PATH_DUPLICATE_ERROR)
 
         if attempt:
@@ -158,6 +270,7 @@ class FSTree:
 
         self.num_inodes += 1
         insert_node(node_to_insert, target_directory)
+        add_to_summaries(target_directory, node_to_insert.get_summary())
         return node_to_insert
 
 
@@ -178,12 +291,24 @@ class FSTree:
     def remove_node(self, node_to_remove):
         parent_d = node_to_remove.parent
         if parent_d != None:  
-            parent_d.childs.remove(node_to_remove)
+            del parent_d.childs[node_to_remove.node_name]
+            add_to_summaries(parent_d, node_to_remove.get_summary(), -1)
         node_to_remove.parent = None
-        node_to_remove.childs = []
+        node_to_remove.childs = {}
         return
 
     
+    def replace_blocks(self, node, blocks):
+        '''
+            gives a file new blocks in place, e.g. after it was converted to 
+            another layout
+        '''
+        if node.parent != None:
+            add_to_summaries(node.parent, node.get_summary(), -1)
+        node.set_blocks(blocks)
+        if node.parent != None:
+            add_to_summaries(node.parent, node.get_summary())
+
     def remove_rec(self, path):
         target = self.find(path)
         self.remove_node(target)
@@ -198,7 +323,7 @@ class FSTree:
                 return "{}<{}/>\n".format(indentation+"\t", self_name)
             if node.node_type == "DIRECTORY":
                 xml = "{}<{}>\n".format(indentation,self_name)
-                child_list = node.childs
+                child_list = node.childs.values()
                 for child in child_list:
                     xml += rec_export(child, level+1)
                 xml += "{}</{}>\n".format(indentation, self_name)
@@ -211,7 +336,7 @@ class FSTree:
         def get_all_rec(root):
             if root.childs == None:
                 return [root]
-            child_nodes = [[root]] + [get_all_rec(x) for x in root.childs]
+            child_nodes = [[root]] + [get_all_rec(x) for x in root.childs.values()]
             child_nodes_flattened = [item for child in child_nodes for item in child]
             return child_nodes_flattened
 
@@ -229,6 +354,9 @@ class FSTree:
 
         last_block_id = ET.SubElement(inode_section, 'lastBlockId')
         last_block_id.text = str(self.currBlockID)
+
+        last_txid = ET.SubElement(inode_section, 'lastTxId')
+        last_txid.text = str(self.lastTxID)
         
         all_nodes_in_tree = self.get_all_nodes()
         for node in all_nodes_in_tree:
@@ -250,6 +378,8 @@ class FSTree:
         last_block_id = int(inode_section.find('lastBlockId').text)
 
         self.initialize(num_inodes, last_node_id, last_block_id)
+        last_txid = inode_section.find('lastTxId')
+        self.lastTxID = int(last_txid.text) if last_txid != None else 0
 
         all_nodes = inode_section.findall('inode')
         
@@ -268,11 +398,20 @@ class FSTree:
             if node_type == "FILE":
                 replication = node[3].text
                 blocks = node.find('blocks')
-                blocks_info = [(int(block[0].text), int(block[1].text)) for block in blocks]
+                blocks_info = [tuple(int(field.text) for field in block) for block in blocks]
                 for block in blocks:
                     block_mapping[int(block[0].text)] = []
                 new_node.set_blocks(blocks_info)
                 new_node.set_replication(replication)
+                codec = node.find('codec')
+                if codec != None:
+                    new_node.set_codec(codec.text)
+                block_offset = node.find('blockOffset')
+                if block_offset != None:
+                    new_node.set_block_offset(int(block_offset.text))
+            ec_policy = node.find('ecPolicy')
+            if ec_policy != None:
+                new_node.set_ec_policy(ec_policy.text)
 
             
             inodes[node_id] = new_node
@@ -293,7 +432,152 @@ class FSTree:
                 child_node = inodes[child_id]
                 insert_node(child_node, parent_node)
 
+        self.compute_summaries()
         return block_mapping 
+
+    def compute_summaries(self):
+        '''
+            fills in the directory summaries of a tree built without insert, 
+            children are summed before their parents
+        '''
+        nodes = list(self.iter_nodes_preorder())
+        for node in nodes:
+            if node.node_type == "DIRECTORY":
+                node.summary = [0, 0, 0, 0]
+        for node in reversed(nodes):
+            if node.parent != None:
+                parent_summary = node.parent.summary
+                for i, value in enumerate(node.get_summary()):
+                    parent_summary[i] += value
+
+    def iter_nodes_preorder(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.childs:
+                stack.extend(reversed(node.childs.values()))
+
+    def save_fs_to_binary_fsimage(self, path_to_save):
+        '''
+            streams the tree to a binary fsimage one inode record at a time
+        '''
+        with open(path_to_save, 'wb') as fsimage_writer:
+            fsimage_writer.write(FSIMAGE_HEADER.pack(FSIMAGE_MAGIC, FSIMAGE_VERSION, 
+                self.currInodeID, self.num_inodes, self.currBlockID, self.lastTxID))
+            for node in self.iter_nodes_preorder():
+                name = node.node_name.encode('utf-8')
+                parent_id = node.parent.id if node.parent != None else -1
+                record = [FSIMAGE_INODE.pack(node.id, parent_id, 
+                                             NODE_TYPE_CODES[node.node_type], len(name)), name]
+                ec_policy = node.ec_policy.encode('utf-8') if node.ec_policy != None else b''
+                if node.node_type == "DIRECTORY":
+                    record.append(FSIMAGE_EC_POLICY_LENGTH.pack(len(ec_policy)))
+                    record.append(ec_policy)
+                if node.node_type == "FILE":
+                    codec = node.codec.encode('utf-8') if node.codec != NO_CODEC else b''
+                    block_format = FSIMAGE_COMPRESSED_BLOCK if codec else FSIMAGE_BLOCK
+                    record.append(FSIMAGE_FILE.pack(int(node.replication), len(node.blocks)))
+                    record.append(FSIMAGE_CODEC_LENGTH.pack(len(codec)))
+                    record.append(codec)
+                    record.append(FSIMAGE_BLOCK_OFFSET.pack(
+                        node.block_offset if node.is_packed() else -1))
+                    record.append(FSIMAGE_EC_POLICY_LENGTH.pack(len(ec_policy)))
+                    record.append(ec_policy)
+                    record.extend(block_format.pack(*block) for block in node.blocks)
+                record = b''.join(record)
+                fsimage_writer.write(FSIMAGE_RECORD_LENGTH.pack(len(record)))
+                fsimage_writer.write(record)
+            fsimage_writer.write(FSIMAGE_RECORD_LENGTH.pack(0))
+
+    def load_binary(self, path_to_fsimage):
+        '''
+            streams a binary fsimage into the tree, returns the block mapping 
+            skeleton like load_xml. only the chain of ancestors of the current 
+            record is kept aside, since records come in pre-order
+        '''
+        block_mapping = {}
+        def finish_node(node):
+            # node and everything below it is loaded, count it in its parent
+            if node.parent != None:
+                parent_summary = node.parent.summary
+                for i, value in enumerate(node.get_summary()):
+                    parent_summary[i] += value
+
+        with open(path_to_fsimage, 'rb') as fsimage_reader:
+            magic, version, last_node_id, num_inodes, last_block_id, last_txid = \
+                FSIMAGE_HEADER.unpack(fsimage_reader.read(FSIMAGE_HEADER.size))
+            if magic != FSIMAGE_MAGIC:
+                raise ValueError(f"{path_to_fsimage} is not a binary fsimage")
+            if version > FSIMAGE_VERSION:
+                raise ValueError(f"unsupported fsimage version {version}")
+            self.initialize(num_inodes, last_node_id, last_block_id)
+            self.lastTxID = last_txid
+
+            ancestors = []
+            while True:
+                (record_length,) = FSIMAGE_RECORD_LENGTH.unpack(
+                    fsimage_reader.read(FSIMAGE_RECORD_LENGTH.size))
+                if record_length == 0:
+                    break
+                record = fsimage_reader.read(record_length)
+                node_id, parent_id, type_code, name_length = FSIMAGE_INODE.unpack_from(record)
+                position = FSIMAGE_INODE.size
+                node_name = record[position:position + name_length].decode('utf-8')
+                position += name_length
+                new_node = Inode(node_name, NODE_TYPES[type_code])
+                new_node.set_id(node_id)
+                if new_node.node_type == "DIRECTORY" and version >= 4:
+                    position = read_ec_policy(new_node, record, position)
+                if new_node.node_type == "FILE":
+                    replication, block_count = FSIMAGE_FILE.unpack_from(record, position)
+                    position += FSIMAGE_FILE.size
+                    block_format = FSIMAGE_BLOCK
+                    if version >= 2:
+                        (codec_length,) = FSIMAGE_CODEC_LENGTH.unpack_from(record, position)
+                        position += FSIMAGE_CODEC_LENGTH.size
+                        if codec_length:
+                            new_node.set_codec(record[position:position + codec_length].decode('utf-8'))
+                            block_format = FSIMAGE_COMPRESSED_BLOCK
+                        position += codec_length
+                    if version >= 3:
+                        (block_offset,) = FSIMAGE_BLOCK_OFFSET.unpack_from(record, position)
+                        position += FSIMAGE_BLOCK_OFFSET.size
+                        if block_offset != -1:
+                            new_node.set_block_offset(block_offset)
+                    if version >= 4:
+                        position = read_ec_policy(new_node, record, position)
+                    blocks = list(block_format.iter_unpack(
+                        record[position:position + block_count * block_format.size]))
+                    for block in blocks:
+                        block_mapping[block[0]] = []
+                    new_node.blocks = blocks
+                    new_node.set_replication(replication)
+
+                if parent_id == -1:
+                    self.set_root(new_node)
+                else:
+                    while ancestors[-1].id != parent_id:
+                        finish_node(ancestors.pop())
+                    insert_node(new_node, ancestors[-1])
+                if new_node.node_type == "DIRECTORY":
+                    ancestors.append(new_node)
+                else:
+                    finish_node(new_node)
+            while ancestors:
+                finish_node(ancestors.pop())
+        return block_mapping
+
+    def load_fsimage(self, path_to_fsimage):
+        '''
+            loads a binary or an xml fsimage, whichever the file holds
+        '''
+        with open(path_to_fsimage, 'rb') as fsimage_reader:
+            is_binary = fsimage_reader.read(len(FSIMAGE_MAGIC)) == FSIMAGE_MAGIC
+        if is_binary:
+            return self.load_binary(path_to_fsimage)
+        return self.load_xml(path_to_fsimage)
+
     def __repr__(self):
         return self.FSTree_to_xml()
 
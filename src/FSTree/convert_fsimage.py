@@ -0,0 +1,23 @@
+'''
+    converts an xml fsimage to the binary fsimage format read by the namenode
+
+    usage: python3 -m src.FSTree.convert_fsimage [fsimage.xml] [fsimage.bin]
+'''
+import os
+import sys
+from .FSTree import FSTree
+
+
+def convert_xml_to_binary(path_to_xml, path_to_binary):
+    fstree = FSTree()
+    fstree.load_xml(path_to_xml)
+    fstree.save_fs_to_binary_fsimage(f"{path_to_binary}.tmp")
+    os.replace(f"{path_to_binary}.tmp", path_to_binary)
+    return fstree.num_inodes
+
+
+if __name__ == "__main__":
+    path_to_xml = sys.argv[1] if len(sys.argv) > 1 else 'fsimage/fsimage.xml'
+    path_to_binary = sys.argv[2] if len(sys.argv) > 2 else 'fsimage/fsimage.bin'
+    num_inodes = convert_xml_to_binary(path_to_xml, path_to_binary)
+    print(f"converted {num_inodes} inodes from {path_to_xml} to {path_to_binary}")
@@ -0,0 +1,87 @@
+import struct
+import zlib
+
+# every block is checksummed in chunks of this many bytes, the crc32 of each 
+# chunk is kept in a .crc file next to the block
+CHECKSUM_CHUNK_SIZE = 64*1024
+CHECKSUM_SIZE = 4
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class ChunkChecksums:
+    '''
+        crc32 of every CHECKSUM_CHUNK_SIZE chunk of a block, fed with pieces 
+        of any size while the block is being written
+    '''
+    def __init__(self):
+        self.crcs = []
+        self.crc = 0
+        self.filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), CHECKSUM_CHUNK_SIZE - self.filled)
+            self.crc = zlib.crc32(view[:take], self.crc)
+            self.filled += take
+            view = view[take:]
+            if self.filled == CHECKSUM_CHUNK_SIZE:
+                self.crcs.append(self.crc)
+                self.crc, self.filled = 0, 0
+
+    def digest(self):
+        crcs = self.crcs + ([self.crc] if self.filled else [])
+        return struct.pack(f'<{len(crcs)}I', *crcs)
+
+
+def read_checksums(block_path, first_chunk, chunk_count):
+    '''
+        returns the stored crc32 of chunk_count chunks starting at first_chunk, 
+        or None for blocks written without checksums
+    '''
+    try:
+        with open(f"{block_path}.crc", 'rb') as crc_reader:
+            crc_reader.seek(first_chunk * CHECKSUM_SIZE)
+            data = crc_reader.read(chunk_count * CHECKSUM_SIZE)
+    except FileNotFoundError:
+        return None
+    if len(data) != chunk_count * CHECKSUM_SIZE:
+        raise ChecksumError(f"checksums of {block_path} are truncated")
+    return struct.unpack(f'<{chunk_count}I', data)
+
+
+def read_verified(block_path, offset, length, piece_size):
+    '''
+        yields the bytes of block_path in [offset, offset + length), in pieces 
+        of at most piece_size (a multiple of CHECKSUM_CHUNK_SIZE). only the checksum chunks overlapping 
+        the range are read and verified, a mismatch raises ChecksumError
+    '''
+    if length <= 0:
+        return
+    end = offset + length
+    first_chunk = offset // CHECKSUM_CHUNK_SIZE
+    chunk_count = (end - 1) // CHECKSUM_CHUNK_SIZE - first_chunk + 1
+    expected = read_checksums(block_path, first_chunk, chunk_count)
+    position = first_chunk * CHECKSUM_CHUNK_SIZE
+    with open(block_path, 'rb') as block_reader:
+        block_reader.seek(position)
+        chunk_index = 0
+        while position < end:
+            data = block_reader.read(min(piece_size, chunk_count * CHECKSUM_CHUNK_SIZE 
+                                         - chunk_index * CHECKSUM_CHUNK_SIZE))
+            if not data:
+                raise ChecksumError(f"{block_path} is shorter than expected")
+            if expected != None:
+                for start in range(0, len(data), CHECKSUM_CHUNK_SIZE):
+                    if zlib.crc32(data[start:start + CHECKSUM_CHUNK_SIZE]) != expected[chunk_index]:
+                        raise ChecksumError(f"checksum mismatch in {block_path} at byte {position + start}")
+                    chunk_index += 1
+            else:
+                chunk_index += len(data) // CHECKSUM_CHUNK_SIZE
+            piece_start = max(offset - position, 0)
+            piece_end = min(end - position, len(data))
+            position += len(data)
+            yield data[piece_start:piece_end]
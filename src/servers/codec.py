@@ -0,0 +1,96 @@
+import lzma
+import zlib
+
+# codec of files put without one
+DEFAULT_CODEC = "none"
+
+
+class Codec:
+    '''
+        compresses each block of a file on its own, so every block stays
+        readable without the others. this base codec stores blocks as they are
+    '''
+    name = "none"
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def decompressor(self):
+        '''
+            returns an object with decompress(chunk) and flush(), for
+            decompressing a block while it is being received
+        '''
+        return IdentityDecompressor()
+
+
+class IdentityDecompressor:
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+class ZlibCodec(Codec):
+    def __init__(self, name="zlib", level=6):
+        self.name = name
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+
+class LzmaDecompressor:
+    def __init__(self):
+        self.decompressor = lzma.LZMADecompressor()
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+    def flush(self):
+        return b""
+
+
+class LzmaCodec(Codec):
+    def __init__(self, name="lzma", preset=6):
+        self.name = name
+        self.preset = preset
+
+    def compress(self, data):
+        return lzma.compress(data, preset=self.preset)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+    def decompressor(self):
+        return LzmaDecompressor()
+
+
+# {codec name: codec}, the name is what the namenode records for each file
+CODECS = {}
+
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+
+
+def get_codec(name):
+    codec = CODECS.get(name)
+    if codec == None:
+        raise ValueError(f"unknown codec {name}")
+    return codec
+
+
+register_codec(Codec())
+register_codec(ZlibCodec())
+register_codec(ZlibCodec("zlib-fast", level=1))
+register_codec(LzmaCodec())
@@ -1,72 +1,610 @@
 import asyncio
+import contextlib
 import os
+import shutil
 import sys
+import aiohttp
 from aiohttp import web
 import base64
 import json 
-import glob
 import logging 
+from .checksum import ChecksumError, ChunkChecksums, read_verified
+from .erasure import get_policy
+from .tasks import BackgroundTasks
+
+# size of the pieces a block body is read from / written to disk in
+TRANSFER_CHUNK_SIZE = 1024*1024
+# chunks buffered between receiving a block and forwarding it down the pipeline
+PIPELINE_QUEUE_DEPTH = 8
+# block reads served at the same time, further readers wait for a free slot
+MAX_CONCURRENT_READS = 16
+# seconds between two heartbeats to the namenode
+HEARTBEAT_INTERVAL = 3
+# bytes per second a block copy ordered by the namenode may use, so 
+# re-replication does not starve client reads and writes
+REPLICATION_BANDWIDTH = 20*1024*1024
+# bytes per second the background scrubber reads, and seconds between two full passes
+SCRUB_BANDWIDTH = 8*1024*1024
+SCRUB_PERIOD = 6*3600
 
 def parse_message(message):
     splitted_message = message.split(" ")
     return splitted_message[0], splitted_message[1:]
 
 
+class ThrottledFileResponse(web.FileResponse):
+    '''
+        FileResponse (sendfile when available) that holds a read slot of the 
+        datanode while the file is being sent
+    '''
+    def __init__(self, datanode, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.datanode = datanode
+
+    async def prepare(self, request):
+        async with self.datanode.read_slots:
+            with self.datanode.transfer():
+                return await super().prepare(request)
+
+
 class DataNode:
-    def __init__(self, id, hostname, port, local_storage_path, home_path):
+    def __init__(self, id, hostname, port, local_storage_path, home_path, peers=None, namenode=None):
         self.id = id
         self.local_storage_base_path = f"{local_storage_path}/{self.id}"
         self.info = (hostname, port)
         self.home_path = home_path
+        # {datanode id: (hostname, port)} of the other datanodes, used for write pipelines
+        self.peers = {peer_id: (peer_hostname, peer_port) 
+                      for peer_id, peer_hostname, peer_port in (peers or [])
+                      if peer_id != self.id}
+        self.peer_sessions = {}
+        self.read_slots = asyncio.Semaphore(MAX_CONCURRENT_READS)
+        # (hostname, port) of the namenode heartbeats are sent to
+        self.namenode = namenode
+        self.namenode_session = None
+        self.heartbeat_task = None
+        self.scrub_task = None
+        # scrubs of single blocks asked for through /verify
+        self.verifications = BackgroundTasks()
+        # block reads and writes in progress, reported in heartbeats
+        self.active_transfers = 0
         logging.basicConfig(filename=f'{self.home_path}/logs/{self.id}.log', 
                             encoding='utf-8', level=logging.DEBUG)
+        # {block id: {replica: (path, size, mtime)}} of every block stored on this datanode
+        self.block_index = {}
+        self.used_bytes = 0
+        os.makedirs(self.local_storage_base_path, exist_ok=True)
+        self.build_block_index()
         print(f"datanode {self.id} initialzed, storing at {self.local_storage_base_path}")
 
+    def build_block_index(self):
+        '''
+            scans the storage directory once at startup, so reads, removes and 
+            block reports never have to touch the directory listing again
+        '''
+        if not os.path.exists(self.local_storage_base_path):
+            return
+        for block_filename in os.listdir(self.local_storage_base_path):
+            block_path = f"{self.local_storage_base_path}/{block_filename}"
+            if block_filename.endswith('.tmp'):
+                # left behind by a write that never completed
+                os.remove(block_path)
+                continue
+            if block_filename.endswith('.crc'):
+                continue
+            block_id, _, replica = block_filename.partition('-r')
+            try:
+                self.index_block(int(block_id), int(replica), block_path)
+            except ValueError:
+                logging.warning(f"ignoring unknown file {block_path} in block storage")
+
+    def index_block(self, block_id, replica, block_path):
+        st = os.stat(block_path)
+        replicas = self.block_index.setdefault(block_id, {})
+        if replica in replicas:
+            self.used_bytes -= replicas[replica][1]
+        replicas[replica] = (block_path, st.st_size, st.st_mtime)
+        self.used_bytes += st.st_size
+
+    @contextlib.contextmanager
+    def transfer(self):
+        self.active_transfers += 1
+        try:
+            yield
+        finally:
+            self.active_transfers -= 1
+
     def launch_server(self):
+        web.run_app(self.make_app(), host=self.info[0], port=self.info[1])
+
+    def make_app(self):
         app = web.Application(client_max_size=1024*1024*100)
         app.add_routes([web.post('/write', self.write_block),
                         web.get('/read', self.read_block), 
                         web.get('/blockreport', self.block_report), 
-                        web.delete('/remove/{block_id}', self.remove_block)])
-        web.run_app(app, host=self.info[0], port=self.info[1])
+                        web.delete('/remove/{block_id}', self.remove_block),
+                        web.post('/remove_bulk', self.remove_blocks),
+                        web.post('/replicate', self.replicate_block),
+                        web.post('/reconstruct', self.reconstruct_unit),
+                        web.get('/checksums', self.block_checksums),
+                        web.post('/verify', self.verify_block)])
+        app.on_startup.append(self.open_peer_sessions)
+        app.on_cleanup.append(self.close_peer_sessions)
+        if self.namenode:
+            app.on_startup.append(self.start_heartbeats)
+            app.on_cleanup.append(self.stop_heartbeats)
+        app.on_startup.append(self.start_scrubber)
+        app.on_cleanup.append(self.stop_scrubber)
+        return app
+
+    async def start_heartbeats(self, app):
+        hostname, port = self.namenode
+        timeout = aiohttp.ClientTimeout(total=HEARTBEAT_INTERVAL)
+        self.namenode_session = aiohttp.ClientSession(f'http://{hostname}:{port}', timeout=timeout)
+        self.heartbeat_task = asyncio.create_task(self.heartbeat_forever())
+
+    async def stop_heartbeats(self, app):
+        self.heartbeat_task.cancel()
+        await self.namenode_session.close()
+
+    async def start_scrubber(self, app):
+        self.scrub_task = asyncio.create_task(self.scrub_forever())
+
+    async def stop_scrubber(self, app):
+        self.scrub_task.cancel()
+
+    def heartbeat_report(self):
+        disk = shutil.disk_usage(self.local_storage_base_path)
+        return {
+            "id": self.id,
+            "capacity": disk.total,
+            "free": disk.free,
+            "used": self.used_bytes,
+            "active_transfers": self.active_transfers,
+            "block_count": len(self.block_index)
+        }
+
+    async def heartbeat_forever(self):
+        while True:
+            try:
+                async with self.namenode_session.post('/heartbeat', json=self.heartbeat_report()) as resp:
+                    await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                logging.warning(f"heartbeat to namenode failed: {e!r}")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def scrub_forever(self):
+        '''
+            re-reads every stored replica against its checksums, at most 
+            SCRUB_BANDWIDTH bytes per second, once every SCRUB_PERIOD seconds
+        '''
+        while True:
+            for block_id in list(self.block_index):
+                await self.scrub_block(block_id)
+            await asyncio.sleep(SCRUB_PERIOD)
+
+    async def scrub_block(self, block_id):
+        for replica, (block_path, block_size, _) in list(self.block_index.get(block_id, {}).items()):
+            try:
+                await self.scrub_replica(block_path, block_size)
+            except ChecksumError as e:
+                logging.error(f"scrubber: {e}")
+                await self.report_bad_block(block_id, replica)
+            except FileNotFoundError:
+                # removed while being scrubbed
+                pass
+
+    async def scrub_replica(self, block_path, block_size):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        scrubbed = 0
+        for piece in read_verified(block_path, 0, block_size, TRANSFER_CHUNK_SIZE):
+            scrubbed += len(piece)
+            await asyncio.sleep(max(scrubbed / SCRUB_BANDWIDTH - (loop.time() - started), 0))
+
+    async def report_bad_block(self, block_id, replica):
+        '''
+            drops a corrupt replica and tells the namenode, which stops handing 
+            it out to clients and restores the replica from a healthy one
+        '''
+        self.drop_replica(block_id, replica)
+        if not self.namenode_session:
+            return
+        try:
+            async with self.namenode_session.post('/report_bad_block', 
+                                                  json={"id": self.id, "block_id": block_id}) as resp:
+                await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"could not report bad block {block_id}: {e!r}")
+
+    async def open_peer_sessions(self, app):
+        self.peer_sessions = {peer_id: aiohttp.ClientSession(f'http://{hostname}:{port}')
+                              for peer_id, (hostname, port) in self.peers.items()}
+
+    async def close_peer_sessions(self, app):
+        for session in self.peer_sessions.values():
+            await session.close()
+
+    def drop_replica(self, block_id, replica):
+        replicas = self.block_index.get(block_id, {})
+        if replica not in replicas:
+            return
+        block_path, size, _ = replicas.pop(replica)
+        if not replicas:
+            del self.block_index[block_id]
+        self.used_bytes -= size
+        for path in (block_path, f"{block_path}.crc"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def drop_block(self, block_id):
+        for replica in list(self.block_index.get(block_id, {})):
+            self.drop_replica(block_id, replica)
 
     async def remove_block(self, req):
-        block_id = req.match_info['block_id']
+        try:
+            block_id = int(req.match_info['block_id'])
+        except ValueError:
+            return web.Response(status=400, text=f"invalid block id")
         if not os.path.exists(self.local_storage_base_path):
             return web.Response(status=405, text=f"block directory doesn't exist")
-        for f in glob.glob(f"{self.local_storage_base_path}/{block_id}-r*"):
-            os.remove(f)
+        self.drop_block(block_id)
         return web.Response(status=200, text=f"Blocks successfully removed")
+
+    async def remove_blocks(self, req):
+        '''
+            route: /remove_bulk
+            request body: [block ids]
+        '''
+        try:
+            block_ids = [int(block_id) for block_id in await req.json()]
+        except (ValueError, TypeError):
+            return web.Response(status=400, text=f"invalid block id")
+        for block_id in block_ids:
+            self.drop_block(block_id)
+        return web.Response(status=200, text=f"{len(block_ids)} blocks successfully removed")
    
     async def write_block(self, req):
-        
+        if req.content_type == 'application/octet-stream':
+            return await self.write_block_stream(req)
         data = await req.json()
         block_id = data["block_id"]
         replica = data["replica"]
         block_content = base64.b64decode(data["block_content"].encode('utf-8'))
         logging.info(os.path.exists(self.local_storage_base_path))
+        self.store_block(int(block_id), int(replica), block_content)
+        return web.Response(status=200, text=f"block {block_id} replica {replica} written succesfully")
+
+    def store_block(self, block_id, replica, block_content):
         if not os.path.exists(self.local_storage_base_path):
             os.makedirs(self.local_storage_base_path)
-        with open(f"{self.local_storage_base_path}/{block_id}-r{replica}", 'wb') as block_writer:
+        block_path = f"{self.local_storage_base_path}/{block_id}-r{replica}"
+        checksums = ChunkChecksums()
+        checksums.update(block_content)
+        with open(f"{block_path}.crc", 'wb') as crc_writer:
+            crc_writer.write(checksums.digest())
+        with open(block_path, 'wb') as block_writer:
             block_writer.write(block_content)
-        return web.Response(status=200, text=f"block {block_id} replica {replica} written succesfully")
+        self.index_block(block_id, replica, block_path)
+
+    async def write_block_stream(self, req):
+        '''
+            route: /write?block_id={block_id}&replica={replica}&pipeline={datanode ids}
+            request body: raw block bytes (application/octet-stream)
+            the body is written to disk chunk by chunk as it arrives, into a 
+            temporary file that is only renamed to the block file once complete.
+            checksums are computed on the same chunks and stored in a .crc file.
+            if pipeline (comma separated datanode ids) is given, every chunk is 
+            also forwarded to the first datanode in it while the block is still 
+            arriving, which continues the pipeline with the remaining ids
+            return: json list of the datanode ids that stored the block
+        '''
+        try:
+            block_id = int(req.query['block_id'])
+            replica = int(req.query['replica'])
+        except (KeyError, ValueError):
+            return web.Response(status=400, text="block_id and replica are required")
+        with self.transfer():
+            return await self.receive_block(req, block_id, replica)
+
+    async def receive_block(self, req, block_id, replica):
+        pipeline = [x for x in req.query.get('pipeline', '').split(',') if x]
+        if not os.path.exists(self.local_storage_base_path):
+            os.makedirs(self.local_storage_base_path)
+        block_path = f"{self.local_storage_base_path}/{block_id}-r{replica}"
+        tmp_path = f"{block_path}.tmp"
+        crc_tmp_path = f"{block_path}.crc.tmp"
+        checksums = ChunkChecksums()
+
+        forward_queue, forward_task = None, None
+        if pipeline:
+            forward_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+            forward_task = asyncio.create_task(
+                self.forward_block(block_id, replica + 1, pipeline, forward_queue))
+        try:
+            with open(tmp_path, 'wb') as block_writer:
+                async for chunk in req.content.iter_chunked(TRANSFER_CHUNK_SIZE):
+                    block_writer.write(chunk)
+                    checksums.update(chunk)
+                    if forward_queue:
+                        await forward_queue.put(chunk)
+            with open(crc_tmp_path, 'wb') as crc_writer:
+                crc_writer.write(checksums.digest())
+            os.replace(crc_tmp_path, f"{block_path}.crc")
+            os.replace(tmp_path, block_path)
+            self.index_block(block_id, replica, block_path)
+        except BaseException:
+            if forward_task:
+                # abort the downstream request so the next node drops its partial block
+                forward_task.cancel()
+            for path in (tmp_path, crc_tmp_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
 
+        written = [self.id]
+        if forward_task:
+            await forward_queue.put(None)
+            written += await forward_task
+        return web.Response(status=200, text=json.dumps(written))
+
+    async def forward_block(self, block_id, replica, pipeline, queue):
+        '''
+            streams the chunks put on queue (terminated by None) to the next 
+            datanode of the pipeline, returns the datanode ids that stored the block
+            downstream. a failed downstream node never fails the local write
+        '''
+        finished, forwarded = False, False
+        async def queued_chunks():
+            nonlocal finished, forwarded
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    finished = True
+                    return
+                forwarded = True
+                yield chunk
+
+        written = []
+        # a node that fails before taking any data is skipped, like in a rebuilt hdfs pipeline
+        while pipeline and not written and not forwarded and not finished:
+            next_id, pipeline = pipeline[0], pipeline[1:]
+            params = {"block_id": block_id, "replica": replica}
+            if pipeline:
+                params["pipeline"] = ','.join(pipeline)
+            try:
+                session = self.peer_sessions[next_id]
+                async with session.post('/write', params=params, data=queued_chunks(),
+                                        headers={"Content-Type": "application/octet-stream"}) as resp:
+                    if resp.status == 200:
+                        written = json.loads(await resp.text())
+                    else:
+                        logging.warning(f"pipeline write of block {block_id} to {next_id} failed: {resp.status}")
+            except Exception as e:
+                # whatever went wrong downstream, e.g. an unexpected answer, 
+                # the queue below must still be drained or the local write blocks
+                logging.warning(f"pipeline write of block {block_id} to {next_id} failed: {e!r}")
+        # keep consuming so the receiving side never blocks on a full queue
+        while not finished:
+            if await queue.get() is None:
+                finished = True
+        return written
+
+    async def replicate_block(self, req):
+        '''
+            route: /replicate
+            request body: {"block_id": int, "target": datanode id}
+            copies a stored block to the target datanode, at most 
+            REPLICATION_BANDWIDTH bytes per second. the copy is verified 
+            against the checksums so a corrupt replica is never spread
+        '''
+        data = await req.json()
+        block_id = int(data["block_id"])
+        replicas = self.block_index.get(block_id)
+        if not replicas:
+            return web.Response(status=404, text=f"block not found")
+        session = self.peer_sessions.get(data["target"])
+        if session == None:
+            return web.Response(status=400, text=f"unknown datanode {data['target']}")
+        replica, (block_path, block_size, _) = next(iter(replicas.items()))
+        corrupt = False
+
+        async def throttled_chunks():
+            nonlocal corrupt
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            sent = 0
+            try:
+                for chunk in read_verified(block_path, 0, block_size, TRANSFER_CHUNK_SIZE):
+                    yield chunk
+                    sent += len(chunk)
+                    ahead = sent / REPLICATION_BANDWIDTH - (loop.time() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+            except ChecksumError:
+                corrupt = True
+                raise
+
+        with self.transfer():
+            try:
+                async with session.post('/write', params={"block_id": block_id, "replica": 0},
+                                        data=throttled_chunks(),
+                                        headers={"Content-Type": "application/octet-stream"}) as resp:
+                    resp_text = await resp.text()
+                    if resp.status != 200:
+                        return web.Response(status=502, text=resp_text)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ChecksumError) as e:
+                if corrupt:
+                    await self.report_bad_block(block_id, replica)
+                    return web.Response(status=404, text=f"block {block_id} is corrupt")
+                return web.Response(status=502, text=f"copy to {data['target']} failed: {e!r}")
+        logging.info(f"block {data['block_id']} copied to {data['target']}")
+        return web.Response(status=200, text=resp_text)
+
+    async def reconstruct_unit(self, req):
+        '''
+            route: /reconstruct
+            request body: {"block_id": int, the lost unit, "group_id": int, 
+                           "ec_policy": str, "block_size": int, the group's,
+                           "sources": {unit id: [datanode ids holding it]}}
+            rebuilds a lost unit of an erasure coded block group from 
+            data_units of the other units, read from the datanodes holding 
+            them, and stores it here as the unit's only replica
+            return: json list with the id of this datanode
+        '''
+        data = await req.json()
+        block_id, group_id = int(data["block_id"]), int(data["group_id"])
+        try:
+            policy = get_policy(data["ec_policy"])
+        except ValueError as e:
+            return web.Response(status=400, text=str(e))
+        block_size = int(data["block_size"])
+        unit_size = policy.unit_size(block_size)
+        candidates = [(int(unit_id), holders) for unit_id, holders in data["sources"].items()]
+        units = {}
+        with self.transfer():
+            while len(units) < policy.data_units:
+                wanted = policy.data_units - len(units)
+                if len(candidates) < wanted:
+                    return web.Response(status=503, text=f"block group {group_id} has too few units left")
+                batch, candidates = candidates[:wanted], candidates[wanted:]
+                fetched = await asyncio.gather(*[self.fetch_unit(unit_id, holders, unit_size)
+                                                 for unit_id, holders in batch])
+                for (unit_id, _), content in zip(batch, fetched):
+                    if content != None:
+                        units[unit_id - group_id] = content
+            index = block_id - group_id
+            rebuild = lambda: policy.encode(policy.decode(units, block_size))[index]
+            content = await asyncio.get_running_loop().run_in_executor(None, rebuild)
+            self.store_block(block_id, 0, content)
+        logging.info(f"unit {block_id} of block group {group_id} rebuilt from {len(units)} units")
+        return web.Response(status=200, text=json.dumps([self.id]))
+
+    async def fetch_unit(self, block_id, holders, unit_size):
+        '''
+            the verified content of a unit from the first of its holders that 
+            can serve it, None if none can
+        '''
+        params = {"id": block_id, "offset": 0, "length": unit_size}
+        for datanode_id in holders:
+            if datanode_id == self.id and block_id in self.block_index:
+                replica, (block_path, _, _) = next(iter(self.block_index[block_id].items()))
+                try:
+                    return b''.join(read_verified(block_path, 0, unit_size, TRANSFER_CHUNK_SIZE))
+                except ChecksumError as e:
+                    logging.error(f"read of unit {block_id}: {e}")
+                    await self.report_bad_block(block_id, replica)
+                    continue
+            session = self.peer_sessions.get(datanode_id)
+            if session == None:
+                continue
+            try:
+                async with session.get('/read', params=params) as resp:
+                    if resp.status == 200:
+                        return await resp.read()
+                    logging.warning(f"unit {block_id} could not be read from {datanode_id}: {resp.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"unit {block_id} could not be read from {datanode_id}: {e!r}")
+        return None
+
+    async def block_checksums(self, req):
+        '''
+            route: /checksums?id={block_id}
+            return: the crc32 of every CHECKSUM_CHUNK_SIZE chunk of the block, 
+            4 bytes little endian each, so clients can verify whole-block reads
+        '''
+        try:
+            replicas = self.block_index.get(int(req.query['id']))
+        except ValueError:
+            return web.Response(status=400, text=f"invalid block id")
+        if not replicas:
+            return web.Response(status=404, text=f"block not found")
+        block_path, _, _ = next(iter(replicas.values()))
+        if not os.path.exists(f"{block_path}.crc"):
+            return web.Response(status=404, text=f"block has no checksums")
+        return web.FileResponse(f"{block_path}.crc")
+
+    async def verify_block(self, req):
+        '''
+            route: /verify?id={block_id}
+            a client saw a checksum mismatch reading the block, the replicas 
+            are checked in the background and dropped if really corrupt
+        '''
+        try:
+            block_id = int(req.query['id'])
+        except ValueError:
+            return web.Response(status=400, text=f"invalid block id")
+        self.verifications.spawn(self.scrub_block(block_id))
+        return web.Response(status=202, text=f"verifying block {block_id}")
+
+    def requested_range(self, req, block_size):
+        '''
+            returns the (offset, length) of the block requested through ?offset=&length=
+        '''
+        offset = int(req.query['offset'])
+        length = int(req.query.get('length', block_size - offset))
+        if offset < 0 or length < 0 or offset > block_size:
+            raise ValueError("Requested range not satisfiable")
+        return offset, min(length, block_size - offset)
 
     async def read_block(self, req):
-        block_id = req.query['id']
-        logging.info(f"{self.local_storage_base_path}/{block_id}-r*")
-        for f in glob.glob(f"{self.local_storage_base_path}/{block_id}-r*"):
-            with open(f, 'rb') as block_reader:
-                block_content = block_reader.read(-1)
-                return web.Response(status=200, body=block_content)
-        return web.Response(status=404, text=f"block not found")
+        '''
+            route: /read?id={block_id}&offset={offset}&length={length}
+            offset and length are optional, an http Range header is honored too
+            return: the requested bytes of the block. whole blocks and Range 
+            requests are sent with sendfile and left to the scrubber for 
+            verification, offset/length reads are checked against the 
+            checksums of the chunks they touch while streamed. at most 
+            MAX_CONCURRENT_READS reads are served at once
+        '''
+        try:
+            block_id = int(req.query['id'])
+        except ValueError:
+            return web.Response(status=400, text=f"invalid block id")
+        replicas = self.block_index.get(block_id)
+        if not replicas:
+            return web.Response(status=404, text=f"block not found")
+        replica, (block_path, block_size, _) = next(iter(replicas.items()))
+        if 'offset' not in req.query:
+            return ThrottledFileResponse(self, block_path, chunk_size=TRANSFER_CHUNK_SIZE)
+        async with self.read_slots:
+            with self.transfer():
+                return await self.stream_block_range(req, block_id, replica, block_path, block_size)
+
+    async def stream_block_range(self, req, block_id, replica, block_path, block_size):
+        try:
+            offset, length = self.requested_range(req, block_size)
+        except ValueError as e:
+            return web.Response(status=416, text=str(e))
+        pieces = read_verified(block_path, offset, length, TRANSFER_CHUNK_SIZE)
+        try:
+            # the first piece is checked before answering, so small reads of a 
+            # corrupt replica get an error status the client can fall back on
+            first_piece = next(pieces, b'')
+        except ChecksumError as e:
+            logging.error(f"read of block {block_id}: {e}")
+            await self.report_bad_block(block_id, replica)
+            return web.Response(status=404, text=f"block {block_id} is corrupt")
+        resp = web.StreamResponse(status=200)
+        resp.content_type = 'application/octet-stream'
+        resp.content_length = length
+        await resp.prepare(req)
+        await resp.write(first_piece)
+        try:
+            for piece in pieces:
+                await resp.write(piece)
+        except ChecksumError as e:
+            # already answering, the dropped connection makes the client try another replica
+            logging.error(f"read of block {block_id}: {e}")
+            await self.report_bad_block(block_id, replica)
+            raise
+        await resp.write_eof()
+        return resp
         
     async def block_report(self, req):
-        if not os.path.exists(self.local_storage_base_path):
-            return web.Response(status=200, text=json.dumps([]))
-        blocks_holding = [block_filename.split('-')[0] 
-                            for block_filename 
-                            in os.listdir(self.local_storage_base_path)]
+        blocks_holding = [str(block_id) for block_id in self.block_index]
         return web.Response(status=200, text=json.dumps(blocks_holding))
 
 def run_datanode(*args):
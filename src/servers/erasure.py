@@ -0,0 +1,186 @@
+# policy of files stored as full replicas
+REPLICATED = "replicated"
+# primitive polynomial of GF(2^8), x^8 + x^4 + x^3 + x^2 + 1
+GF_POLYNOMIAL = 0x11d
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= GF_POLYNOMIAL
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_inv(a):
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return GF_EXP[255 - GF_LOG[a]]
+
+
+# {coefficient: bytes.translate table multiplying every byte by it}
+_MUL_TABLES = {}
+
+
+def mul_table(c):
+    table = _MUL_TABLES.get(c)
+    if table == None:
+        table = bytes(gf_mul(c, x) for x in range(256))
+        _MUL_TABLES[c] = table
+    return table
+
+
+def combine(coefficients, units, size, unit_ints=None):
+    '''
+        sum over GF(256) of coefficient * unit for equally sized units. a
+        whole unit is multiplied at once with bytes.translate and the units
+        are added (xored) as big integers, so the per-byte work runs in C
+        instead of a python loop. unit_ints caches the integer value of the
+        units that are added as they are, for reuse by the next combine
+    '''
+    acc = 0
+    for i, (c, unit) in enumerate(zip(coefficients, units)):
+        if c == 0:
+            continue
+        if c == 1 and unit_ints != None:
+            if unit_ints[i] == None:
+                unit_ints[i] = int.from_bytes(unit, 'little')
+            acc ^= unit_ints[i]
+            continue
+        if c != 1:
+            unit = unit.translate(mul_table(c))
+        acc ^= int.from_bytes(unit, 'little')
+    return acc.to_bytes(size, 'little')
+
+
+def invert_matrix(matrix):
+    '''
+        inverse of a square matrix over GF(256) by gauss-jordan elimination
+    '''
+    n = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next((r for r in range(col, n) if rows[r][col]), None)
+        if pivot == None:
+            raise ValueError("matrix is singular")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        inverse = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(inverse, x) for x in rows[col]]
+        for r in range(n):
+            factor = rows[r][col]
+            if r != col and factor:
+                rows[r] = [x ^ gf_mul(factor, y) for x, y in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+class ErasurePolicy:
+    '''
+        reed-solomon coding over GF(256). a block is cut into data_units
+        equally sized units (the last one zero padded) and parity_units
+        parity units are computed from them; any data_units of the
+        data_units + parity_units units rebuild the block. the code is
+        systematic, data units hold the block's bytes as they are, and the
+        parity rows form a cauchy matrix so any data_units rows are invertible.
+        its rows and columns are scaled so the first row and column are all
+        ones, which keeps that property and makes those products plain xors
+    '''
+    def __init__(self, name, data_units, parity_units):
+        self.name = name
+        self.data_units = data_units
+        self.parity_units = parity_units
+        self.width = data_units + parity_units
+        cauchy = [[gf_inv((data_units + r) ^ j) for j in range(data_units)]
+                  for r in range(parity_units)]
+        column_scale = [gf_inv(x) for x in cauchy[0]]
+        self.parity_matrix = []
+        for row in cauchy:
+            row = [gf_mul(x, scale) for x, scale in zip(row, column_scale)]
+            row_scale = gf_inv(row[0])
+            self.parity_matrix.append([gf_mul(x, row_scale) for x in row])
+
+    def unit_size(self, block_size):
+        return -(-block_size // self.data_units)
+
+    def overhead(self):
+        '''
+            bytes stored per byte of data
+        '''
+        return self.width / self.data_units
+
+    def split(self, content):
+        unit_size = self.unit_size(len(content))
+        units = [content[i * unit_size:(i + 1) * unit_size] for i in range(self.data_units)]
+        return [unit.ljust(unit_size, b'\0') for unit in units]
+
+    def encode(self, content):
+        '''
+            returns the data units followed by the parity units of a block
+        '''
+        data = self.split(content)
+        unit_size = len(data[0])
+        data_ints = [None] * self.data_units
+        return data + [combine(row, data, unit_size, data_ints) for row in self.parity_matrix]
+
+    def generator_row(self, index):
+        if index < self.data_units:
+            return [int(index == j) for j in range(self.data_units)]
+        return self.parity_matrix[index - self.data_units]
+
+    def decode(self, units, block_size):
+        '''
+            rebuilds a block of block_size bytes from {unit index: unit}
+            holding at least data_units of its units
+        '''
+        unit_size = self.unit_size(block_size)
+        data = [units.get(i) for i in range(self.data_units)]
+        missing = [i for i, unit in enumerate(data) if unit == None]
+        if missing:
+            present = sorted(units)[:self.data_units]
+            if len(present) < self.data_units:
+                raise ValueError(f"{self.name} needs {self.data_units} units, got {len(present)}")
+            inverse = invert_matrix([self.generator_row(i) for i in present])
+            sources = [units[i] for i in present]
+            source_ints = [None] * len(sources)
+            for i in missing:
+                data[i] = combine(inverse[i], sources, unit_size, source_ints)
+        return b''.join(data)[:block_size]
+
+
+class XorPolicy(ErasurePolicy):
+    '''
+        a single parity unit, the xor of the data units. survives the loss
+        of any one unit, and needs no multiplications at all
+    '''
+    def __init__(self, name, data_units):
+        super().__init__(name, data_units, 1)
+        self.parity_matrix = [[1] * data_units]
+
+
+# {policy name: policy}, the name is what the namenode records for each file
+POLICIES = {}
+
+
+def register_policy(policy):
+    POLICIES[policy.name] = policy
+
+
+def get_policy(name):
+    policy = POLICIES.get(name)
+    if policy == None:
+        raise ValueError(f"unknown erasure coding policy {name}")
+    return policy
+
+
+register_policy(ErasurePolicy("rs-6-3", 6, 3))
+register_policy(ErasurePolicy("rs-3-2", 3, 2))
+register_policy(XorPolicy("xor-2-1", 2))
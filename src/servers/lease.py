@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import secrets
+import time
+from ..FSTree.FSTree import INodeError
+
+# seconds a writer may go without renewing its lease before its file is recovered
+LEASE_EXPIRY = 60
+# seconds between two scans for expired leases
+LEASE_CHECK_INTERVAL = 5
+
+
+class Lease:
+    '''
+        the right of one writer to add blocks to a file under construction.
+        blocks are kept in allocation order as the allocations handed out by
+        /add_block, each updated with the datanodes that stored it once the
+        writer reports it written
+    '''
+    def __init__(self, path, node):
+        self.id = secrets.token_urlsafe(16)
+        self.path = path
+        self.node = node
+        self.blocks = []
+        # ids of the blocks reported written
+        self.written = set()
+        self.renewed = time.monotonic()
+
+    def renew(self):
+        self.renewed = time.monotonic()
+
+    def report_written(self, reports):
+        '''
+            takes the written blocks a writer reports: the allocation with
+            "datanode_id" (or the "datanode_id" of every unit) narrowed to
+            the datanodes that stored it, and the "stored_size" of a
+            compressed block
+        '''
+        allocations = {block["block_id"]: block for block in self.blocks}
+        for report in reports:
+            block = allocations.get(report.get("block_id"))
+            if block == None:
+                raise INodeError(f"Block {report.get('block_id')} was not allocated to this lease", 400)
+            if "units" in block:
+                for unit, reported_unit in zip(block["units"], report["units"]):
+                    unit["datanode_id"] = reported_unit["datanode_id"]
+            else:
+                block["datanode_id"] = report["datanode_id"]
+            if "stored_size" in report:
+                block["stored_size"] = report["stored_size"]
+            self.written.add(block["block_id"])
+
+    def written_prefix(self):
+        '''
+            the blocks up to the first one that was not reported written,
+            the part of the file that can be committed
+        '''
+        prefix = []
+        for block in self.blocks:
+            if block["block_id"] not in self.written:
+                break
+            prefix.append(block)
+        return prefix
+
+
+class LeaseManager:
+    '''
+        hands out leases on files under construction, one writer per file,
+        and has the namenode recover the files of writers that stopped
+        renewing theirs for LEASE_EXPIRY seconds
+    '''
+    def __init__(self, namenode):
+        self.namenode = namenode
+        # {lease id: lease}
+        self.leases = {}
+        # {file inode id: lease id} of the files under construction
+        self.writers = {}
+
+    def grant(self, path, node):
+        if node.id in self.writers:
+            raise INodeError("File is being written by another client", 409)
+        lease = Lease(path, node)
+        self.leases[lease.id] = lease
+        self.writers[node.id] = lease.id
+        return lease
+
+    def get(self, lease_id):
+        '''
+            the lease with that id, renewed
+        '''
+        lease = self.leases.get(lease_id)
+        if lease == None:
+            raise INodeError("Lease expired or unknown", 404)
+        lease.renew()
+        return lease
+
+    def is_under_construction(self, node):
+        return node.id in self.writers
+
+    def release(self, lease):
+        self.leases.pop(lease.id, None)
+        self.writers.pop(lease.node.id, None)
+
+    async def expire_forever(self):
+        while True:
+            await asyncio.sleep(LEASE_CHECK_INTERVAL)
+            now = time.monotonic()
+            expired = [lease for lease in self.leases.values() if now - lease.renewed > LEASE_EXPIRY]
+            for lease in expired:
+                logging.warning(f"lease on {lease.path} expired, recovering the file")
+                try:
+                    await self.namenode.recover_lease(lease)
+                except Exception as e:
+                    logging.error(f"recovering {lease.path} failed: {e!r}")
+                    self.release(lease)
@@ -1,13 +1,116 @@
 import asyncio
+import aiohttp
 from aiohttp import web
 import random
 import json
+import base64
+import secrets
+from collections import OrderedDict
 import logging
-import requests
 import time
-from ..FSTree.FSTree import Inode, INodeError, FSTree, parse_path, INVALID_PATH_ERROR
+from ..FSTree.FSTree import Inode, INodeError, FSTree, parse_path, INVALID_PATH_ERROR, NO_CODEC
+from ..FSTree.EditLog import EditLog, replay_edits, checkpoint
+from .replication import ReplicationManager
+from .lease import LeaseManager
+from .erasure import REPLICATED, get_policy
+from .codec import get_codec
+from .tasks import BackgroundTasks
 import os
 
+# a checkpoint merges the edit log into the fsimage once the log grows past 
+# CHECKPOINT_EDITS_SIZE bytes, or CHECKPOINT_PERIOD seconds after the last one
+CHECKPOINT_EDITS_SIZE = 16*1024*1024
+CHECKPOINT_PERIOD = 3600
+CHECKPOINT_CHECK_INTERVAL = 10
+# seconds to wait for a single datanode's block report at startup
+BLOCK_REPORT_TIMEOUT = 10
+# routes that change the namespace, refused while in safe mode
+SAFE_MODE_BLOCKED_ROUTES = {'/put', '/allocate', '/mkdir', '/rm', '/rmdir', 
+                            '/allocate_container', '/put_packed', '/batch',
+                            '/set_ec_policy', '/convert', '/create', '/append',
+                            '/add_block', '/complete'}
+# a datanode that has not sent a heartbeat for this many seconds is considered dead
+STALE_DATANODE_INTERVAL = 10
+# entries of a recursive listing sent per write, the event loop is yielded in between
+LS_RECURSIVE_BATCH = 1000
+# entries a paginated listing returns per page at most
+LS_MAX_LIMIT = 10000
+# paginated listings kept open at once, and seconds a listing's cursor stays valid after a page
+LS_MAX_OPEN_LISTINGS = 256
+LS_LISTING_TTL = 300
+
+
+def place_replicas(datanode_stats, count, block_size, now, exclude=()):
+    '''
+        picks up to count distinct live datanodes for a new block. nodes that 
+        are stale or cannot fit the block are skipped; among the others the 
+        least loaded win (active transfers from the last heartbeat plus blocks 
+        scheduled since), with more free space breaking ties. datanodes in 
+        exclude (e.g. the ones already holding the block) are never picked
+    '''
+    candidates = [(datanode_id, stats) for datanode_id, stats in datanode_stats.items()
+                  if now - stats['last_heartbeat'] < STALE_DATANODE_INTERVAL 
+                  and stats['free'] >= block_size and datanode_id not in exclude]
+    # shuffle first so equally loaded nodes with equal space take turns
+    random.shuffle(candidates)
+    candidates.sort(key=lambda c: (c[1]['active_transfers'] + c[1]['scheduled_blocks'], -c[1]['free']))
+    choice = []
+    for datanode_id, stats in candidates[:count]:
+        # account for the new block until it is reported written or the next heartbeat
+        stats['scheduled_blocks'] += 1
+        stats['free'] -= block_size
+        choice.append(datanode_id)
+    return choice
+
+
+def iter_subtree(path_lst, directory):
+    '''
+        yields (path, inode) for everything below directory in pre-order. 
+        children are copied when a directory is expanded, so the namespace 
+        may change between two steps
+    '''
+    prefix = '/' + '/'.join(path_lst) if path_lst else ''
+    stack = [(prefix, list(reversed(directory.childs.values())))]
+    while stack:
+        parent_path, children = stack[-1]
+        if not children:
+            stack.pop()
+            continue
+        node = children.pop()
+        node_path = f"{parent_path}/{node.node_name}"
+        yield node_path, node
+        if node.node_type == "DIRECTORY" and node.childs:
+            stack.append((node_path, list(reversed(node.childs.values()))))
+
+
+def allocated_replicas(blocks):
+    '''
+        {block id: datanode ids} of the blocks (or block group units) of an 
+        allocation
+    '''
+    replicas = {}
+    for block in blocks:
+        for stored in block.get("units", [block]):
+            replicas[stored["block_id"]] = stored["datanode_id"]
+    return replicas
+
+
+def encode_listing_cursor(token, position):
+    return base64.urlsafe_b64encode(f"{token}:{position}".encode()).decode()
+
+
+def decode_listing_cursor(cursor):
+    '''
+        returns (listing token, position in the listing), raises ValueError 
+        for a malformed cursor
+    '''
+    try:
+        token, position = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit(':', 1)
+    except (ValueError, UnicodeError):
+        raise ValueError(f"invalid cursor {cursor}")
+    return token, int(position)
+
+
 class NameNode():
     def __init__(self, hostname, port, blocksize, replicationfactor, datanode_info, home_path):
         self.fstree = FSTree()
@@ -18,6 +121,14 @@ class NameNode():
         self.home_path = home_path
         # {id: [datanodes that hold the replica]}
         self.block_mapping = {}
+        # {container block id: number of packed files still stored in it}
+        self.container_files = {}
+        # {unit id: (group id, policy name, group block size)} of the units of erasure 
+        # coded block groups, each unit is kept as a single replica
+        self.ec_units = {}
+        # {file inode id: time of its last /get}, files not read since startup count from then
+        self.last_read = {}
+        self.started = time.monotonic()
         folder = os.path.exists(f'{self.home_path}/logs')
         if not folder:
             os.mkdir(f'{self.home_path}/logs')
@@ -33,86 +144,616 @@ class NameNode():
         logging.basicConfig(filename=f'{self.home_path}/logs/namenode.log', 
                             encoding='utf-8', level=logging.DEBUG)
         logging.info(self.datanodes_avaliable)
-        self.fsimage_path = f"{self.home_path}/fsimage/fsimage.xml"
+        self.fsimage_path = f"{self.home_path}/fsimage/fsimage.bin"
+        # fsimage format used before fsimage.bin, only read if there is no fsimage.bin yet
+        self.xml_fsimage_path = f"{self.home_path}/fsimage/fsimage.xml"
+        self.edits_path = f"{self.home_path}/fsimage/edits.log"
+        # edits rolled out of edits.log that are being merged into the fsimage
+        self.rolled_edits_path = f"{self.home_path}/fsimage/edits.log.1"
+        self.edit_log = None
+        self.checkpoint_task = None
+        # until every datanode has reported its blocks (or timed out), only reads are served
+        self.safe_mode = True
+        self.block_report_task = None
+        self.datanode_sessions = {}
+        # {datanode id: latest heartbeat report + "last_heartbeat" and "scheduled_blocks"}
+        self.datanode_stats = {}
+        self.replication = ReplicationManager(self)
+        # removals of replicas that are no longer part of any file
+        self.replica_removals = BackgroundTasks()
+        # metadata operations that can be sent through /batch
+        self.batch_ops = {'mkdir': self.apply_mkdir, 'rm': self.apply_rm, 'rmdir': self.apply_rmdir,
+                          'allocate': self.apply_allocate, 'put': self.apply_put}
+        self.replication_task = None
+        # leases of the files under construction through /create and /append
+        self.leases = LeaseManager(self)
+        self.lease_task = None
+        # {listing token: (expiry time, directory, child names)} of paginated listings, oldest first
+        self.listings = OrderedDict()
 
-    def launch_server(self):
-        logging.info(f'Listening on port {self.info[1]}')
-        app = web.Application(client_max_size=1024*1024*1000)
+    def make_app(self):
+        app = web.Application(client_max_size=1024*1024*1000, 
+                              middlewares=[self.safe_mode_guard])
         app.add_routes([web.get('/ls', self.ls),
                         web.get('/ls_html', self.ls_html),
+                        web.get('/du', self.du),
+                        web.get('/count', self.count),
                         web.put('/put', self.put),
                         web.put('/allocate', self.allocate_block),
+                        web.put('/allocate_container', self.allocate_container),
+                        web.put('/put_packed', self.put_packed),
                         web.put('/mkdir', self.mkdir),
                         web.delete('/rm', self.rm),
                         web.delete('/rmdir', self.rmdir),
-                        web.get('/get', self.get)])
-        web.run_app(app, host=self.info[0], port=self.info[1])
+                        web.get('/get', self.get),
+                        web.get('/cold_files', self.cold_files),
+                        web.put('/set_ec_policy', self.set_ec_policy),
+                        web.put('/convert', self.convert),
+                        web.put('/create', self.create),
+                        web.put('/append', self.append),
+                        web.put('/add_block', self.add_block),
+                        web.put('/complete', self.complete),
+                        web.put('/renew_lease', self.renew_lease),
+                        web.post('/batch', self.batch),
+                        web.post('/heartbeat', self.heartbeat),
+                        web.get('/replication_status', self.replication_status),
+                        web.post('/report_bad_block', self.report_bad_block)])
+        app.on_startup.append(self.start_background_tasks)
+        app.on_cleanup.append(self.stop_background_tasks)
+        return app
+
+    def launch_server(self):
+        logging.info(f'Listening on port {self.info[1]}')
+        web.run_app(self.make_app(), host=self.info[0], port=self.info[1])
 
 
-    def choose_datanodes(self, count):
+    def choose_datanodes(self, count, block_size=None):
+        if self.datanode_stats:
+            choice = place_replicas(self.datanode_stats, count, block_size or self.block_size, 
+                                    time.monotonic())
+            return choice, len(choice)
+        # no heartbeats received yet, fall back to the configured datanodes
         datanodes = [x[0] for x in self.datanodes_avaliable]
         if count > len(datanodes):
             return datanodes, len(datanodes)
         random.shuffle(datanodes)
         choice = datanodes[:count]
         return choice, count
+
+    def choose_replication_target(self, exclude):
+        return place_replicas(self.datanode_stats, 1, self.block_size, time.monotonic(), exclude)
+
+    def live_datanodes(self):
+        now = time.monotonic()
+        return {datanode_id for datanode_id, stats in self.datanode_stats.items()
+                if now - stats['last_heartbeat'] < STALE_DATANODE_INTERVAL}
+
+    def replication_target(self, block_id):
+        if block_id in self.ec_units:
+            # a lost unit is rebuilt from the other units of its group, not copied
+            return 1
+        # a block cannot have more replicas than there are datanodes to hold them
+        return min(self.replication_factor, len(self.live_datanodes()))
+
+    def check_ec_width(self, policy):
+        '''
+            rejects a policy with more units than there are live datanodes: 
+            its units would share datanodes, and losing one of them could 
+            lose more units than the parity makes up for
+        '''
+        datanode_count = len(self.live_datanodes()) if self.datanode_stats else len(self.datanodes_avaliable)
+        if policy.width > datanode_count:
+            raise INodeError(f"{policy.name} spreads {policy.width} units, "
+                             f"only {datanode_count} datanodes are live", 400)
+
+    def block_units(self, node, block):
+        '''
+            ids of the blocks stored on datanodes for a block of the file node: 
+            the block itself, or the units of an erasure coded block group
+        '''
+        if node.is_erasure_coded():
+            return range(block[0], block[0] + get_policy(node.ec_policy).width)
+        return (block[0],)
+
+    def register_units(self, node):
+        '''
+            adds the units of an erasure coded file to block_mapping and ec_units
+        '''
+        for block in node.blocks:
+            for unit_id in self.block_units(node, block):
+                self.block_mapping.setdefault(unit_id, [])
+                self.ec_units[unit_id] = (block[0], node.ec_policy, block[1])
         
     def initialize(self):
-        self.block_mapping = self.fstree.load_xml(self.fsimage_path)
-        for datanode in self.datanodes_avaliable:
-            url = f"http://{datanode[1]}:{datanode[2]}/blockreport"
-            try:
-                resp = requests.get(url).json()
-            except:
-                pass
-            for block_id in resp:
-                try:
-                    self.block_mapping[int(block_id)].append(datanode[0])
-                except KeyError:
+        if os.path.exists(self.fsimage_path):
+            self.block_mapping = self.fstree.load_binary(self.fsimage_path)
+        else:
+            self.block_mapping = self.fstree.load_xml(self.xml_fsimage_path)
+            self.save_fsimage()
+            logging.info(f'Converted {self.xml_fsimage_path} to {self.fsimage_path}')
+        last_txid = replay_edits(self.fstree, [self.rolled_edits_path, self.edits_path], 
+                                 self.block_mapping)
+        logging.info(f'Namespace loaded up to txid {last_txid}')
+        for node in self.fstree.iter_nodes_preorder():
+            if node.node_type == "FILE" and node.is_packed():
+                container_id = node.blocks[0][0]
+                self.container_files[container_id] = self.container_files.get(container_id, 0) + 1
+            elif node.is_erasure_coded():
+                self.register_units(node)
+        self.edit_log = EditLog(self.edits_path, last_txid)
+
+    async def collect_block_reports(self):
+        '''
+            gathers the block reports of all datanodes concurrently, each under 
+            BLOCK_REPORT_TIMEOUT, then leaves safe mode
+        '''
+        await asyncio.gather(*[self.collect_block_report(datanode_id) 
+                               for datanode_id in self.datanode_sessions])
+        self.safe_mode = False
+        logging.info('Block reports collected, leaving safe mode')
+
+    async def collect_block_report(self, datanode_id):
+        session = self.datanode_sessions[datanode_id]
+        timeout = aiohttp.ClientTimeout(total=BLOCK_REPORT_TIMEOUT)
+        try:
+            async with session.get('/blockreport', timeout=timeout) as resp:
+                block_report = json.loads(await resp.text())
+            orphan_blocks = []
+            for block_id in block_report:
+                holders = self.block_mapping.get(int(block_id))
+                if holders == None:
                     #block not found in filesystem metadata, remove the block
-                    delete_url = f"http://{datanode[1]}:{datanode[2]}/remove/{block_id}"
-                    d_resp = requests.delete(delete_url)
-                except:
-                    pass
-            
+                    orphan_blocks.append(int(block_id))
+                elif datanode_id not in holders:
+                    holders.append(datanode_id)
+            if orphan_blocks:
+                async with session.post('/remove_bulk', json=orphan_blocks, timeout=timeout) as resp:
+                    logging.info(f'{datanode_id}: {await resp.text()}')
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logging.warning(f'No block report from {datanode_id}: {e!r}')
 
-    async def rm(self, req):
-        req_body = await req.json()
+    @web.middleware
+    async def safe_mode_guard(self, req, handler):
+        if self.safe_mode and req.path in SAFE_MODE_BLOCKED_ROUTES:
+            return web.Response(status=503, text="NameNode is in safe mode, try again later")
+        return await handler(req)
+
+    async def start_background_tasks(self, app):
+        self.datanode_sessions = {datanode_id: aiohttp.ClientSession(f'http://{hostname}:{port}')
+                                  for datanode_id, hostname, port in self.datanodes_avaliable}
+        self.edit_log.start()
+        self.checkpoint_task = asyncio.create_task(self.checkpoint_forever())
+        self.block_report_task = asyncio.create_task(self.collect_block_reports())
+        self.replication_task = asyncio.create_task(self.replication.replicate_forever())
+        self.lease_task = asyncio.create_task(self.leases.expire_forever())
+
+    async def stop_background_tasks(self, app):
+        self.checkpoint_task.cancel()
+        self.block_report_task.cancel()
+        self.replication_task.cancel()
+        self.lease_task.cancel()
+        await self.edit_log.close()
+        for session in self.datanode_sessions.values():
+            await session.close()
+
+    async def checkpoint_forever(self):
+        last_checkpoint = time.monotonic()
+        while True:
+            await asyncio.sleep(CHECKPOINT_CHECK_INTERVAL)
+            if (self.edit_log.size() < CHECKPOINT_EDITS_SIZE and 
+                time.monotonic() - last_checkpoint < CHECKPOINT_PERIOD):
+                continue
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logging.error(f'Checkpoint failed: {e!r}')
+            last_checkpoint = time.monotonic()
+
+    async def checkpoint(self):
+        '''
+            rolls the edit log and merges the rolled edits into a fresh fsimage
+            in a worker thread, off the live namespace
+        '''
+        if not os.path.exists(self.rolled_edits_path):
+            await self.edit_log.roll(self.rolled_edits_path)
+        checkpoint_txid = await asyncio.get_running_loop().run_in_executor(
+            None, checkpoint, self.fsimage_path, [self.rolled_edits_path])
+        os.remove(self.rolled_edits_path)
+        logging.info(f'Checkpointed namespace up to txid {checkpoint_txid}')
+
+    def block_written(self, datanode_id):
+        '''
+            a block write placed on datanode_id finished, so it no longer adds to 
+            the node's load until the next heartbeat refreshes it
+        '''
+        stats = self.datanode_stats.get(datanode_id)
+        if stats == None:
+            return
+        if stats['scheduled_blocks'] > 0:
+            stats['scheduled_blocks'] -= 1
+        elif stats['active_transfers'] > 0:
+            stats['active_transfers'] -= 1
+
+    async def heartbeat(self, req):
+        '''
+            route: /heartbeat
+            request body: {"id", "capacity", "free", "used", "active_transfers", "block_count"}
+        '''
+        report = await req.json()
+        report['last_heartbeat'] = time.monotonic()
+        report['scheduled_blocks'] = 0
+        if report['id'] not in self.datanode_stats:
+            logging.info(f"datanode {report['id']} is alive")
+        self.datanode_stats[report['id']] = report
+        return web.Response(text="ok")
+
+    async def report_bad_block(self, req):
+        '''
+            route: /report_bad_block
+            request body: {"id": datanode id, "block_id": int}
+            the datanode dropped a replica that failed its checksums
+        '''
+        report = await req.json()
+        block_id = report['block_id']
+        holders = self.block_mapping.get(block_id)
+        if holders != None and report['id'] in holders:
+            holders.remove(report['id'])
+            logging.warning(f"replica of block {block_id} on {report['id']} is corrupt")
+            self.replication.enqueue(block_id)
+        return web.Response(text="ok")
+
+    async def replication_status(self, req):
+        '''
+            route: /replication_status
+            return: {"queue_depth", "in_flight", "recovered", "failed", 
+                     "recovery_rate": blocks recovered per second over the last minute,
+                     "dead_datanodes"}
+        '''
+        return web.Response(text=json.dumps(self.replication.status()))
+
+    def forget_blocks(self, removed_file):
+        '''
+            drops the blocks of a removed file from block_mapping, returns the
+            dropped entries. replicas left on datanodes are removed with the
+            next block report
+        '''
+        forgotten = {}
+        for block in removed_file.blocks:
+            block_id = block[0]
+            if removed_file.is_packed():
+                # a container block lives on until its last packed file is removed
+                self.container_files[block_id] -= 1
+                if self.container_files[block_id] > 0:
+                    continue
+                del self.container_files[block_id]
+            for unit_id in self.block_units(removed_file, block):
+                if unit_id in self.block_mapping:
+                    forgotten[unit_id] = self.block_mapping.pop(unit_id)
+                self.ec_units.pop(unit_id, None)
+        return forgotten
+
+    # the apply_* metadata operations change the namespace without touching
+    # the edit log. each returns (response, edit log record, undo), where undo
+    # reverts the change as long as nothing applied after it depends on it
+
+    def apply_rm(self, req_body):
+        path = req_body['path']
+        path_lst = parse_path(path)
+        target_file = self.fstree.find(path_lst)
+        if target_file.node_type == "DIRECTORY":
+            raise INodeError("Cannot rm a directory", 405)
+        self.fstree.remove(path_lst)
+        forgotten = self.forget_blocks(target_file)
+        self.last_read.pop(target_file.id, None)
+
+        def undo():
+            # remove_node leaves an empty childs dict behind, files have none
+            target_file.childs = None
+            self.fstree.insert(target_file, path_lst[:-1])
+            self.block_mapping.update(forgotten)
+            if target_file.is_erasure_coded():
+                self.register_units(target_file)
+            if target_file.is_packed():
+                container_id = target_file.blocks[0][0]
+                self.container_files[container_id] = self.container_files.get(container_id, 0) + 1
+        return 'File removed from filesystem', {'op': 'rm', 'path': path}, undo
+
+    def apply_rmdir(self, req_body):
         path = req_body['path']
+        path_lst = parse_path(path)
+        target_dir = self.fstree.find(path_lst)
+        if target_dir.node_type == "FILE":
+            raise INodeError("Cannot rmdir a file", 405)
+        self.fstree.remove(path_lst)
+        undo = lambda: self.fstree.insert(target_dir, path_lst[:-1])
+        return 'Directory removed from filesystem', {'op': 'rmdir', 'path': path}, undo
 
-        try: 
-            path_lst = parse_path(path)
-            target_file = self.fstree.find(path_lst)
+    def apply_mkdir(self, req_body):
+        dest_path = parse_path(req_body["path"])
+        if len(dest_path) == 0:
+            raise INodeError("Given path is invalid", INVALID_PATH_ERROR)
+        new_dir_node = Inode(dest_path[-1], "DIRECTORY")
+        self.fstree.insert(new_dir_node, dest_path[:-1])
+        undo = lambda: self.fstree.remove(dest_path)
+        return "Successfully created directory", {'op': 'mkdir', 'path': req_body["path"]}, undo
 
-            if target_file.node_type == "DIRECTORY":
-                return web.Response(status=405, text="Cannot rm a directory")
-            self.fstree.remove(path_lst)
+    def file_ec_policy(self, req_body, parent_path):
+        '''
+            the erasure coding policy a new file is stored with: the one asked 
+            for, or else the one set on its directory. None for replication, 
+            also when there are too few live datanodes for the directory's policy
+        '''
+        ec_policy = req_body.get("ec_policy") or self.fstree.find(parent_path).inherited_ec_policy()
+        if ec_policy in (None, REPLICATED):
+            return None
+        try:
+            policy = get_policy(ec_policy)
+        except ValueError as e:
+            raise INodeError(str(e), 400)
+        try:
+            self.check_ec_width(policy)
         except INodeError as e:
-            return web.Response(status=e.error_code, text=str(e))
+            if req_body.get("ec_policy"):
+                raise
+            # replicas keep the file safe until there are datanodes enough for the directory's policy
+            logging.warning(f"{e}, storing {req_body['name']} replicated")
+            return None
+        if req_body.get("codec", NO_CODEC) != NO_CODEC:
+            raise INodeError("Compressed files cannot be erasure coded", 400)
+        return ec_policy
+
+    def allocate_block_group(self, block_id, block_size, policy):
+        '''
+            places the units of a block group, each on its own datanode
+        '''
+        unit_size = policy.unit_size(block_size)
+        choosed_datanodes, actual_count = self.choose_datanodes(policy.width, unit_size)
+        if actual_count == 0:
+            return None
+        if actual_count < policy.width:
+            # units sharing a datanode could be lost together, beyond what the parity makes up for
+            raise INodeError(f"Only {actual_count} datanodes can take the {policy.width} units "
+                             f"of block group {block_id}", 503)
+        return {"block_id": block_id, "block_size": block_size,
+                "units": [{"block_id": block_id + i, "datanode_id": [choosed_datanodes[i % actual_count]]}
+                          for i in range(policy.width)]}
+
+    def allocate_file_block(self, block_size, policy):
+        '''
+            reserves the next block id, or the ids of a block group with an 
+            erasure coding policy, and places the block
+        '''
+        block_id = self.fstree.currBlockID
+        if policy != None:
+            block = self.allocate_block_group(block_id, block_size, policy)
         else:
-            return web.Response(text='File removed from filesystem')
+            choosed_datanodes, actual_replica_count = self.choose_datanodes(self.replication_factor)
+            block = None
+            if actual_replica_count > 0:
+                block = {"block_id": block_id, "datanode_id": choosed_datanodes, "block_size": block_size}
+        if block == None:
+            raise INodeError("No live datanode can store the block", 503)
+        # the units of a group take the ids following the group's
+        self.fstree.currBlockID += policy.width if policy != None else 1
+        return block
 
-    async def rmdir(self, req):
-        req_body = await req.json()
-        path = req_body['path']
+    def apply_allocate(self, req_body):
+        item_name = req_body["name"]
+        item_size = req_body["size"]
+        path_to_put = req_body["path"]
+        block_count = (item_size // self.block_size) + 1
+        logging.info(path_to_put)
+        parent_path = parse_path(path_to_put)
+        new_node = Inode(item_name, "FILE")
+        block_sizes = [min(self.block_size, item_size - i * self.block_size) for i in range(block_count)]
+        if req_body.get("replace"):
+            # blocks for a new layout of an existing file, see /convert
+            target_file = self.fstree.find(parent_path + [item_name])
+            if target_file.node_type != "FILE":
+                raise INodeError("Only files can be converted", 405)
+            # appends leave partial blocks inside the file, every block keeps its size
+            block_sizes = [block[1] for block in target_file.blocks]
+            block_count = len(block_sizes)
+        else:
+            self.fstree.insert(new_node, parent_path, attempt=True)
+        ec_policy = self.file_ec_policy(req_body, parent_path)
+        policy = get_policy(ec_policy) if ec_policy != None else None
+
+        response = {
+            "block_count": block_count,
+            "full_block_size": self.block_size,
+            "block_info": []
+        }
+        if policy != None:
+            response["ec_policy"] = ec_policy
+        first_block_id = self.fstree.currBlockID
+        try:
+            for curr_block_size in block_sizes:
+                response["block_info"].append(self.allocate_file_block(curr_block_size, policy))
+        except INodeError:
+            self.fstree.currBlockID = first_block_id
+            raise
+
+        def undo():
+            self.fstree.currBlockID = first_block_id
+        # allocated ids are never handed out again, even after a crash
+        return response, {'op': 'allocate', 'last_block_id': self.fstree.currBlockID}, undo
+
+    def apply_put(self, req_body):
+        item_name = req_body["name"]
+        path_to_put = req_body["path"]
+        allocation = req_body["allocation"]
+        block_info = allocation["block_info"]
 
-        try: 
-            path_lst = parse_path(path)
-            target_file = self.fstree.find(path_lst)
+        parent_path = parse_path(path_to_put)
+        new_node = Inode(item_name, "FILE")
+        new_node.set_blocks(self.blocks_from_allocation(block_info))
+        new_node.set_replication(1 if "ec_policy" in allocation else self.replication_factor)
+        new_node.set_codec(req_body.get("codec", new_node.codec))
+        new_node.set_ec_policy(allocation.get("ec_policy"))
+        self.fstree.insert(new_node, parent_path)
+        previous_mapping = self.map_written_blocks(block_info)
+        if new_node.is_erasure_coded():
+            self.register_units(new_node)
+
+        def undo():
+            self.fstree.remove(parent_path + [item_name])
+            for block_id, holders in previous_mapping.items():
+                self.ec_units.pop(block_id, None)
+                if holders == None:
+                    self.block_mapping.pop(block_id, None)
+                else:
+                    self.block_mapping[block_id] = holders
+        edit = {'op': 'put', 'name': item_name, 'path': path_to_put, 'blocks': new_node.blocks,
+                'replication': new_node.replication, 'codec': new_node.codec, 
+                'ec_policy': new_node.ec_policy}
+        return "Successfully put file", edit, undo
+
+    def blocks_from_allocation(self, block_info):
+        blocks = []
+        for block in block_info:
+            if "stored_size" in block:
+                blocks.append((block["block_id"], block["block_size"], block["stored_size"]))
+            else:
+                blocks.append((block["block_id"], block["block_size"]))
+        return blocks
+
+    def map_written_blocks(self, block_info):
+        '''
+            adds the datanodes that stored the blocks (or block group units) of 
+            an allocation to block_mapping, returns the previous holders
+        '''
+        previous_mapping = {}
+        for block in block_info:
+            for stored in block.get("units", [block]):
+                block_id = stored["block_id"]
+                datanode_id = stored["datanode_id"]
+                previous_mapping[block_id] = self.block_mapping.get(block_id)
+                self.block_mapping[block_id] = self.block_mapping.get(block_id, []) + datanode_id
+                for written_datanode in datanode_id:
+                    self.block_written(written_datanode)
+        return previous_mapping
 
-            if target_file.node_type == "FILE":
-                return web.Response(status=405, text="Cannot rmdir a file")
-            self.fstree.remove(path_lst)
+    async def run_op(self, apply, req):
+        try:
+            result, edit, _ = apply(await req.json())
         except INodeError as e:
             return web.Response(status=e.error_code, text=str(e))
-        else:
-            return web.Response(text='Directory removed from filesystem')
+        await self.edit_log.log(**edit)
+        return web.Response(text=result if isinstance(result, str) else json.dumps(result))
 
+    async def rm(self, req):
+        '''
+            route: /rm
+            request body: {"path": str}
+        '''
+        return await self.run_op(self.apply_rm, req)
+
+    async def rmdir(self, req):
+        '''
+            route: /rmdir
+            request body: {"path": str}
+        '''
+        return await self.run_op(self.apply_rmdir, req)
+
+    async def mkdir(self, req):
+        '''
+            route: /mkdir
+            request body: {"path": str}
+        '''
+        return await self.run_op(self.apply_mkdir, req)
+
+    async def allocate_block(self, req):
+        '''
+            route: /allocate
+            request body: {
+                "name": str,
+                "size": int,
+                "path": str,
+                "ec_policy": str, optional, the directory's policy by default,
+                "replace": bool, optional, allocate for an existing file (see /convert),
+                    with blocks of the sizes of the file's current blocks
+            }
+            return:
+            response object:
+            {
+                "block_count": int
+                "full_block_size": int
+                "block_info": [{"block_id": str
+                                "datanode_id": [str of datanode ids that will hold replica]
+                                }]
+            }
+            for an erasure coded file the response has "ec_policy", and each 
+            block is a block group with "units": [{"block_id", "datanode_id"}] 
+            instead of a datanode_id
+        '''
+        return await self.run_op(self.apply_allocate, req)
+
+    async def put(self, req):
+        '''
+            route: /put
+            request body: {
+                "name": str,
+                "size": int,
+                "path": str,
+                "codec": str, optional,
+                "allocation: json response from allocate request, with a
+                    "stored_size" added to each block of a compressed file
+            }
+            return: Success
+        '''
+        return await self.run_op(self.apply_put, req)
+
+    async def batch(self, req):
+        '''
+            route: /batch
+            request body: {
+                "ops": [{"op": "mkdir" | "rm" | "rmdir" | "allocate" | "put",
+                         "args": request body of that route}],
+                "atomic": bool, optional
+            }
+            applies the ops in order within one event loop turn, so no other
+            request sees a half applied batch, and commits their edit log
+            records as one group. in an atomic batch the first failing op rolls
+            back the ops applied before it
+            return: {"results": [{"status": int, "result": response of the route}]}
+                    with status 409 if an atomic batch was rolled back
+        '''
+        req_body = await req.json()
+        ops = req_body["ops"]
+        results, edits, undos = [], [], []
+        for i, op in enumerate(ops):
+            try:
+                apply = self.batch_ops.get(op.get("op"))
+                if apply == None:
+                    raise INodeError(f"Unknown operation {op.get('op')}", 400)
+                result, edit, undo = apply(op.get("args", {}))
+            except (INodeError, KeyError, TypeError, ValueError) as e:
+                status = e.error_code if isinstance(e, INodeError) else 400
+                results.append({"status": status, "result": str(e)})
+                if req_body.get("atomic"):
+                    for undo in reversed(undos):
+                        undo()
+                    for applied in results[:-1]:
+                        applied.update(status=409, result="Rolled back")
+                    results += [{"status": 424, "result": "Not applied"} for _ in ops[i + 1:]]
+                    return web.Response(status=409, text=json.dumps({"results": results}))
+                continue
+            results.append({"status": 200, "result": result})
+            edits.append(edit)
+            undos.append(undo)
+        # appended in the order the ops were applied, and fsynced as one group
+        await asyncio.gather(*[self.edit_log.append(**edit) for edit in edits])
+        return web.Response(text=json.dumps({"results": results}))
 
     async def ls(self, req):
         '''
-            route: /ls?path={path_to_ls(urlencoded)}
-            return: metadata as text
+            route: /ls?path={path_to_ls(urlencoded)}&recursive=1
+                   /ls?path={path_to_ls(urlencoded)}&limit={n}&cursor={cursor}
+            return: metadata as text. with recursive=1, every inode below path 
+            as json lines {"path", "type", "size"}, streamed in pre-order. with 
+            a limit, {"entries": up to limit entries, "cursor": pass it to get 
+            the next page, null after the last one}
         '''
         try:
             path_to_ls = req.query['path']
@@ -123,14 +764,111 @@ class NameNode():
         except INodeError as e:
             return web.Response(status=e.error_code, text=str(e))
         else:
-            response = [{"name": x.node_name, 
-                        "type": x.node_type} 
-                        for x in found_node.childs]
-            return web.Response(text=json.dumps(response))
+            if req.query.get('recursive') == '1':
+                return await self.ls_recursive(req, path_lst, found_node)
+            return self.list_directory(req, found_node, lambda x: {"name": x.node_name, 
+                                                                   "type": x.node_type})
+
+    def list_directory(self, req, directory, entry):
+        '''
+            the response of /ls and /ls_html: entry(child) for every child of 
+            directory or, given a limit, for one page of them. the first page 
+            snapshots the child names, and its cursor lets later pages continue 
+            from that snapshot, so each page costs O(limit). children removed 
+            since the snapshot are skipped, ones added since are not listed
+        '''
+        if 'limit' not in req.query:
+            return web.Response(text=json.dumps([entry(x) for x in directory.childs.values()]))
+        try:
+            limit = int(req.query['limit'])
+            if limit <= 0:
+                raise ValueError
+            limit = min(limit, LS_MAX_LIMIT)
+            token, start = decode_listing_cursor(req.query['cursor']) if 'cursor' in req.query else (None, 0)
+        except ValueError:
+            return web.Response(status=400, text="limit must be a positive integer and cursor one returned by /ls")
+        now = time.monotonic()
+        # drop listings that were abandoned
+        while self.listings and next(iter(self.listings.values()))[0] < now:
+            self.listings.popitem(last=False)
+        if token == None:
+            token, names = secrets.token_urlsafe(12), list(directory.childs)
+        else:
+            listing = self.listings.get(token)
+            if listing == None or listing[1] is not directory:
+                return web.Response(status=410, text="Listing cursor expired, start the listing again")
+            names = listing[2]
+        page, position = [], start
+        while position < len(names) and len(page) < limit:
+            child = directory.childs.get(names[position])
+            position += 1
+            if child != None:
+                page.append(entry(child))
+        if position < len(names) or start > 0:
+            # kept until it expires, also after the last page, so a page can be retried
+            self.listings[token] = (now + LS_LISTING_TTL, directory, names)
+            self.listings.move_to_end(token)
+            if len(self.listings) > LS_MAX_OPEN_LISTINGS:
+                self.listings.popitem(last=False)
+        cursor = encode_listing_cursor(token, position) if position < len(names) else None
+        return web.Response(text=json.dumps({"entries": page, "cursor": cursor}))
+
+    async def ls_recursive(self, req, path_lst, directory):
+        resp = web.StreamResponse()
+        resp.content_type = 'application/x-ndjson'
+        await resp.prepare(req)
+        lines = []
+        for node_path, node in iter_subtree(path_lst, directory):
+            lines.append(json.dumps({"path": node_path, "type": node.node_type, 
+                                     "size": node.get_size()}))
+            if len(lines) >= LS_RECURSIVE_BATCH:
+                await resp.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                lines = []
+                # let other requests in between batches of a large listing
+                await asyncio.sleep(0)
+        if lines:
+            await resp.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        await resp.write_eof()
+        return resp
+
+    def find_for_summary(self, req):
+        path_lst = parse_path(req.query['path'])
+        return self.fstree.find(path_lst)
+
+    async def du(self, req):
+        '''
+            route: /du?path={path}
+            return: {"path", "bytes"}, answered from the directory summaries 
+            without walking the tree
+        '''
+        try:
+            found_node = self.find_for_summary(req)
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        return web.Response(text=json.dumps({"path": req.query['path'], 
+                                             "bytes": found_node.get_size()}))
+
+    async def count(self, req):
+        '''
+            route: /count?path={path}
+            return: {"path", "directories", "files", "bytes", "blocks"}, like 
+            hdfs dfs -count the directory itself is counted. blocks counts 
+            block references, so a container shared by packed files counts 
+            once per file
+        '''
+        try:
+            found_node = self.find_for_summary(req)
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        size, files, directories, blocks = found_node.get_summary()
+        return web.Response(text=json.dumps({"path": req.query['path'], "directories": directories,
+                                             "files": files, "bytes": size, "blocks": blocks}))
 
     async def ls_html(self, req):
         '''
-            route: /ls?path={path_to_ls(urlencoded)}
+            route: /ls_html?path={path_to_ls(urlencoded)}&limit={n}&cursor={cursor}&summary=1
+            limit and cursor page through the entries like /ls; with summary=1 
+            entries have "block_count" instead of the block lists
             return: metadata as text
         '''
         try:
@@ -142,140 +880,439 @@ class NameNode():
         except INodeError as e:
             return web.Response(status=e.error_code, text=str(e))
         else:
-            response = [{"name": x.node_name,
+            blocks_field = "block_count" if req.query.get('summary') == '1' else "blocks"
+            def entry(x):
+                return {"name": x.node_name,
                         "type": x.node_type,
                         "replication": x.replication,
-                        "blocks": x.blocks
-                         }
-                        for x in found_node.childs]
-            return web.Response(text=json.dumps(response))
+                        blocks_field: len(x.blocks or ()) if blocks_field == "block_count" else x.blocks,
+                        "codec": x.codec,
+                        "ec_policy": x.ec_policy,
+                        "size": x.get_size()
+                        }
+            return self.list_directory(req, found_node, entry)
 
     async def get(self, req):
+        '''
+            route: /get?path={path}&offset={offset}&length={length}
+            offset and length are optional; a negative offset counts from the 
+            end of the file
+            return: [{"block_id", "num_bytes", "block_mapping", 
+                      "offset": start of the range in the block, 
+                      "length": bytes of the range in the block,
+                      "codec", "stored_bytes": size of the block on the datanodes}] 
+                    for the blocks covering the requested range. num_bytes, 
+                    offset and length count uncompressed bytes. for a packed 
+                    file ("packed": true) offset is relative to the container block. 
+                    a block group of an erasure coded file has "ec_policy" and 
+                    "units": [{"block_id", "block_mapping"}] in unit order instead 
+                    of a block_mapping of its own
+        '''
         try:
             path_to_get = req.query['path']
             path_lst = parse_path(path_to_get)
             found_node = self.fstree.find(path_lst)
             if found_node.node_type != "FILE":
                 return web.Response(status=405, text="Cannot get a directory")
+            offset = int(req.query.get('offset', 0))
+            length = int(req.query['length']) if 'length' in req.query else None
         except INodeError as e:
             return web.Response(status=e.error_code, text=str(e))
+        except ValueError:
+            return web.Response(status=400, text="offset and length must be integers")
         else:
+            self.last_read[found_node.id] = time.monotonic()
             file_composition_blocks = found_node.blocks
-            file_composition = [
-                {'block_id': block_id,
-                'block_mapping': self.block_mapping[block_id]}
-                for (block_id, numbytes) in file_composition_blocks
-            ]
+            file_size = sum(block[1] for block in file_composition_blocks)
+            if offset < 0:
+                offset = max(file_size + offset, 0)
+            end = file_size if length == None else min(offset + length, file_size)
+            file_composition = []
+            block_start = 0
+            for block in file_composition_blocks:
+                block_id, numbytes = block[0], block[1]
+                block_end = block_start + numbytes
+                if (block_end > offset and block_start < end) or (offset == 0 and length == None):
+                    range_start = max(offset, block_start) - block_start
+                    range_end = min(end, block_end) - block_start
+                    # a packed file is a range of its container block
+                    container_offset = found_node.block_offset if found_node.is_packed() else 0
+                    located = {'block_id': block_id,
+                               'num_bytes': numbytes,
+                               'block_mapping': self.block_mapping[block_id],
+                               'offset': container_offset + range_start,
+                               'length': range_end - range_start,
+                               'codec': found_node.codec,
+                               'stored_bytes': block[-1],
+                               'packed': found_node.is_packed()}
+                    if found_node.is_erasure_coded():
+                        located['block_mapping'] = []
+                        located['ec_policy'] = found_node.ec_policy
+                        located['units'] = [{'block_id': unit_id, 'block_mapping': self.block_mapping[unit_id]}
+                                            for unit_id in self.block_units(found_node, block)]
+                    file_composition.append(located)
+                block_start = block_end
         
             return web.Response(text=json.dumps(file_composition))
 
-    async def mkdir(self, req):
+    async def cold_files(self, req):
+        '''
+            route: /cold_files?path={path}&idle={seconds}&min_size={bytes}
+            return: [{"path", "size"}] of the replicated files below path of at 
+            least min_size bytes that were not read for idle seconds, the 
+            candidates for an erasure coded layout. packed and compressed files 
+            are left out
+        '''
         try:
-            req_body = await req.json()
-            
-            dest_path = parse_path(req_body["path"])
-            if len(dest_path) == 0:
-                raise INodeError("Given path is invalid", INVALID_PATH_ERROR)
-            dir_name = dest_path[-1]
-            parent_path = dest_path[:-1]
-            new_dir_node = Inode(dir_name, "DIRECTORY")
-            self.fstree.insert(new_dir_node, parent_path)
+            path_lst = parse_path(req.query['path'])
+            directory = self.fstree.find(path_lst)
+            if directory.node_type != "DIRECTORY":
+                return web.Response(status=405, text="Target is not a directory")
+            idle = float(req.query.get('idle', 0))
+            min_size = int(req.query.get('min_size', 0))
         except INodeError as e:
             return web.Response(status=e.error_code, text=str(e))
-        else:
-            return web.Response(text="Successfully created directory")
+        except ValueError:
+            return web.Response(status=400, text="idle and min_size must be numbers")
+        now = time.monotonic()
+        cold = []
+        for i, (node_path, node) in enumerate(iter_subtree(path_lst, directory)):
+            if (node.node_type == "FILE" and not node.is_erasure_coded() and not node.is_packed() 
+                    and node.codec == NO_CODEC and node.get_size() >= min_size 
+                    and now - self.last_read.get(node.id, self.started) >= idle):
+                cold.append({"path": node_path, "size": node.get_size()})
+            if i % LS_RECURSIVE_BATCH == LS_RECURSIVE_BATCH - 1:
+                await asyncio.sleep(0)
+        return web.Response(text=json.dumps(cold))
 
+    async def set_ec_policy(self, req):
+        '''
+            route: /set_ec_policy
+            request body: {"path": str, "ec_policy": policy name, "replicated", 
+                           or null to use the parent directory's again}
+            new files below the directory are stored with the policy, files 
+            already there keep their layout until converted. a policy with 
+            more units than there are live datanodes is rejected
+        '''
+        req_body = await req.json()
+        path, ec_policy = req_body["path"], req_body.get("ec_policy")
+        try:
+            directory = self.fstree.find(parse_path(path))
+            if directory.node_type != "DIRECTORY":
+                raise INodeError("Policies are set on directories, convert a file instead", 405)
+            if ec_policy not in (None, REPLICATED):
+                self.check_ec_width(get_policy(ec_policy))
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        except ValueError as e:
+            return web.Response(status=400, text=str(e))
+        directory.set_ec_policy(ec_policy)
+        await self.edit_log.log('set_ec_policy', path=path, ec_policy=ec_policy)
+        return web.Response(text="Successfully set erasure coding policy")
 
-    async def allocate_block(self, req):
+    async def convert(self, req):
         '''
-            route: /allocate
+            route: /convert
             request body: {
-                "name": str,
-                "size": int,
-                "path": str
-            }
-            return: 
-            response object: 
-            {
-                "block_count": int
-                "full_block_size": int
-                "block_info": [{"block_id": str
-                                "datanode_id": [str of datanode ids that will hold replica]
-                                }] 
+                "path": str,
+                "source_blocks": [block ids of the file when its conversion started],
+                "allocation": json response from an allocate request with 
+                    "replace": true, after its blocks were written
             }
-        ''' 
-        
-        
+            switches the file to the blocks of the allocation, e.g. from 
+            replicas to an erasure coded layout. the file is left alone with 
+            409 if it changed since the conversion started, or if the new blocks 
+            do not hold exactly the bytes of the old ones. replicas of the 
+            old blocks are removed from the datanodes
+            return: Success
+        '''
+        req_body = await req.json()
+        path = req_body["path"]
+        allocation = req_body["allocation"]
+        blocks = self.blocks_from_allocation(allocation["block_info"])
         try:
-            req_body = await req.json()
-            item_name = req_body["name"]
-            item_size = req_body["size"]
-            path_to_put = req_body["path"]
-            block_count = (item_size // self.block_size) + 1
-            logging.info(path_to_put)
-            parent_path = parse_path(path_to_put)
-            new_node = Inode(item_name, "FILE")
-            self.fstree.insert(new_node, parent_path, attempt=True)
+            target_file = self.fstree.find(parse_path(path))
         except INodeError as e:
             return web.Response(status=e.error_code, text=str(e))
-        else:
-            response = {
-                "block_count": block_count,
-                "full_block_size": self.block_size,
-                "block_info": []
-            }
-            remaining_size = item_size
-            for i in range(block_count):
-                block_id = self.fstree.currBlockID
-                self.fstree.currBlockID += 1
-                curr_block_size = min(remaining_size, self.block_size)
-                remaining_size -= self.block_size
-                choosed_datanodes, actual_replica_count = self.choose_datanodes(self.replication_factor)
+        if (target_file.node_type != "FILE" or target_file.is_packed() or 
+                self.leases.is_under_construction(target_file) or
+                [block[0] for block in target_file.blocks] != req_body["source_blocks"] or 
+                [block[1] for block in blocks] != [block[1] for block in target_file.blocks]):
+            return web.Response(status=409, text="File changed while being converted")
+        if "ec_policy" in allocation and target_file.codec != NO_CODEC:
+            return web.Response(status=400, text="Compressed files cannot be erasure coded")
+        forgotten = self.forget_blocks(target_file)
+        self.fstree.replace_blocks(target_file, blocks)
+        target_file.set_ec_policy(allocation.get("ec_policy"))
+        target_file.set_replication(1 if "ec_policy" in allocation else self.replication_factor)
+        self.map_written_blocks(allocation["block_info"])
+        if target_file.is_erasure_coded():
+            self.register_units(target_file)
+        await self.edit_log.log('convert', path=path, blocks=target_file.blocks, 
+                                ec_policy=target_file.ec_policy, replication=target_file.replication)
+        self.replica_removals.spawn(self.remove_replicas(forgotten))
+        return web.Response(text="Successfully converted file")
 
-                response["block_info"].append({"block_id": block_id, "datanode_id": choosed_datanodes, "block_size": curr_block_size})
+    async def remove_replicas(self, holders_by_block):
+        '''
+            asks the datanodes to drop the replicas of {block id: [holders]}, 
+            replicas that stay behind are removed with the next block report
+        '''
+        blocks_by_holder = {}
+        for block_id, holders in holders_by_block.items():
+            for datanode_id in holders:
+                blocks_by_holder.setdefault(datanode_id, []).append(block_id)
+        for datanode_id, block_ids in blocks_by_holder.items():
+            try:
+                async with self.datanode_sessions[datanode_id].post('/remove_bulk', json=block_ids) as resp:
+                    logging.info(f'{datanode_id}: {await resp.text()}')
+            except (KeyError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f'Could not remove blocks from {datanode_id}: {e!r}')
 
-            return web.Response(status=200, text=json.dumps(response))
+    async def allocate_container(self, req):
+        '''
+            route: /allocate_container
+            request body: {"size": int}
+            reserves a block that many small files are packed into
+            return: {"block_id": int, "datanode_id": [datanode ids], "block_size": int}
+        '''
+        req_body = await req.json()
+        container_size = req_body["size"]
+        if container_size > self.block_size:
+            return web.Response(status=400, text=f"Container larger than the block size {self.block_size}")
+        block_id = self.fstree.currBlockID
+        self.fstree.currBlockID += 1
+        choosed_datanodes, actual_replica_count = self.choose_datanodes(self.replication_factor)
+        if actual_replica_count == 0:
+            return web.Response(status=503, text="No live datanode can store the block")
+        await self.edit_log.log('allocate', last_block_id=self.fstree.currBlockID)
+        return web.Response(text=json.dumps({"block_id": block_id, 
+                                             "datanode_id": choosed_datanodes,
+                                             "block_size": container_size}))
 
+    async def put_packed(self, req):
+        '''
+            route: /put_packed
+            request body: {
+                "block_id": int, "datanode_id": [datanode ids that stored the container],
+                "files": [{"name": str, "path": str, "offset": int, "length": int}]
+            }
+            adds every file packed into a written container block, with a single 
+            edit log record. a file that cannot be added does not fail the others
+            return: {"stored": number of files added, "errors": [{"path", "name", "error"}]}
+        '''
+        req_body = await req.json()
+        block_id = req_body["block_id"]
+        stored, errors = [], []
+        for packed_file in req_body["files"]:
+            new_node = Inode(packed_file["name"], "FILE")
+            new_node.set_blocks([(block_id, packed_file["length"])])
+            new_node.set_block_offset(packed_file["offset"])
+            new_node.set_replication(self.replication_factor)
+            try:
+                self.fstree.insert(new_node, parse_path(packed_file["path"]))
+            except INodeError as e:
+                errors.append({"path": packed_file["path"], "name": packed_file["name"], "error": str(e)})
+                continue
+            stored.append([packed_file["path"], packed_file["name"], 
+                           packed_file["offset"], packed_file["length"]])
+        if stored:
+            self.block_mapping[block_id] = self.block_mapping.get(block_id, []) + req_body["datanode_id"]
+            self.container_files[block_id] = self.container_files.get(block_id, 0) + len(stored)
+            for written_datanode in req_body["datanode_id"]:
+                self.block_written(written_datanode)
+            await self.edit_log.log('put_packed', block_id=block_id, files=stored, 
+                                    replication=self.replication_factor)
+        return web.Response(text=json.dumps({"stored": len(stored), "errors": errors}))
 
+    def lease_response(self, lease):
+        node = lease.node
+        response = {"lease_id": lease.id, "full_block_size": self.block_size, "codec": node.codec}
+        if node.is_erasure_coded():
+            response["ec_policy"] = node.ec_policy
+        return web.Response(text=json.dumps(response))
 
-    async def put(self, req):
+    async def create(self, req):
         '''
-            route: /put
+            route: /create
             request body: {
                 "name": str,
-                "size": int,
                 "path": str,
-                "allocation: json response from allocate request
+                "codec": str, optional,
+                "ec_policy": str, optional, the directory's policy by default
+            }
+            creates an empty file under construction. its blocks are added one 
+            at a time with /add_block and committed by /complete, until then 
+            other clients see the file without them
+            return: {"lease_id", "full_block_size", "codec", 
+                     "ec_policy" if the file is erasure coded}
+        '''
+        req_body = await req.json()
+        name, path = req_body["name"], req_body["path"]
+        codec = req_body.get("codec", NO_CODEC)
+        try:
+            get_codec(codec)
+            parent_path = parse_path(path)
+            ec_policy = self.file_ec_policy(req_body, parent_path)
+            new_node = Inode(name, "FILE")
+            new_node.set_replication(1 if ec_policy != None else self.replication_factor)
+            new_node.set_codec(codec)
+            new_node.set_ec_policy(ec_policy)
+            self.fstree.insert(new_node, parent_path)
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        except ValueError as e:
+            return web.Response(status=400, text=str(e))
+        lease = self.leases.grant('/' + '/'.join(parent_path + [name]), new_node)
+        await self.edit_log.log('put', name=name, path=path, blocks=[], replication=new_node.replication, 
+                                codec=codec, ec_policy=ec_policy)
+        return self.lease_response(lease)
+
+    async def append(self, req):
+        '''
+            route: /append
+            request body: {"path": str}
+            opens an existing file for adding blocks after its last one, as 
+            for a file from /create. packed files cannot be appended to
+            return: as /create, with the codec and policy of the file
+        '''
+        req_body = await req.json()
+        path = req_body["path"]
+        try:
+            target_file = self.fstree.find(parse_path(path))
+            if target_file.node_type != "FILE":
+                raise INodeError("Cannot append to a directory", 405)
+            if target_file.is_packed():
+                raise INodeError("Cannot append to a packed file", 405)
+            lease = self.leases.grant(path, target_file)
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        return self.lease_response(lease)
+
+    def writer_lease(self, req_body):
+        '''
+            the renewed lease of a writer's request, with the blocks the 
+            writer reports written taken in
+        '''
+        lease = self.leases.get(req_body["lease_id"])
+        if lease.node.parent == None:
+            self.drop_lease(lease)
+            raise INodeError("File was removed while being written", 404)
+        lease.report_written(req_body.get("written", []))
+        return lease
+
+    async def add_block(self, req):
+        '''
+            route: /add_block
+            request body: {
+                "lease_id": str,
+                "size": bytes of the block,
+                "written": [blocks written since the last call, as allocated but 
+                            with "datanode_id" (of each unit) the datanodes that 
+                            stored it, and "stored_size" if compressed]
             }
+            allocates the next block of a file under construction
+            return: the block, as in the block_info of /allocate
+        '''
+        req_body = await req.json()
+        try:
+            lease = self.writer_lease(req_body)
+            size = int(req_body["size"])
+            if not 0 < size <= self.block_size:
+                raise INodeError(f"Block size must be between 1 and {self.block_size}", 400)
+            node = lease.node
+            block = self.allocate_file_block(size, get_policy(node.ec_policy) if node.is_erasure_coded() else None)
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        except (KeyError, TypeError, ValueError) as e:
+            return web.Response(status=400, text=f"Invalid request: {e!r}")
+        lease.blocks.append(block)
+        await self.edit_log.log('allocate', last_block_id=self.fstree.currBlockID)
+        return web.Response(text=json.dumps(block))
+
+    async def complete(self, req):
+        '''
+            route: /complete
+            request body: {"lease_id": str, "written": as for /add_block}
+            adds the blocks of a file under construction to it once all of 
+            them are written, and releases the lease
             return: Success
         '''
         req_body = await req.json()
-        item_name = req_body["name"]
-        item_size = req_body["size"]
-        path_to_put = req_body["path"]
-        allocation = req_body["allocation"]
-        block_count = allocation["block_count"]
-        block_info = allocation["block_info"]
-        
-        parent_path = parse_path(path_to_put)
-        new_node = Inode(item_name, "FILE")
+        try:
+            lease = self.writer_lease(req_body)
+            if len(lease.written) < len(lease.blocks):
+                raise INodeError(f"{len(lease.blocks) - len(lease.written)} blocks are not written yet", 400)
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        except (KeyError, TypeError) as e:
+            return web.Response(status=400, text=f"Invalid request: {e!r}")
+        await self.commit_lease(lease)
+        return web.Response(text="Successfully put file")
 
-        for block in block_info:
-            block_id = block["block_id"]
-            datanode_id = block["datanode_id"]
-            block_size = block["block_size"]
-            self.block_mapping[block_id] = self.block_mapping.get(block_id, []) + datanode_id
+    async def renew_lease(self, req):
+        '''
+            route: /renew_lease
+            request body: {"lease_id": str}
+            a writer that sends no other request renews its lease with this 
+            more often than every LEASE_EXPIRY seconds
+        '''
+        try:
+            self.writer_lease(await req.json())
+        except INodeError as e:
+            return web.Response(status=e.error_code, text=str(e))
+        except (KeyError, TypeError) as e:
+            return web.Response(status=400, text=f"Invalid request: {e!r}")
+        return web.Response(text="ok")
 
-            new_node.blocks.append((block_id, block_size))
-        new_node.set_replication(self.replication_factor)
+    async def commit_lease(self, lease):
+        '''
+            releases a lease and adds its written blocks to the file, up to the 
+            first block that was not written. replicas of the blocks after it 
+            are removed
+        '''
+        self.leases.release(lease)
+        committed = lease.written_prefix()
+        node = lease.node
+        if committed:
+            blocks = self.blocks_from_allocation(committed)
+            self.fstree.replace_blocks(node, node.blocks + blocks)
+            self.map_written_blocks(committed)
+            if node.is_erasure_coded():
+                self.register_units(node)
+            await self.edit_log.log('append', path=lease.path, blocks=blocks)
+        if len(committed) < len(lease.blocks):
+            self.replica_removals.spawn(self.remove_replicas(allocated_replicas(lease.blocks[len(committed):])))
+
+    def drop_lease(self, lease):
+        '''
+            releases a lease without keeping any of its blocks
+        '''
+        self.leases.release(lease)
+        self.replica_removals.spawn(self.remove_replicas(allocated_replicas(lease.blocks)))
+
+    async def recover_lease(self, lease):
+        '''
+            the writer of a file under construction stopped renewing its lease: 
+            the file keeps the blocks written up to that point, like on /complete
+        '''
+        if lease.node.parent == None:
+            self.drop_lease(lease)
+            return
+        await self.commit_lease(lease)
+
+    def save_fsimage(self):
+        self.fstree.save_fs_to_binary_fsimage(f"{self.fsimage_path}.tmp")
+        os.replace(f"{self.fsimage_path}.tmp", self.fsimage_path)
 
-        self.fstree.insert(new_node, parent_path)
-        return web.Response(status=200, text="Successfully put file")
-            
-            
     def close_server(self):
-        self.fstree.save_fs_to_fsimage(self.fsimage_path)
-        logging.info('Namenode metadata saved to fsimage.xml')
+        self.fstree.lastTxID = self.edit_log.txid
+        self.save_fsimage()
+        # everything in the edit log is now part of the fsimage
+        for path_to_edits in (self.rolled_edits_path, self.edits_path):
+            if os.path.exists(path_to_edits):
+                os.remove(path_to_edits)
+        logging.info('Namenode metadata saved to fsimage.bin')
 
 def run_namenode(*args):
     namenode_instance = NameNode(*args)
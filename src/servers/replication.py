@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+import aiohttp
+from .erasure import get_policy
+from .tasks import BackgroundTasks
+
+# seconds between two scans for dead or revived datanodes
+REPLICATION_CHECK_INTERVAL = 5
+# block copies in progress at the same time, so recovery leaves room for client I/O
+MAX_CONCURRENT_REPLICATIONS = 2
+# seconds before a failed block copy is tried again
+REPLICATION_RETRY_DELAY = 10
+# recovery rate is averaged over this many seconds
+RECOVERY_RATE_WINDOW = 60
+
+
+class ReplicationManager:
+    '''
+        restores the replication factor of blocks that lost replicas to dead
+        datanodes. under-replicated blocks wait in a priority queue, fewest
+        live replicas first, and are copied by a surviving datanode directly
+        to a new target, at most MAX_CONCURRENT_REPLICATIONS at a time. a
+        lost unit of an erasure coded block group is rebuilt by the new
+        target from the surviving units of its group instead
+    '''
+    def __init__(self, namenode):
+        self.namenode = namenode
+        # heap of (live replicas, sequence, block id)
+        self.queue = []
+        self.queued = set()
+        self.sequence = 0
+        self.dead_datanodes = set()
+        # datanodes seen alive so far, a new one can take the replicas missing for lack of nodes
+        self.known_datanodes = set()
+        # whether the block mapping was scanned once after the startup block reports
+        self.scanned = False
+        self.in_flight = 0
+        self.recovered = 0
+        self.failed = 0
+        self.recovery_times = deque()
+        self.has_work = None
+        self.copy_slots = None
+        # block copies and rebuilds in progress
+        self.replications = BackgroundTasks()
+
+    def live_replicas(self, block_id):
+        live = self.namenode.live_datanodes()
+        return [d for d in self.namenode.block_mapping.get(block_id, []) if d in live]
+
+    def enqueue(self, block_id):
+        live_count = len(self.live_replicas(block_id))
+        if block_id in self.queued or live_count >= self.namenode.replication_target(block_id):
+            return
+        if live_count == 0 and block_id not in self.namenode.ec_units:
+            logging.warning(f"block {block_id} has no live replica left")
+            return
+        self.sequence += 1
+        heapq.heappush(self.queue, (live_count, self.sequence, block_id))
+        self.queued.add(block_id)
+        self.has_work.set()
+
+    def enqueue_all(self):
+        for block_id in self.namenode.block_mapping:
+            self.enqueue(block_id)
+
+    def datanode_died(self, datanode_id):
+        logging.warning(f"datanode {datanode_id} is dead, re-replicating its blocks")
+        for block_id, holders in self.namenode.block_mapping.items():
+            if datanode_id in holders:
+                holders.remove(datanode_id)
+                self.enqueue(block_id)
+
+    async def monitor_forever(self):
+        while True:
+            await asyncio.sleep(REPLICATION_CHECK_INTERVAL)
+            if not self.scanned and not self.namenode.safe_mode:
+                self.enqueue_all()
+                self.scanned = True
+            live = self.namenode.live_datanodes()
+            joined = False
+            for datanode_id in list(self.namenode.datanode_stats):
+                if datanode_id not in live and datanode_id not in self.dead_datanodes:
+                    self.dead_datanodes.add(datanode_id)
+                    self.datanode_died(datanode_id)
+                elif datanode_id in live and datanode_id in self.dead_datanodes:
+                    # its blocks were dropped from the mapping, learn them again
+                    self.dead_datanodes.discard(datanode_id)
+                    logging.info(f"datanode {datanode_id} is back")
+                    await self.namenode.collect_block_report(datanode_id)
+                    joined = True
+                elif datanode_id in live and datanode_id not in self.known_datanodes:
+                    joined = True
+                self.known_datanodes.add(datanode_id)
+            if joined and self.scanned:
+                self.enqueue_all()
+
+    async def replicate_forever(self):
+        self.has_work = asyncio.Event()
+        self.copy_slots = asyncio.Semaphore(MAX_CONCURRENT_REPLICATIONS)
+        monitor = asyncio.create_task(self.monitor_forever())
+        try:
+            while True:
+                if not self.queue:
+                    self.has_work.clear()
+                    await self.has_work.wait()
+                    continue
+                await self.copy_slots.acquire()
+                _, _, block_id = heapq.heappop(self.queue)
+                self.queued.discard(block_id)
+                self.replications.spawn(self.replicate(block_id))
+        finally:
+            monitor.cancel()
+
+    async def replicate(self, block_id):
+        self.in_flight += 1
+        try:
+            sources = self.live_replicas(block_id)
+            if len(sources) >= self.namenode.replication_target(block_id):
+                return
+            if sources:
+                target = await self.copy(block_id, sources[0])
+            elif block_id in self.namenode.ec_units:
+                target = await self.reconstruct(block_id)
+            else:
+                return
+            if target == None:
+                # enqueue_all picks it up again once a datanode joins or comes back
+                return
+            self.namenode.block_written(target)
+            if block_id in self.namenode.block_mapping and target not in self.namenode.block_mapping[block_id]:
+                self.namenode.block_mapping[block_id].append(target)
+            self.recovered += 1
+            self.recovery_times.append(time.monotonic())
+            # still short of the target replication, go around once more
+            self.enqueue(block_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failed += 1
+            logging.warning(f"re-replication of block {block_id} failed: {e!r}")
+            asyncio.get_running_loop().call_later(REPLICATION_RETRY_DELAY, self.enqueue, block_id)
+        finally:
+            self.in_flight -= 1
+            self.copy_slots.release()
+
+    async def post(self, datanode_id, route, body):
+        session = self.namenode.datanode_sessions[datanode_id]
+        async with session.post(route, json=body) as resp:
+            resp_text = await resp.text()
+            if resp.status != 200:
+                raise aiohttp.ClientResponseError(resp.request_info, (), status=resp.status,
+                                                  message=resp_text)
+
+    async def copy(self, block_id, source):
+        '''
+            has source copy the block to a live datanode without a replica of 
+            it, returns that datanode, None if there is none
+        '''
+        targets = self.namenode.choose_replication_target(exclude=self.namenode.block_mapping[block_id])
+        if not targets:
+            return None
+        await self.post(source, '/replicate', {"block_id": block_id, "target": targets[0]})
+        logging.info(f"block {block_id} copied from {source} to {targets[0]}")
+        return targets[0]
+
+    async def reconstruct(self, unit_id):
+        '''
+            has a live datanode holding no other unit of its block group rebuild 
+            a lost unit from the surviving units of the group. returns that 
+            datanode, None if there is none or too few units survived
+        '''
+        group_id, ec_policy, block_size = self.namenode.ec_units[unit_id]
+        policy = get_policy(ec_policy)
+        group = range(group_id, group_id + policy.width)
+        sources = {other_id: self.live_replicas(other_id) for other_id in group if other_id != unit_id}
+        sources = {other_id: holders for other_id, holders in sources.items() if holders}
+        if len(sources) < policy.data_units:
+            logging.error(f"unit {unit_id} cannot be rebuilt, block group {group_id} kept "
+                          f"{len(sources)} of the {policy.data_units} units needed")
+            return None
+        group_holders = [d for other_id in group for d in self.namenode.block_mapping.get(other_id, [])]
+        # two units on one datanode could be lost together, wait for a datanode to join instead
+        targets = self.namenode.choose_replication_target(exclude=group_holders)
+        if not targets:
+            return None
+        await self.post(targets[0], '/reconstruct', {"block_id": unit_id, "group_id": group_id, 
+                                                     "ec_policy": ec_policy, "block_size": block_size,
+                                                     "sources": sources})
+        logging.info(f"unit {unit_id} of block group {group_id} rebuilt on {targets[0]}")
+        return targets[0]
+
+    def status(self):
+        now = time.monotonic()
+        while self.recovery_times and now - self.recovery_times[0] > RECOVERY_RATE_WINDOW:
+            self.recovery_times.popleft()
+        return {
+            "queue_depth": len(self.queue),
+            "in_flight": self.in_flight,
+            "recovered": self.recovered,
+            "failed": self.failed,
+            "recovery_rate": len(self.recovery_times) / RECOVERY_RATE_WINDOW,
+            "dead_datanodes": sorted(self.dead_datanodes)
+        }
@@ -0,0 +1,24 @@
+import asyncio
+import logging
+
+
+class BackgroundTasks:
+    '''
+        tasks started without anyone awaiting them, e.g. replica removals
+        answered before they finish. the event loop only keeps weak
+        references to tasks, so they are held here until done, and their
+        failures are logged instead of lost
+    '''
+    def __init__(self):
+        self.tasks = set()
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.done)
+        return task
+
+    def done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() != None:
+            logging.error(f"background task {task.get_coro().__qualname__} failed: {task.exception()!r}")
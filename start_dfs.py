@@ -37,7 +37,8 @@ if __name__ == "__main__":
                 args=(*namenode_info, datanodes_info, homepath))
     datanodes_proc = []
     for node_info in datanodes_info['nodes']:
-        p_d = Process(target=dn.run_datanode, args=(*node_info, datanodes_info['storage'].text, homepath))
+        p_d = Process(target=dn.run_datanode, args=(*node_info, datanodes_info['storage'].text, homepath, 
+                                                        datanodes_info['nodes'], namenode_info[:2]))
         datanodes_proc.append(p_d)
         #dn.run_datanode(*node_info, datanodes_info['storage'], homepath)
 
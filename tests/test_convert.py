@@ -0,0 +1,57 @@
+'''
+    converting a file whose blocks are not all full (an appended file has a
+    partial block in the middle) must lay the block groups out with the
+    sizes of the blocks they replace
+'''
+import asyncio
+import os
+import sys
+
+homepath = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, homepath)
+from src.FSTree.FSTree import Inode
+from src.servers.namenode import NameNode
+
+BLOCK_SIZE = 1048576
+# a 300 KB put followed by an -append of 1 MB
+APPENDED_BLOCKS = [(10, 300000), (11, BLOCK_SIZE)]
+
+
+class JsonRequest:
+    def __init__(self, body):
+        self.body = body
+
+    async def json(self):
+        return self.body
+
+
+def make_namenode(tmp_path):
+    datanodes = {'nodes': [(f'datanode_{i}', '127.0.0.1', 11000 + i) for i in range(1, 6)]}
+    namenode = NameNode('127.0.0.1', 11000, BLOCK_SIZE, 3, datanodes, str(tmp_path))
+    root = Inode("", "DIRECTORY")
+    root.set_id(0)
+    namenode.fstree.set_root(root)
+    namenode.fstree.initialize(1, 1, 100)
+    appended = Inode("conv", "FILE")
+    appended.set_blocks(APPENDED_BLOCKS)
+    namenode.fstree.insert(appended, [])
+    return namenode
+
+
+def test_replace_allocation_keeps_block_sizes(tmp_path):
+    namenode = make_namenode(tmp_path)
+    request = {"name": "conv", "path": "/", "size": 300000 + BLOCK_SIZE,
+               "ec_policy": "rs-3-2", "replace": True}
+    allocation, _, _ = namenode.apply_allocate(request)
+    assert [block["block_size"] for block in allocation["block_info"]] == [300000, BLOCK_SIZE]
+
+
+def test_convert_rejects_reordered_block_sizes(tmp_path):
+    namenode = make_namenode(tmp_path)
+    allocation = {"ec_policy": "rs-3-2", "block_info": [
+        {"block_id": 100, "block_size": BLOCK_SIZE, "units": []},
+        {"block_id": 105, "block_size": 300000, "units": []}]}
+    request = JsonRequest({"path": "/conv", "source_blocks": [10, 11], "allocation": allocation})
+    resp = asyncio.run(namenode.convert(request))
+    assert resp.status == 409
+    assert namenode.fstree.find(["conv"]).blocks == APPENDED_BLOCKS
@@ -2,17 +2,100 @@
 import os, sys
 import asyncio
 from quart import Quart, render_template, request, redirect, url_for, send_from_directory, jsonify
-from io import BytesIO
 from quart import Response
 import shutil
-from edfs import EdfsClient, get_config
+from edfs import EdfsClient, EdfsClientError, BlockCache, TRANSFER_CHUNK_SIZE
 import logging
 import json
 from urllib.parse import quote_plus as urlquote
 from urllib.parse import unquote_plus as urlunquote
 
+# bytes of a streamed upload received but not yet read before the connection stops reading
+UPLOAD_BUFFER_SIZE = 1024*1024
+# blocks every upload or download holds in memory at most
+WEB_INFLIGHT_BLOCKS = 2
+# entries shown on one page of a folder
+WEB_LS_PAGE_SIZE = 100
+
+
+class ReceiveWindow:
+    '''
+        holds back the ASGI receive of a streamed upload while 
+        UPLOAD_BUFFER_SIZE bytes of it wait to be read from request.body, so a 
+        client faster than the datanodes is slowed down by its connection 
+        instead of buffered in memory
+    '''
+    def __init__(self, receive):
+        self.receive_message = receive
+        self.pending = 0
+        self.drained = asyncio.Event()
+
+    async def receive(self):
+        while self.pending >= UPLOAD_BUFFER_SIZE:
+            self.drained.clear()
+            await self.drained.wait()
+        message = await self.receive_message()
+        if message["type"] == "http.request":
+            self.pending += len(message.get("body", b""))
+        return message
+
+    def consumed(self, nbytes):
+        self.pending -= nbytes
+        self.drained.set()
+
+
+class UploadStreamMiddleware:
+    '''
+        gives requests to /upload_stream a ReceiveWindow, found in 
+        request.scope["receive_window"]
+    '''
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/upload_stream":
+            window = ReceiveWindow(receive)
+            scope["receive_window"] = window
+            receive = window.receive
+        await self.asgi_app(scope, receive, send)
+
+
+class RequestBodyReader:
+    '''
+        read(n) over a request body that is iterated as it arrives, for 
+        put_single_file. the body may not bring more than limit bytes
+    '''
+    def __init__(self, body, limit, window=None):
+        self.chunks = body.__aiter__()
+        self.rest = b""
+        self.limit = limit
+        self.received = 0
+        self.window = window
+
+    async def read(self, n):
+        pieces, size = [self.rest], len(self.rest)
+        while size < n:
+            try:
+                chunk = await self.chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            self.received += len(chunk)
+            if self.window:
+                self.window.consumed(len(chunk))
+            if self.received > self.limit:
+                raise EdfsClientError(f"Request body is longer than {self.limit} bytes", 413)
+            pieces.append(chunk)
+            size += len(chunk)
+        # split the last piece instead of the joined block, which is copied only once
+        overflow = max(size - n, 0)
+        last = pieces[-1]
+        pieces[-1], self.rest = last[:len(last) - overflow], last[len(last) - overflow:]
+        return b"".join(pieces)
+
+
 app = Quart(__name__)
 app.config.from_object(f"conf.Config.Config")
+app.asgi_app = UploadStreamMiddleware(app.asgi_app)
 homepath = os.path.dirname(os.path.realpath(__file__))
 
 def get_parent(unquoted_url):
@@ -23,6 +106,49 @@ def get_parent(unquoted_url):
 def join_url(a, b):
     return (a if a != '/' else '') + '/' + b
 
+def BKMG(size):
+    if size < 1024:
+        return str(size) + "B"
+    elif size < 1024*1024:
+        return str(size//1024) + "KB"
+    elif size < 1024*1024*1024:
+        return str(size//(1024*1024)) + "MB"
+    return str(size//(1024*1024*1024)) + "GB"
+
+async def render_folder(unquoted_path):
+    '''
+        renders one page of the folder, the page after the cursor in the 
+        request's query string. entries come in summary form, without block lists
+    '''
+    cursor = request.args.get("cursor")
+    try:
+        folder_contents, next_cursor = await app.client.ls_page(unquoted_path, cursor, WEB_LS_PAGE_SIZE, 
+                                                                summary=True)
+    except EdfsClientError as e:
+        if e.error_code == 410:
+            # the listing expired, start it again
+            if unquoted_path == '/':
+                return redirect(url_for('index'))
+            return redirect(url_for('folder_contents', item_path=urlquote(unquoted_path)))
+        return str(e), e.error_code
+    existing_files = [
+        {
+            "name": file['name'],
+            "type": file['type'],
+            "block_num": file["block_count"] if file["type"] == "FILE" else None,
+            # erasure coded files show their policy instead of a replica count
+            "replication": file["ec_policy"] or file["replication"],
+            "codec": file["codec"],
+            "total_size": BKMG(file["size"]) if file["size"] != None else None,
+            "path": urlquote(join_url(unquoted_path, file["name"]))
+        }
+        for file in folder_contents
+    ]
+    return await render_template(
+        "index_new.html", existing_files=existing_files, folder_name=urlquote(unquoted_path), 
+        next_cursor=next_cursor, paged=cursor != None
+    )
+
 @app.route('/list_folder/<folder_name>')
 async def list_folder(folder_name):
     print(folder_name)
@@ -73,37 +199,7 @@ async def delete_item(item_path):
 
 @app.route('/')
 async def index(path=""):
-    code, resp = await app.client.handle_user_request("ls_html", ['/'])
-    def BKMG(size):
-        if size < 1024:
-            return str(size) + "B"
-        elif size > 1024 and size<1024*1024:
-            return str(int(size/1024)) + "KB"
-        elif size > 1024*1024 and size<1024*1024*1024:
-            return str(size//(1024*1024)) + "MB"
-    
-    folder_contents = json.loads(resp)
-    print(folder_contents)
-
-    namenode_info, datanode_info = get_config(homepath)
-    saving_path = datanode_info['storage']
-
-    existing_files = [
-        {
-            "name": file['name'],
-            "type": file['type'],
-            "block_num": len(file["blocks"]) if file["blocks"] else None,
-            "block_id_1": [(saving_path.text+"/datanode_1/" + str(block[0]) + "-r0", BKMG(block[1])) for block in file["blocks"]] if file["blocks"] else None,
-            "block_id_2": [(saving_path.text+"/datanode_1/" + str(block[0]) + "-r1", BKMG(block[1])) for block in file["blocks"]] if file[
-                "blocks"] else None,
-            "block_size": [block[1] for block in file["blocks"]] if isinstance(file["blocks"], list) else None,
-            "total_size": BKMG(sum([block[1] for block in file["blocks"]] if isinstance(file["blocks"], list) else [])),
-            "path": urlquote("/" + file['name'])
-        }
-        for file in folder_contents
-    ]
-    logging.info(existing_files)
-    return await render_template("index_new.html", existing_files=existing_files, folder_name=urlquote("/"))
+    return await render_folder('/')
 
 @app.route('/parent/<item_path>')
 async def parent(item_path):
@@ -117,43 +213,21 @@ async def folder_contents(item_path):
     unquoted_path = urlunquote(item_path)
     if unquoted_path == '/':
         return redirect('/')
-    code, resp = await app.client.handle_user_request("ls_html", [unquoted_path])
-    if code != 200:
-        return resp, code
-    def BKMG(size):
-        if size < 1024:
-            return str(size) + "B"
-        elif size > 1024 and size<1024*1024:
-            return str(int(size/1024)) + "KB"
-        elif size > 1024*1024 and size<1024*1024*1024:
-            return str(int(size/(1024*1024))) + "MB"
-    logging.info(resp)
-    folder_contents = json.loads(resp)
-
-    namenode_info, datanode_info = get_config(homepath)
-    saving_path = datanode_info['storage']
+    return await render_folder(unquoted_path)
 
-    existing_files = [
-        {
-            "name": file['name'],
-            "type": file['type'],
-            "block_num": len(file["blocks"]) if file["blocks"] else None,
-            "block_id_1": [(saving_path.text+"/datanode_1/" + str(block[0]) + "-r0", BKMG(block[1])) for block in file["blocks"]] if file["blocks"] else None,
-            "block_id_2": [(saving_path.text+"/datanode_1/" + str(block[0]) + "-r1", BKMG(block[1])) for block in file["blocks"]] if file[
-                "blocks"] else None,
-            "block_size": [block[1] for block in file["blocks"]] if isinstance(file["blocks"], list) else None,
-            "total_size": BKMG(sum([block[1] for block in file["blocks"]] if isinstance(file["blocks"], list) else [])),
-            "path": urlquote(join_url(unquoted_path, file["name"]))  
-        }
-        for file in folder_contents
-    ]
-    return await render_template(
-        "index_new.html", existing_files=existing_files, folder_name=item_path
-    )
+@app.before_request
+async def limit_body():
+    # bodies other than streamed uploads are held in memory whole, e.g. a form upload 
+    # spooled to a temporary file; larger files go through /upload_stream
+    if request.endpoint == "upload_stream" or request.method in ("GET", "HEAD"):
+        return
+    if request.content_length == None and "Transfer-Encoding" in request.headers:
+        return "Content-Length is required", 411
+    if request.content_length and request.content_length > app.config["MAX_BODY_LENGTH"]:
+        return "Request body too large, put large files through /upload_stream", 413
 
 @app.route('/upload', methods=['POST'])
 async def upload_file():
-    
     file = (await request.files).get('file')
     path = (await request.form).get("path", "/")
     unquoted_folder_path = urlunquote(path)
@@ -168,23 +242,64 @@ async def upload_file():
 
     return "Invalid file or filename", 400
 
+@app.route('/upload_stream', methods=['PUT'])
+async def upload_stream():
+    '''
+        puts the request body as file name into folder path (query 
+        parameters), reading it block by block as the blocks are written
+    '''
+    name = request.args.get("name")
+    path = urlunquote(request.args.get("path", "/"))
+    if not name:
+        return "Invalid file or filename", 400
+    if request.content_length == None:
+        return "Content-Length is required", 411
+    code, resp = await app.client.put_single_file(name, path, 
+                                                  RequestBodyReader(request.body, request.content_length,
+                                                                    request.scope.get("receive_window")),
+                                                  src_size=request.content_length)
+    return resp, code
+
 @app.route('/download/<item_path>')
 async def download_file(item_path):
     unquoted_path = urlunquote(item_path)
-    code, resp = await app.client.handle_user_request("get", 
-                                            [unquoted_path])
-    if code != 200:
-        return code, resp
+    try:
+        located = await app.client.locate(unquoted_path)
+    except EdfsClientError as e:
+        return str(e), e.error_code
+
+    async def stream_blocks():
+        # iter_file fetches WEB_INFLIGHT_BLOCKS blocks ahead and waits while 
+        # the browser is slower, as every yield waits for the send to drain.
+        # it reads the blocks located for the Content-Length, not a second lookup
+        async for content in app.client.iter_file(unquoted_path, located=located):
+            for start in range(0, len(content), TRANSFER_CHUNK_SIZE):
+                yield content[start:start + TRANSFER_CHUNK_SIZE]
+
     filename = unquoted_path.split('/')[-1]
-    file_storage = BytesIO(resp)
-    response = Response(file_storage, content_type='application/octet-stream')
+    response = Response(stream_blocks(), content_type='application/octet-stream')
     response.headers.set('Content-Disposition', 'attachment', filename=filename)
-
+    response.headers.set('Content-Length', str(sum(block["num_bytes"] for block in located[0])))
+    # a large download may take longer than RESPONSE_TIMEOUT
+    response.timeout = None
     return response
 
+@app.route('/cache_stats')
+async def cache_stats():
+    return jsonify(app.client.location_cache.stats())
+
+@app.route('/block_cache_stats')
+async def block_cache_stats():
+    if app.client.block_cache == None:
+        return "Block cache is not enabled", 404
+    return jsonify(app.client.block_cache.stats())
+
 @app.before_serving
 async def startup():
-    app.client = EdfsClient()
+    block_cache = None
+    if app.config["BLOCK_CACHE_DIR"]:
+        block_cache = BlockCache(app.config["BLOCK_CACHE_DIR"], app.config["BLOCK_CACHE_SIZE"])
+    app.client = EdfsClient(max_inflight_blocks=WEB_INFLIGHT_BLOCKS, block_cache=block_cache)
     await app.client.initialize()
 
 if __name__ == '__main__':